@@ -22,11 +22,31 @@
 from .mln.base import MLN
 from .mln.database import Database
 from .mln.constants import *
-from .mlnlearn import MLNLearn
-from .mlnlearn import MLNLearn as learn
-from .mlnquery import MLNQuery
-from .mlnquery import MLNQuery as query
-from .mlnlearn import QUERY_PREDS
-from .mlnlearn import EVIDENCE_PREDS
-from .utils.project import mlnpath
-from .utils.project import PRACMLNConfig
\ No newline at end of file
+from importlib import import_module
+
+# the members that are not imported from their modules before they are
+# accessed, since the tools and their GUIs pull in tkinter, scipy and all
+# learning and inference methods (see PEP 562)
+_lazy = {
+    'MLNLearn': ('.mlnlearn', 'MLNLearn'),
+    'learn': ('.mlnlearn', 'MLNLearn'),
+    'MLNQuery': ('.mlnquery', 'MLNQuery'),
+    'query': ('.mlnquery', 'MLNQuery'),
+    'QUERY_PREDS': ('.mlnlearn', 'QUERY_PREDS'),
+    'EVIDENCE_PREDS': ('.mlnlearn', 'EVIDENCE_PREDS'),
+    'mlnpath': ('.utils.project', 'mlnpath'),
+    'PRACMLNConfig': ('.utils.project', 'PRACMLNConfig'),
+}
+
+
+def __getattr__(name):
+    if name not in _lazy:
+        raise AttributeError('module %s has no attribute %s' % (__name__, name))
+    module, member = _lazy[name]
+    value = getattr(import_module(module, __name__), member)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_lazy))
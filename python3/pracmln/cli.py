@@ -0,0 +1,163 @@
+# Markov Logic Networks -- Command Line Interface
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+Headless command line interface to learning and inference.
+
+In contrast to the `mlnquery` and `mlnlearn` tools, it does neither
+need a display nor import tkinter, and the learning and inference
+methods are only imported when they are used.
+
+:Example:
+
+$ pracmln query -i smokers.pracmln:smoking.mln -e smokers.pracmln:smoking-test.db \\
+      -q Cancer -m MC-SAT -p "maxsteps=1000"
+$ pracmln learn -i smokers.pracmln:smoking.mln -t smokers.pracmln:smoking-train.db \\
+      -m BPLL -o learnt.mln
+'''
+import sys
+import argparse
+
+from dnutils import logs
+
+from .mln.base import MLN
+from .mln.database import Database
+from .mln.constants import ALL
+from .mln.methods import InferenceMethods, LearningMethods
+from .mln.util import parse_queries
+from .utils import tracing
+
+
+logger = logs.getlogger(__name__)
+
+
+def _params(args):
+    # the additional parameters of a method are given as in the GUIs, e.g. "maxsteps=100,chains=2"
+    params = eval('dict(%s)' % (args.params or ''))
+    params['verbose'] = args.verbose
+    params['multicore'] = args.multicore
+    return params
+
+
+def _output(args):
+    if args.output is None:
+        return sys.stdout
+    return open(args.output, 'w')
+
+
+def query(args):
+    '''
+    Runs the inference on every database of the evidence files and writes
+    the results.
+    '''
+    mln = MLN.load(args.mln, logic=args.logic, grammar=args.grammar)
+    dbs = Database.load(mln, args.evidence) if args.evidence else [Database(mln)]
+    method = InferenceMethods.clazz(args.method)
+    params = _params(args)
+    params['cw'] = args.cw
+    stream = _output(args)
+    try:
+        for i, db in enumerate(dbs):
+            mrf = mln.materialize(db).ground(db)
+            queries = parse_queries(mrf.mln, args.queries) if args.queries else ALL
+            inference = method(mrf, queries, **params).run()
+            if len(dbs) > 1:
+                stream.write('%s database %d:\n' % ('' if i == 0 else '\n', i + 1))
+            inference.write(stream)
+            if args.verbose:
+                inference.write_elapsed_time(stream)
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+
+
+def learn(args):
+    '''
+    Learns the weights of the MLN from the training databases and writes
+    the learnt MLN.
+    '''
+    mln = MLN.load(args.mln, logic=args.logic, grammar=args.grammar)
+    dbs = Database.load(mln, args.training)
+    learnt = mln.learn(dbs, LearningMethods.clazz(args.method), **_params(args))
+    stream = _output(args)
+    try:
+        learnt.write(stream, color=False)
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+
+
+def methods(args):
+    '''
+    Lists the learning and inference methods.
+    '''
+    for title, enum in (('inference methods', InferenceMethods), ('learning methods', LearningMethods)):
+        print('%s:' % title)
+        for id_ in enum.ids():
+            print('  %-18s %s' % (id_, enum.name(id_)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='PRACMLN Command Line Interface')
+    parser.add_argument('--trace', dest='tracefile', help='a file the tracing records are appended to as JSON lines', metavar='FILE')
+    parser.add_argument('--debug', default='WARNING', help='the log level, e.g. INFO or DEBUG')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-i', '--mln', required=True, help='the MLN file, e.g. project.pracmln:model.mln', metavar='FILE')
+    common.add_argument('-p', '--params', help='additional parameters of the method, e.g. "maxsteps=100,chains=2"')
+    common.add_argument('-o', '--output', help='the output file, stdout by default', metavar='FILE')
+    common.add_argument('--logic', default='FirstOrderLogic', help='FirstOrderLogic or FuzzyLogic')
+    common.add_argument('--grammar', default='PRACGrammar', help='PRACGrammar or StandardGrammar')
+    common.add_argument('--multicore', action='store_true', default=False, help='use all CPU cores')
+    common.add_argument('-v', '--verbose', action='store_true', default=False)
+
+    cmd = commands.add_parser('query', parents=[common], help='run the inference')
+    cmd.add_argument('-e', '--evidence', help='the evidence database file', metavar='FILE')
+    cmd.add_argument('-q', '--queries', help='queries (comma-separated), all atoms without evidence by default')
+    cmd.add_argument('-m', '--method', default='MCSAT', help='the inference method (see "pracmln methods")')
+    cmd.add_argument('--cw', action='store_true', default=False, help='apply the closed-world assumption to the evidence')
+    cmd.set_defaults(func=query)
+
+    cmd = commands.add_parser('learn', parents=[common], help='learn the weights of an MLN')
+    cmd.add_argument('-t', '--training', required=True, nargs='+', help='the training database files', metavar='FILE')
+    cmd.add_argument('-m', '--method', default='BPLL', help='the learning method (see "pracmln methods")')
+    cmd.set_defaults(func=learn)
+
+    cmd = commands.add_parser('methods', help='list the learning and inference methods')
+    cmd.set_defaults(func=methods)
+
+    args = parser.parse_args(argv)
+    logger.level = eval('logs.%s' % args.debug.upper())
+    exporter = None
+    if args.tracefile:
+        exporter = tracing.JSONLinesExporter(args.tracefile)
+        tracing.addlistener(exporter)
+    try:
+        args.func(args)
+    finally:
+        if exporter is not None:
+            tracing.removelistener(exporter)
+            exporter.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -27,7 +27,7 @@ from dnutils import logs, ifnone
 
 from .grammar import StandardGrammar, PRACGrammar
 from ..mln.util import fstr, dict_union, colorize
-from ..mln.errors import NoSuchDomainError, NoSuchPredicateError
+from ..mln.errors import NoSuchDomainError, NoSuchPredicateError, FormulaCompilationError
 from ..mln.constants import HARD, predicate_color, inherit, auto
 from collections import defaultdict
 import itertools
@@ -81,7 +81,15 @@ class Logic(object):
     class Constraint(object):
         """
         Super class of every constraint.
+
+        Since millions of formulas are created during grounding, the logical
+        elements have `__slots__` instead of a `__dict__`. Their members are
+        declared by the classes in this module. The classes of the concrete
+        logics inherit from several of them and therefore must not add members
+        and declare empty `__slots__`.
         """
+
+        __slots__ = ()
         
         
         def template_variants(self, mln):
@@ -135,6 +143,8 @@ class Logic(object):
         """ 
         The base class for all logical formulas.
         """
+
+        __slots__ = ('_mln', '_idx')
         
         def __init__(self, mln=None, idx=None):
             self.mln = mln
@@ -395,10 +405,22 @@ class Logic(object):
                                if `False`, it can be greater or equal.
             :param unknown:    If `True`, also groundings with the truth value `None` are returned
             """
+            from .compiled import CompiledFormula
             if world is None:
                 world = list(mrf.evidence)
             if partial is None:
                 partial = {}
+            try:
+                compiled = CompiledFormula(self, mrf)
+            except FormulaCompilationError:
+                pass
+            else:
+                freevars = [(i, v) for i, (v, _) in enumerate(compiled.variables) if v not in partial]
+                for values, gnd in compiled.iterassignments(partial):
+                    truth = compiled.truth(world, gnd)
+                    if (truth is not None and ((truth >= truth_thr) if not strict else (truth > truth_thr))) or (truth is None and unknown):
+                        yield dict([(v, values[i]) for i, v in freevars])
+                return
             try:
                 variables = self.vardoms()
                 for var in partial:
@@ -614,6 +636,8 @@ class Logic(object):
         A formula that has other formulas as subelements (children)
         """
 
+        __slots__ = ('_children',)
+
         def __init__(self, mln, idx=None):
             Formula.__init__(self, mln, idx)
 
@@ -650,7 +674,10 @@ class Logic(object):
         def ground(self, mrf, assignment, simplify=False, partial=False):
             children = []
             for child in self.children:
-                gndchild = child.ground(mrf, assignment, simplify, partial)
+                if isinstance(child, Logic.Lit):
+                    gndchild = child.ground(mrf, assignment, simplify, partial, shared=True)
+                else:
+                    gndchild = child.ground(mrf, assignment, simplify, partial)
                 children.append(gndchild)
             gndformula = self.mln.logic.create(type(self), children, mln=self.mln, idx=self.idx)
             if simplify:
@@ -711,6 +738,8 @@ class Logic(object):
         Represents a logical conjunction.
         """
 
+        __slots__ = ()
+
 
         def __init__(self, children, mln, idx=None):
             Formula.__init__(self, mln, idx)
@@ -821,6 +850,8 @@ class Logic(object):
         Represents a disjunction of formulas.
         """
 
+        __slots__ = ()
+
 
         def __init__(self, children, mln, idx=None):
             Formula.__init__(self, mln, idx)
@@ -938,6 +969,8 @@ class Logic(object):
         Represents a literal.
         """
 
+        __slots__ = ('_negated', '_predname', '_args')
+
         def __init__(self, negated, predname, args, mln, idx=None):
             Formula.__init__(self, mln, idx)
             self.negated = negated
@@ -1035,7 +1068,13 @@ class Logic(object):
             return prednames
 
 
-        def ground(self, mrf, assignment, simplify=False, partial=False):
+        def ground(self, mrf, assignment, simplify=False, partial=False, shared=False):
+            """
+            :param shared:    if `True`, the ground literal shared by all ground formulas
+                              (see :meth:`Logic.GroundAtom.literal`) is returned. This is
+                              only allowed for the children of complex formulas, whose
+                              ground literals are never modified.
+            """
             args = [assignment.get(x, x) for x in self.args]
             if not any(map(self.mln.logic.isvar, args)):
                 atom = "%s(%s)" % (self.predname, ",".join(args))
@@ -1047,6 +1086,8 @@ class Logic(object):
                     truth = gndatom.truth(mrf.evidence)
                     if self.negated: truth = 1 - truth
                     return self.mln.logic.true_false(truth, mln=self.mln, idx=self.idx)
+                if shared and self.idx is None and self.negated in (True, False):
+                    return gndatom.literal(self.negated, self.mln)
                 gndformula = self.mln.logic.gnd_lit(gndatom, self.negated, mln=self.mln, idx=self.idx)
                 return gndformula
             else:
@@ -1117,6 +1158,8 @@ class Logic(object):
         Represents a group of literals with identical arguments.
         """
 
+        __slots__ = ('_negated', '_predname', '_args')
+
         def __init__(self, negated, predname, args, mln, idx=None):
             Formula.__init__(self, mln, idx)
             self.negated = negated
@@ -1233,7 +1276,7 @@ class Logic(object):
                 return [self.mln.logic.lit(self.negated, predname, self.args, mln=self.mln) for predname in self.predname]
 
         def copy(self, mln=None, idx=inherit):
-            return self.mln.logic.litgroup(self.negated, self.predname, self.args, mln=ifnone(mln, self.mln), idx=self.idx if idx is inherit else idx)
+            return self.mln.logic.litgroup(self.negated, list(self.predname), self.args, mln=ifnone(mln, self.mln), idx=self.idx if idx is inherit else idx)
 
 
         def truth(self, world):
@@ -1281,6 +1324,8 @@ class Logic(object):
         Represents a ground literal.
         """
 
+        __slots__ = ('_gndatom', '_negated')
+
 
         def __init__(self, gndatom, negated, mln, idx=None):
             Formula.__init__(self, mln, idx)
@@ -1317,6 +1362,16 @@ class Logic(object):
             return self.gndatom.args
 
 
+        @property
+        def shared(self):
+            """
+            Whether this is the ground literal shared by all ground formulas
+            (see :meth:`Logic.GroundAtom.literal`).
+            """
+            lits = self.gndatom._gndlits
+            return lits is not None and lits[self.negated] is self
+
+
         def truth(self, world):
             tv = self.gndatom.truth(world)
             if tv is None: return None
@@ -1393,6 +1448,8 @@ class Logic(object):
             truth = self.truth(world)
             if truth is not None:
                 return self.mln.logic.true_false(truth, mln=self.mln, idx=self.idx)
+            if self.shared:
+                return self
             return self.mln.logic.gnd_lit(self.gndatom, self.negated, mln=self.mln, idx=self.idx)
 
 
@@ -1428,11 +1485,14 @@ class Logic(object):
         Represents a ground atom.
         """
 
+        __slots__ = ('_predname', '_args', '_idx', 'mln', '_gndlits')
+
         def __init__(self, predname, args, mln, idx=None):
             self.predname = predname
             self.args = args
             self.idx = idx
             self.mln = mln
+            self._gndlits = None
 
 
         @property
@@ -1469,6 +1529,21 @@ class Logic(object):
             return world[self.idx]
 
 
+        def literal(self, negated, mln):
+            """
+            Returns the (negated) ground literal of this atom that is shared by
+            all ground formulas of `mln` containing it. The shared literals must
+            not be modified and do not have a formula index.
+            """
+            if self._gndlits is None:
+                self._gndlits = [None, None]
+            lit = self._gndlits[negated]
+            if lit is None or lit.mln is not mln:
+                lit = mln.logic.gnd_lit(self, negated, mln=mln)
+                self._gndlits[negated] = lit
+            return lit
+
+
         def mintruth(self, world):
             truth = self.truth(world)
             if truth is None: return 0
@@ -1529,11 +1604,14 @@ class Logic(object):
         Represents (in)equality constraints between two symbols.
         """
 
+        __slots__ = ('_args', '_negated', '_vardomains')
+
 
         def __init__(self, args, negated, mln, idx=None):
             ComplexFormula.__init__(self, mln, idx)
             self.args = args
             self.negated = negated
+            self._vardomains = None
 
 
         @property
@@ -1585,7 +1663,7 @@ class Logic(object):
 
 
         def copy(self, mln=None, idx=inherit):
-            return self.mln.logic.equality(self.args, self.negated, mln=ifnone(mln, self.mln), idx=self.idx if idx is inherit else idx)
+            return self.mln.logic.equality(list(self.args), self.negated, mln=ifnone(mln, self.mln), idx=self.idx if idx is inherit else idx)
 
 
         def _ground_template(self, assignment):
@@ -1599,6 +1677,11 @@ class Logic(object):
         def vardoms(self, variables=None, constants=None):
             if variables is None:
                 variables = {}
+            if self._vardomains is not None:
+                for arg in self.args:
+                    if self.mln.logic.isvar(arg):
+                        variables[arg] = self._vardomains[arg]
+                return variables
             if self.mln.logic.isvar(self.args[0]) and self.args[0] not in variables: variables[self.args[0]] = None
             if self.mln.logic.isvar(self.args[1]) and self.args[1] not in variables: variables[self.args[1]] = None
             return variables
@@ -1608,6 +1691,15 @@ class Logic(object):
             return None
 
 
+        def bind_vardoms(self, vardoms):
+            """
+            Makes the variables of this equality take their domains from the dict
+            `vardoms`, e.g. the domains of the variables of the formula it is part of,
+            so that the equality can be grounded on its own.
+            """
+            self._vardomains = vardoms
+
+
         def vardomain_from_formula(self, formula):
             f_var_domains = formula.vardoms()
             eq_vars = self.vardoms()
@@ -1657,6 +1749,8 @@ class Logic(object):
         Represents an implication
         """
 
+        __slots__ = ()
+
 
         def __init__(self, children, mln, idx=None):
             Formula.__init__(self, mln, idx)
@@ -1712,6 +1806,8 @@ class Logic(object):
         Represents a bi-implication.
         """
 
+        __slots__ = ()
+
 
         def __init__(self, children, mln, idx=None):
             Formula.__init__(self, mln, idx)
@@ -1774,6 +1870,8 @@ class Logic(object):
         Represents a negation of a complex formula.
         """
 
+        __slots__ = ()
+
         def __init__(self, children, mln, idx=None):
             ComplexFormula.__init__(self, mln, idx)
             if hasattr(children, '__iter__'):
@@ -1900,6 +1998,8 @@ class Logic(object):
         Existential quantifier.
         """
 
+        __slots__ = ('_vars',)
+
 
         def __init__(self, variables, formula, mln, idx=None):
             Formula.__init__(self, mln, idx)
@@ -1997,7 +2097,7 @@ class Logic(object):
 
 
         def copy(self, mln=None, idx=inherit):
-            return self.mln.logic.exist(self.vars, self.formula, mln=ifnone(mln, self.mln), idx=self.idx if idx is inherit else idx)
+            return self.mln.logic.exist(list(self.vars), self.formula.copy(mln=ifnone(mln, self.mln), idx=None), mln=ifnone(mln, self.mln), idx=self.idx if idx is inherit else idx)
 
 
         def cnf(self,l=0):
@@ -2016,6 +2116,8 @@ class Logic(object):
         Represents constant truth values.
         """
 
+        __slots__ = ('_value',)
+
         def __init__(self, truth, mln, idx=None):
             Formula.__init__(self, mln, idx)
             self.value = truth
@@ -0,0 +1,323 @@
+# LOGIC -- COMPILED FORMULA EVALUATION
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from itertools import product
+
+from .common import Logic
+from .fuzzy import FuzzyLogic
+from ..mln.errors import FormulaCompilationError, NoSuchDomainError
+
+
+# maximum number of nested loops in a generated grounding function.
+# python refuses to compile more than 20 statically nested blocks.
+MAX_NESTED_LOOPS = 16
+
+
+class _AtomIndex(dict):
+    """
+    Maps ground atom strings to their indices in an MRF and looks up
+    missing entries lazily.
+    """
+
+    def __init__(self, mrf):
+        dict.__init__(self)
+        self.mrf = mrf
+
+
+    def __missing__(self, atom):
+        gndatom = self.mrf.gndatom(atom)
+        if gndatom is None:
+            raise Exception('Could not ground "%s". This atom is not among the ground atoms.' % atom)
+        self[atom] = gndatom.idx
+        return gndatom.idx
+
+
+class CompiledFormula(object):
+    """
+    A formula template compiled into a specialized Python function.
+
+    Every grounding of the formula is represented by a flat tuple of
+    integers, one per constituent of the formula: for literals, the
+    entry is the index of the respective ground atom, for (in)equality
+    constraints it is their precomputed truth value. The compiled
+    evaluator only indexes the world vector by these integers, so no
+    formula objects need to be instantiated for evaluating a grounding.
+
+    :param formula:    the formula template (e.g. a formula of an MRF).
+    :param mrf:        the MRF (or any object providing `domains` and
+                       `gndatom()`) the formula is grounded in.
+
+    :Example:
+
+    >>> cf = CompiledFormula(mrf.formulas[0], mrf)
+    >>> for gnd in cf.itergroundings():
+    >>>     print cf(mrf.evidence, gnd)
+    """
+
+    def __init__(self, formula, mrf):
+        self.formula = formula
+        self.mrf = mrf
+        self.logic = formula.mln.logic
+        self.fuzzy = isinstance(self.logic, FuzzyLogic)
+        try:
+            self.variables = list(formula.vardoms().items())
+        except Exception as e:
+            raise Exception("Error grounding '%s': %s" % (str(formula), str(e)))
+        self._varpos = dict([(v, i) for i, (v, _) in enumerate(self.variables)])
+        self.slots = []
+        self._funcs = []
+        self._atoms = _AtomIndex(mrf)
+        self.truth = self._compile_truth()
+        self._litslots = [i for i, s in enumerate(self.slots) if s[0] == 'lit']
+        self._groundings = self._compile_groundings()
+
+
+    @property
+    def idx(self):
+        return self.formula.idx
+
+
+    @property
+    def weight(self):
+        return self.formula.weight
+
+
+    def __call__(self, world, gnd):
+        return self.truth(world, gnd)
+
+
+    def __reduce__(self):
+        # the generated functions cannot be pickled, so they are compiled anew
+        return CompiledFormula, (self.formula, self.mrf)
+
+
+    def gndatom_indices(self, gnd):
+        """
+        Returns the list of distinct ground atom indices of the grounding `gnd`
+        in the order of their first appearance in the formula.
+        """
+        indices = []
+        for i in self._litslots:
+            if gnd[i] not in indices:
+                indices.append(gnd[i])
+        return indices
+
+
+    def itergroundings(self, partial=None):
+        """
+        Yields the groundings of this formula as tuples of integers.
+
+        :param partial:    an optional dict mapping variable names to constants,
+                           which restricts the groundings to the ones consistent
+                           with the given partial assignment.
+        """
+        for _, gnd in self.iterassignments(partial):
+            yield gnd
+
+
+    def iterassignments(self, partial=None):
+        """
+        Yields pairs `(values, gnd)`, where `values` is the tuple of constants
+        assigned to the variables in :attr:`variables` and `gnd` is the
+        corresponding grounding.
+        """
+        domains = []
+        for varname, domname in self.variables:
+            if partial is not None and varname in partial:
+                domains.append((partial[varname],))
+            elif domname not in self.mrf.domains:
+                raise NoSuchDomainError('The domain %s does not exist, but is needed to ground the formula %s' % (domname, str(self.formula)))
+            else:
+                domains.append(self.mrf.domains[domname])
+        return self._groundings(domains, self._atoms, product)
+
+
+    def _compile_truth(self):
+        self._newfunc(self.formula, {})
+        source = '\n'.join(src for src in reversed(self._funcs))
+        namespace = {}
+        exec(compile(source, '<compiled formula %s>' % self.formula, 'exec'), namespace)
+        return namespace['_f0']
+
+
+    def _newfunc(self, f, binding):
+        # reserve the function index before compiling the children
+        # so the root function is always _f0
+        fidx = len(self._funcs)
+        self._funcs.append(None)
+        lines = ['def _f%d(w, g):' % fidx]
+        if isinstance(f, Logic.Conjunction):
+            self._compile_junction(f, binding, lines, 0)
+        elif isinstance(f, Logic.Disjunction):
+            self._compile_junction(f, binding, lines, 1)
+        elif isinstance(f, Logic.Exist):
+            self._compile_exist(f, binding, lines)
+        elif isinstance(f, Logic.Implication):
+            self._compile_child(f.children[0], binding, lines, 'a')
+            if self.fuzzy:
+                lines.append('    if a is not None: a = 1. - a')
+                self._compile_child(f.children[1], binding, lines, 'c')
+                lines.append('    if a == 1 or c == 1: return 1')
+                lines.append('    if a is None or c is None: return None')
+                lines.append('    return max(a, c)')
+            else:
+                self._compile_child(f.children[1], binding, lines, 'c')
+                lines.append('    if a == 0 or c == 1: return 1')
+                lines.append('    if a is None or c is None: return None')
+                lines.append('    return 0')
+        elif isinstance(f, Logic.Biimplication):
+            self._compile_child(f.children[0], binding, lines, 'a')
+            self._compile_child(f.children[1], binding, lines, 'c')
+            if self.fuzzy:
+                lines.append('    if a == 0 or c == 0: return 0')
+                lines.append('    if a is None or c is None: return None')
+                lines.append('    return min(a, c)')
+            else:
+                lines.append('    if a is None or c is None: return None')
+                lines.append('    return 1 if a == c else 0')
+        elif isinstance(f, Logic.Negation):
+            self._compile_child(f.children[0], binding, lines, 'v')
+            lines.append('    if v is None: return None')
+            lines.append('    return %s - v' % ('1.' if self.fuzzy else '1'))
+        else:
+            self._compile_child(f, binding, lines, 'v')
+            lines.append('    return v')
+        self._funcs[fidx] = '\n'.join(lines)
+        return fidx
+
+
+    def _compile_junction(self, f, binding, lines, short):
+        # short is the truth value that determines the truth of the whole
+        # junction, i.e. 0 for conjunctions and 1 for disjunctions
+        lines.append('    u = 0')
+        if self.fuzzy: lines.append('    m = None')
+        for child in f.children:
+            self._compile_child(child, binding, lines, 'v')
+            lines.append('    if v == %d: return %d' % (short, short))
+            lines.append('    if v is None: u = 1')
+            if self.fuzzy:
+                lines.append('    elif m is None or v %s m: m = v' % ('<' if short == 0 else '>'))
+        if self.fuzzy:
+            lines.append('    return None if u else m')
+        else:
+            lines.append('    return None if u else %s' % ('1.' if short == 0 else '0'))
+
+
+    def _compile_exist(self, f, binding, lines):
+        vardoms = f.formula.vardoms()
+        if not set(f.vars).issubset(vardoms):
+            raise Exception('One or more variables do not appear in formula: %s' % str(set(f.vars).difference(vardoms)))
+        domains = [self.mrf.domains[vardoms[v]] for v in f.vars]
+        lines.append('    u = 0')
+        if self.fuzzy: lines.append('    m = None')
+        for values in product(*domains):
+            b = dict(binding)
+            b.update(zip(f.vars, values))
+            self._compile_child(f.formula, b, lines, 'v')
+            lines.append('    if v == 1: return 1')
+            lines.append('    if v is None: u = 1')
+            if self.fuzzy: lines.append('    elif m is None or v > m: m = v')
+        if self.fuzzy:
+            lines.append('    return None if u else (0 if m is None else m)')
+        else:
+            lines.append('    return None if u else 0')
+
+
+    def _compile_child(self, f, binding, lines, target):
+        if isinstance(f, Logic.Lit):
+            if f.negated not in (True, False):
+                raise FormulaCompilationError('Cannot compile formula template "%s".' % str(f))
+            args = [binding.get(a, a) for a in f.args]
+            lines.append('    %s = w[g[%d]]' % (target, self._slot('lit', f.predname, args)))
+            if f.negated:
+                lines.append('    if %s is not None: %s = 1. - %s' % (target, target, target))
+        elif isinstance(f, Logic.GroundLit):
+            lines.append('    %s = w[%d]' % (target, f.gndatom.idx))
+            if f.negated:
+                lines.append('    if %s is not None: %s = 1. - %s' % (target, target, target))
+        elif isinstance(f, Logic.Equality):
+            args = [binding.get(a, a) for a in f.args]
+            lines.append('    %s = g[%d]' % (target, self._slot('eq', f.negated, args)))
+        elif isinstance(f, Logic.TrueFalse):
+            lines.append('    %s = %r' % (target, f.value))
+        elif isinstance(f, (Logic.Conjunction, Logic.Disjunction, Logic.Exist, Logic.Implication,
+                            Logic.Biimplication, Logic.Negation)):
+            lines.append('    %s = _f%d(w, g)' % (target, self._newfunc(f, binding)))
+        else:
+            raise FormulaCompilationError('Cannot compile formulas of type %s.' % type(f).__name__)
+
+
+    def _slot(self, kind, spec, args):
+        self.slots.append((kind, spec, args))
+        return len(self.slots) - 1
+
+
+    def _argexpr(self, arg):
+        if self.logic.isvar(arg):
+            if arg not in self._varpos:
+                raise Exception("Variable '%s' in '%s' not bound to a domain!" % (arg, str(self.formula)))
+            return 'v%d' % self._varpos[arg]
+        return repr(arg)
+
+
+    def _slotexpr(self, slot):
+        kind, spec, args = slot
+        if kind == 'lit':
+            fmt = '%s(%s)' % (spec, ','.join(['%s'] * len(args)))
+            return 'atoms[%r %% (%s,)]' % (fmt, ', '.join(map(self._argexpr, args)))
+        # equality constraints are evaluated at grounding time
+        t, f = ('1.', '0.') if self.fuzzy else ('1', '0')
+        if spec: t, f = f, t
+        return '(%s if %s == %s else %s)' % (t, self._argexpr(args[0]), self._argexpr(args[1]), f)
+
+
+    def _slotlevel(self, slot):
+        # the loop level at which all variables of a slot are bound
+        return max([self._varpos[a] + 1 for a in slot[2] if self.logic.isvar(a) and a in self._varpos] + [0])
+
+
+    def _compile_groundings(self):
+        """
+        Generates a generator function enumerating the groundings of the formula
+        with nested loops over the variable domains. The entries of a grounding are
+        computed in the outermost loop in which all their variables are bound.
+        """
+        n = len(self.variables)
+        values = ', '.join(['v%d' % i for i in range(n)])
+        gnd = ', '.join(['s%d' % i for i in range(len(self.slots))])
+        lines = ['def _groundings(doms, atoms, product):']
+        if n > MAX_NESTED_LOOPS:
+            lines.append('    for %s in product(*doms):' % values)
+            for i, slot in enumerate(self.slots):
+                lines.append('        s%d = %s' % (i, self._slotexpr(slot)))
+            lines.append('        yield (%s,), (%s,)' % (values, gnd))
+        else:
+            levels = [self._slotlevel(s) for s in self.slots]
+            for level in range(n + 1):
+                indent = '    ' * (level + 1)
+                if level > 0:
+                    lines.append('%sfor v%d in doms[%d]:' % ('    ' * level, level - 1, level - 1))
+                for i, slot in enumerate(self.slots):
+                    if levels[i] == level:
+                        lines.append('%ss%d = %s' % (indent, i, self._slotexpr(slot)))
+            lines.append('%syield (%s), (%s)' % ('    ' * (n + 1), values + ',' if n else '', gnd + ',' if gnd else ''))
+        namespace = {}
+        exec(compile('\n'.join(lines), '<groundings of %s>' % self.formula, 'exec'), namespace)
+        return namespace['_groundings']
@@ -35,13 +35,14 @@ class FirstOrderLogic(Logic):
 #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #
 
 
-    class Constraint(Logic.Constraint): pass
+    class Constraint(Logic.Constraint): __slots__ = ()
         
     
 #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #
 
     
     class Formula(Logic.Formula, Constraint): 
+        __slots__ = ()
         
         def noisyor(self, world):
             """
@@ -83,31 +84,32 @@ class FirstOrderLogic(Logic):
 #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #
     
 
-    class ComplexFormula(Logic.ComplexFormula, Formula): pass
+    class ComplexFormula(Logic.ComplexFormula, Formula): __slots__ = ()
         
         
 #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #
 
         
-    class Lit(Logic.Lit, Formula): pass
+    class Lit(Logic.Lit, Formula): __slots__ = ()
 
 
 #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #
 
 
-    class Litgroup(Logic.LitGroup, Formula): pass
+    class Litgroup(Logic.LitGroup, Formula): __slots__ = ()
 
 
 #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #
     
     
-    class GroundAtom(Logic.GroundAtom): pass
+    class GroundAtom(Logic.GroundAtom): __slots__ = ()
 
         
 #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #
 
             
     class GroundLit(Logic.GroundLit, Formula):
+        __slots__ = ()
 
         def noisyor(self, world):
             truth = self(world)
@@ -118,6 +120,7 @@ class FirstOrderLogic(Logic):
 
     
     class Disjunction(Logic.Disjunction, ComplexFormula):
+        __slots__ = ()
         
         def truth(self, world):
             dontKnow = False
@@ -165,6 +168,7 @@ class FirstOrderLogic(Logic):
 #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #
             
     class Conjunction(Logic.Conjunction, ComplexFormula):
+        __slots__ = ()
         
         def truth(self, world):
             dontKnow = False
@@ -211,6 +215,7 @@ class FirstOrderLogic(Logic):
 
 
     class Implication(Logic.Implication, ComplexFormula):
+        __slots__ = ()
 
         def truth(self, world):
             ant = self.children[0].truth(world)
@@ -226,6 +231,7 @@ class FirstOrderLogic(Logic):
 
         
     class Biimplication(Logic.Biimplication, ComplexFormula):
+        __slots__ = ()
 
         def truth(self, world):
             c1 = self.children[0].truth(world)
@@ -238,25 +244,26 @@ class FirstOrderLogic(Logic):
 #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #
 
         
-    class Negation(Logic.Negation, ComplexFormula): pass
+    class Negation(Logic.Negation, ComplexFormula): __slots__ = ()
         
             
 #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #
 
     
-    class Exist(Logic.Exist, ComplexFormula): pass
+    class Exist(Logic.Exist, ComplexFormula): __slots__ = ()
      
     
 #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #
 
     
-    class Equality(Logic.Equality, ComplexFormula): pass
+    class Equality(Logic.Equality, ComplexFormula): __slots__ = ()
     
             
 #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #
 
 
     class TrueFalse(Logic.TrueFalse, Formula):
+        __slots__ = ()
         
         @property
         def value(self):
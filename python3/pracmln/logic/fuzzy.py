@@ -56,43 +56,44 @@ class FuzzyLogic(Logic):
 #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #
     
     
-    class Constraint(Logic.Constraint): pass
+    class Constraint(Logic.Constraint): __slots__ = ()
     
     
 #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #
 
 
-    class Formula(Logic.Formula): pass
+    class Formula(Logic.Formula): __slots__ = ()
     
     
 #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #
 
 
-    class ComplexFormula(Logic.Formula): pass
+    class ComplexFormula(Logic.Formula): __slots__ = ()
 
 
 #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #
 
 
-    class Lit(Logic.Lit): pass
+    class Lit(Logic.Lit): __slots__ = ()
 
     
 #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #
 
 
-    class LitGroup(Logic.LitGroup): pass
+    class LitGroup(Logic.LitGroup): __slots__ = ()
 
 
 #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #
     
     
-    class GroundLit(Logic.GroundLit): pass
+    class GroundLit(Logic.GroundLit): __slots__ = ()
         
 
 #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #
 
 
     class GroundAtom(Logic.GroundAtom):
+        __slots__ = ()
         
         def truth(self, world):
             return world[self.idx]
@@ -102,6 +103,7 @@ class FuzzyLogic(Logic):
 
     
     class Negation(Logic.Negation, ComplexFormula):
+        __slots__ = ()
         
         def truth(self, world):
             val = self.children[0].truth(world)
@@ -120,6 +122,7 @@ class FuzzyLogic(Logic):
     
     
     class Conjunction(Logic.Conjunction, ComplexFormula):
+        __slots__ = ()
         
         
         def truth(self, world):
@@ -154,6 +157,7 @@ class FuzzyLogic(Logic):
 
     
     class Disjunction(Logic.Disjunction, ComplexFormula):
+        __slots__ = ()
         
         
         def truth(self, world):
@@ -187,6 +191,7 @@ class FuzzyLogic(Logic):
 
 
     class Implication(Logic.Implication, ComplexFormula):
+        __slots__ = ()
         
         def truth(self, world):
             ant = self.children[0].truth(world)
@@ -201,6 +206,7 @@ class FuzzyLogic(Logic):
 
 
     class Biimplication(Logic.Biimplication, ComplexFormula):
+        __slots__ = ()
         
         def truth(self, world):
             return FuzzyLogic.min_undef(self.children[0].truth(world), self.children[1].truth(world))
@@ -215,6 +221,7 @@ class FuzzyLogic(Logic):
 
         
     class Equality(Logic.Equality):
+        __slots__ = ()
         
         def truth(self, world=None):
             if any(map(self.mln.logic.isvar, self.args)):
@@ -232,6 +239,7 @@ class FuzzyLogic(Logic):
 
         
     class TrueFalse(Formula, Logic.TrueFalse):
+        __slots__ = ()
         
         # def __init__(self, truth, mln, idx=None):
         #     if not (truth >= 0. and truth <= 1.):
@@ -262,7 +270,7 @@ class FuzzyLogic(Logic):
 
 
     class Exist(Logic.Exist, Logic.ComplexFormula):
-        pass
+        __slots__ = ()
 
 
 #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #
@@ -24,6 +24,7 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 from pyparsing import *
+from collections import OrderedDict
 import re
 
 
@@ -126,17 +127,60 @@ class TreeBuilder(object):
 class Grammar(object):
     """
     Abstract super class for all logic grammars.
+    
+    The pyparsing elements of a grammar are built lazily on the first
+    parse that requires them. Parsed formulas, literals and predicate
+    declarations are memoized in a least-recently-used cache keyed by
+    the string that has been parsed. Repeated parses of the same string
+    return copies of the memoized objects.
+    
+    :param logic:    the logic instance the parsed formulas are created with.
     """
     
+    # maximum number of strings memoized per parse method
+    CACHESIZE = 4096
     
+    def __init__(self, logic):
+        self.logic = logic
+        self.tree = None
+        self._cache = {'formula': OrderedDict(), 'literal': OrderedDict(), 'predicate': OrderedDict()}
+        
     def __deepcopy__(self, memo):
         return self
     
+    def _init_grammar(self):
+        raise Exception('%s does not implement _init_grammar().' % str(type(self)))
+    
+    def _cached(self, cache, s):
+        cache = self._cache[cache]
+        try:
+            item = cache.pop(s)
+        except KeyError:
+            return None
+        cache[s] = item
+        return item
+    
+    def _memoize(self, cache, s, item):
+        cache = self._cache[cache]
+        cache[s] = item
+        if len(cache) > self.CACHESIZE:
+            cache.popitem(last=False)
+    
     def parse_formula(self, s):
+        formula = self._cached('formula', s)
+        # the memoized formula is the one returned by the first parse, which may
+        # have been added to another MLN in the meantime.
+        if formula is not None and formula.mln is self.logic.mln:
+            return formula.copy(idx=None)
+        if self.tree is None: self._init_grammar()
         self.tree.reset()
         self.formula.parseString(s)
-        constr = self.tree.getConstraint()
-        return constr
+        formula = self.tree.getConstraint()
+        # count constraints cannot be copied and are not memoized. a copy is
+        # memoized, since the caller may modify the formula returned.
+        if hasattr(formula, 'copy'):
+            self._memoize('formula', s, formula.copy())
+        return formula
     
     def parse_atom(self, string):
         """
@@ -149,7 +193,19 @@ class Grammar(object):
         raise Exception("Could not parse predicate '%s'" % string)
     
     def parse_predicate(self, s):
-        return self.predDecl.parseString(s)[0]
+        pred = self._cached('predicate', s)
+        if pred is None:
+            if self.tree is None: self._init_grammar()
+            try:
+                pred = self.predDecl.parseString(s)[0]
+            except ParseException as e:
+                # non-declarations are memoized as well, since every formula 
+                # of an MLN file is tried to be parsed as a declaration first
+                pred = (e.pstr, e.loc, e.msg)
+            self._memoize('predicate', s, pred)
+        if type(pred) is tuple:
+            raise ParseException(*pred)
+        return pred.copy()
     
     def isvar(self, identifier):
         raise Exception('%s does not implement isvar().' % str(type(self)))
@@ -177,14 +233,19 @@ class Grammar(object):
         where the first item is whether the literal is true, the second is the 
         predicate name and the third is a list of parameters, e.g. (False, "p", ["A", "B"])
         """
-        # try regular MLN syntax
-        self.tree.reset()
-        try:
-            lit = self.literal.parseString(s)
-        except ParseException:
-            raise Exception('unable to parse string', s)
-        lit = self.tree.getConstraint()
-        return (not lit.negated, lit.predname, lit.args)
+        lit = self._cached('literal', s)
+        if lit is None:
+            # try regular MLN syntax
+            if self.tree is None: self._init_grammar()
+            self.tree.reset()
+            try:
+                self.literal.parseString(s)
+            except ParseException:
+                raise Exception('unable to parse string', s)
+            lit = self.tree.getConstraint()
+            lit = (not lit.negated, lit.predname, lit.args)
+            self._memoize('literal', s, lit)
+        return (lit[0], lit[1], list(lit[2]))
 #         m = re.match(r'(!?)(\w+)\((.*?)\)$', s)
 #         if m is not None:
 #             return (m.group(1) != "!", m.group(2), map(str.strip, m.group(3).split(",")))
@@ -196,7 +257,8 @@ class StandardGrammar(Grammar):
     The standard MLN logic syntax.
     """
     
-    def __init__(self, logic):
+    def _init_grammar(self):
+        logic = self.logic
         identifierCharacter = alphanums + '_' + '-' + "'"
         lcCharacter = alphas.lower()
         ucCharacter = alphas.upper()
@@ -278,7 +340,8 @@ class PRACGrammar(Grammar):
     arbitrary constants. Variables need to start with '?'
     """
     
-    def __init__(self, logic):
+    def _init_grammar(self):
+        logic = self.logic
         # grammar
         
         identifierCharacter = alphanums + 'ÄÖÜäöü' + '_' + '-' + "'" + '.' + ':' + ';' + '$' + '~' + '\\' + '!' + '/'
@@ -35,16 +35,17 @@ from pyparsing import ParseException
 from .constants import HARD, comment_color, predicate_color, weight_color
 import copy
 import os
+from collections import OrderedDict
 from .util import StopWatch, mergedom, fstr, colorize, stripComments
 from .mlnpreds import (Predicate, FuzzyPredicate, SoftFunctionalPredicate,
     FunctionalPredicate)
 from .database import Database
-from .learning.multidb import MultipleDatabaseLearner
 import sys
 import re
 import traceback
-from .learning.bpll import BPLL
+from .grounding.profile import GroundingProfile
 from ..utils.project import mlnpath
+from ..utils.tracing import traced, span
 from importlib import util as imputil
 
 logger = logs.getlogger(__name__)
@@ -88,6 +89,7 @@ class MLN(object):
         self._unique_templvars = []
         self._probreqs = []
         self._materialized = False
+        self._matcache = OrderedDict() # LRU cache of materialized formula sets
         self.fuzzypreds = []  # for saving fuzzy predicates that have been converted to binary preds
         if mlnfile is not None:
             MLN.load(mlnfile, logic=logic, grammar=grammar, mln=self)
@@ -98,6 +100,14 @@ class MLN(object):
         self.posteriorProbReqs = []
         self.watch = StopWatch()
 
+    # maximum number of materializations memoized per MLN
+    MATCACHESIZE = 8
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        d['_matcache'] = OrderedDict()
+        return d
+
     @property
     def predicates(self):
         return list(self.iterpreds())
@@ -152,8 +162,14 @@ class MLN(object):
         for pred in self.iterpreds():
             mln_.predicate(copy.copy(pred))
         mln_.domain_decls = list(self.domain_decls)
+        # the constants of the formulas are contained in the domains copied below,
+        # so the formulas are added directly instead of via formula()
         for i, f in self.iterformulas():
-            mln_.formula(f.copy(mln=mln_), weight=self.weight(i), fixweight=self.fixweights[i], unique_templvars=self._unique_templvars[i])
+            f_ = f.copy(mln=mln_, idx=i)
+            mln_._formulas.append(f_)
+            mln_.weights.append(self.weight(i))
+            mln_.fixweights.append(self.fixweights[i])
+            mln_._unique_templvars.append(list(self._unique_templvars[i]))
         mln_.domains = dict(self.domains)
         mln_.vars = dict(self.vars)
         mln_._probreqs = list(self.probreqs)
@@ -283,6 +299,7 @@ class MLN(object):
     def __lshift__(self, _input):
         parse_mln(_input, '.', logic=None, grammar=None, mln=self)
 
+    @traced('materialize')
     def materialize(self, *dbs):
         '''
         Materializes this MLN with respect to the databases given. This must
@@ -301,15 +318,27 @@ class MLN(object):
         # obtain full domain with all objects
         fulldomain = mergedom(self.domains, *[db.domains for db in dbs])
         logger.debug('full domains: %s' % fulldomain)
+        # the materialized formulas only depend on the templates and the domains,
+        # so they can be reused as long as neither of them has changed.
+        key = self._materialization_key(fulldomain)
+        if key in self._matcache:
+            matmln, templidx = self._matcache.pop(key)
+            self._matcache[key] = (matmln, templidx)
+            mln__ = matmln.copy()
+            mln__.weights = [self.weights[i] for i in templidx]
+            mln__._materialized = True
+            return mln__
         mln_ = self.copy()
         # collect the admissible formula templates. templates might be not
         # admissible since the domain of a template variable might be empty.
-        for ft in list(mln_.formulas):
+        templates = []
+        for i, ft in enumerate(list(mln_.formulas)):
             domnames = list(ft.vardoms().values())
             if any([domname not in fulldomain for domname in domnames]):
                 logger.debug('Discarding formula template %s, since it cannot be grounded (domain(s) %s empty).' % \
                     (fstr(ft), ','.join([d for d in domnames if d not in fulldomain])))
                 mln_.rmf(ft)
+            else: templates.append(i)
         # collect the admissible predicates. a predicate may become inadmissible
         # if either the domain of one of its arguments is empty or there is
         # no formula containing the respective predicate.
@@ -333,14 +362,34 @@ class MLN(object):
         # materialize the formula templates
         mln__ = mln_.copy()
         mln__ ._rmformulas()
+        templidx = []
         for i, template in mln_.iterformulas():
             for variant in template.template_variants():
                 idx = len(mln__._formulas)
                 f = mln__.formula(variant, weight=template.weight, fixweight=mln_.fixweights[i])
                 f.idx = idx
+                templidx.append(templates[i])
         mln__._materialized = True
+        self._matcache[key] = (mln__.copy(), templidx)
+        if len(self._matcache) > self.MATCACHESIZE:
+            self._matcache.popitem(last=False)
         return mln__
 
+    def _materialization_key(self, fulldomain):
+        '''
+        Returns a hashable signature of everything a materialization of this MLN
+        depends on, i.e. the formula templates, predicates and the full domains.
+        '''
+        return (tuple([(dom, tuple(values)) for dom, values in sorted(fulldomain.items())]),
+                tuple(map(str, self._formulas)),
+                tuple(self.fixweights),
+                tuple(map(tuple, self._unique_templvars)),
+                tuple(map(repr, self.iterpreds())),
+                tuple(self.fuzzypreds),
+                tuple(map(str, self.probreqs)),
+                tuple(self.domain_decls),
+                tuple(sorted(self.vars.items())))
+
     def constant(self, domain, *values):
         '''
         Adds to the MLN a constant domain value to the domain specified.
@@ -365,12 +414,14 @@ class MLN(object):
         :param cwpreds:    a list of predicate names the closed-world assumption shall be applied.
         '''
         logger.debug('creating ground MRF...')
-        mrf = MRF(self, db)
-        for pred in self.predicates:
-            for gndatom in pred.groundatoms(self, mrf.domains):
-                mrf.gndatom(gndatom.predname, *gndatom.args)
-        evidence = dict([(atom, value) for atom, value in db.evidence.items() if mrf.gndatom(atom) is not None])
-        mrf.set_evidence(evidence, erase=False)
+        with span('ground') as s:
+            mrf = MRF(self, db)
+            for pred in self.predicates:
+                for gndatom in pred.groundatoms(self, mrf.domains):
+                    mrf.gndatom(gndatom.predname, *gndatom.args)
+            evidence = dict([(atom, value) for atom, value in db.evidence.items() if mrf.gndatom(atom) is not None])
+            mrf.set_evidence(evidence, erase=False)
+            s.attrs['gndatoms'] = len(mrf._gndatoms)
         return mrf
 
     def update_domain(self, domain):
@@ -383,13 +434,34 @@ class MLN(object):
         for value in domain[domname]:
             self.constant(domname, value)
 
-    def learn(self, databases, method=BPLL, **params):
+    def learn(self, databases, method=None, **params):
         '''
         Triggers the learning parameter learning process for a given set of databases.
         Returns a new MLN object with the learned parameters.
         
         :param databases:     list of :class:`mln.database.Database` objects or filenames
-        '''
+        :param method:        the learning method, :class:`mln.learning.bpll.BPLL` by default.
+        :param warmstart:     an MLN (or the filename of an MLN) whose weights are used as
+                              initial weights for the formulas it shares with this MLN,
+                              e.g. the result of a previous learning run.
+        :param checkpoint:    a filename the weights, the state of the optimizer and the
+                              precomputed statistics are periodically saved to (every
+                              `checkpoint_interval` seconds).
+        :param resume:        if `True`, learning is resumed from the state in `checkpoint`.
+        :param optimizer:     the optimizer, e.g. `'bfgs'`, `'l-bfgs-b'` or, for learners
+                              providing Hessian-vector products (the pseudo-likelihood
+                              and composite-likelihood learners), `'ncg'` or `'trust-ncg'`.
+        :param bounds:        box constraints for `'l-bfgs-b'`, either a single `(min, max)`
+                              pair for all weights or one pair for every formula.
+        :param groundingprofile:    a :class:`mln.grounding.profile.GroundingProfile` the
+                              statistics of the grounding factories used by the learner
+                              are recorded in.
+        '''
+        # the learners are imported on demand, since they depend on scipy
+        from .methods import LearningMethods
+        from .learning.multidb import MultipleDatabaseLearner
+        if method is None:
+            method = LearningMethods.BPLL
         verbose = params.get('verbose', False)
         
         # get a list of database objects
@@ -404,6 +476,9 @@ class MLN(object):
             elif type(db) is list: dbs.extend(db)
             else: dbs.append(db)
         logger.debug('loaded %s evidence databases for learning' % len(dbs))
+        if isinstance(params.get('warmstart'), str):
+            params['warmstart'] = MLN(mlnfile=params['warmstart'], logic=self.logic.__class__.__name__,
+                                      grammar=self.logic.grammar.__class__.__name__)
         newmln = self.materialize(*dbs)
 
         logger.debug('MLN predicates:')
@@ -423,7 +498,16 @@ class MLN(object):
             learner = MultipleDatabaseLearner(newmln, dbs, method, **params)
         if verbose:
             "learner: %s" % learner.name
-        wt = learner.run(**params)
+        profile = params.get('groundingprofile')
+        if profile is not None:
+            # every MRF gets its own profile, since the learners may be prepared in child processes
+            for mrf in self._learner_mrfs(learner):
+                mrf.groundingprofile = GroundingProfile()
+        with span('learn', learner=type(learner).__name__):
+            wt = learner.run(**params)
+        if profile is not None:
+            for mrf in self._learner_mrfs(learner):
+                profile.merge(mrf.groundingprofile)
         newmln.weights = wt
         # fit prior prob. constraints if any available
         if len(self.probreqs) > 0:
@@ -445,6 +529,13 @@ class MLN(object):
                 if w != 0: newmln.formula(f, w, fi)
         return newmln
 
+    @staticmethod
+    def _learner_mrfs(learner):
+        from .learning.multidb import MultipleDatabaseLearner
+        if isinstance(learner, MultipleDatabaseLearner):
+            return [l.mrf for l in learner.learners]
+        return [learner.mrf]
+
     def tofile(self, filename):
         '''
         Creates the file with the given filename and writes this MLN into it.
@@ -548,6 +639,7 @@ class MLN(object):
         raise Exception('No mln files given.')
 
 
+@traced('parse.mln')
 def parse_mln(text, searchpaths=['.'], projectpath=None, logic='FirstOrderLogic', grammar='PRACGrammar', mln=None):
     '''
     Reads an MLN from a stream providing a 'read' method.
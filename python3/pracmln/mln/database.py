@@ -38,6 +38,7 @@ import traceback
 from collections import defaultdict
 import re
 from ..utils.project import mlnpath
+from ..utils.tracing import traced
 
 
 logger = logs.getlogger(__name__)
@@ -536,6 +537,7 @@ class Database(object):
                 yield assignment
                 
 
+@traced('parse.db')
 def parse_db(mln, content, ignore_unknown_preds=False, db=None, dirs=['.'], projectpath=None):
     """
     Reads one or more databases in a string representation and returns
@@ -11,3 +11,4 @@ class MRFValueException(Exception): pass
 class SatisfiabilityException(Exception): pass
 class OutOfMemoryError(Exception): pass
 class NoConstraintsError(Exception): pass
+class FormulaCompilationError(Exception): pass
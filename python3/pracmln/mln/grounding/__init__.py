@@ -1,3 +1,7 @@
 from .default import DefaultGroundingFactory
 from .bpll import BPLLGroundingFactory
-from .fastconj import FastConjunctionGrounding
\ No newline at end of file
+from .fastconj import FastConjunctionGrounding
+from .profile import GroundingProfile
+from .lazy import LazyGrounding
+from .cache import GroundingCache
+from .shared import SharedGrounding
@@ -22,18 +22,23 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 from collections import defaultdict
+from itertools import chain
+from math import ceil
 
-from dnutils import logs
+from dnutils import logs, ifnone
 
 from .fastconj import FastConjunctionGrounding
+from .variants import FormulaVariants, group_variants
+from .profile import GroundingProfile
 from ..util import unifyDicts, dict_union
 from ..constants import HARD
-from ..errors import SatisfiabilityException
+from ..errors import SatisfiabilityException, FormulaCompilationError
 from ...utils.undo import Ref, Number, List, ListDict, Boolean
 from ...logic.common import Logic
-from ...utils.multicore import with_tracing, checkmem
+from ...logic.compiled import CompiledFormula
+from ...utils.multicore import with_tracing, poolsize, checkmem
 
-import types
+from multiprocessing import cpu_count
 from multiprocessing.pool import Pool
 
 # this readonly global is for multiprocessing to exploit copy-on-write
@@ -43,31 +48,169 @@ global_bpll_grounding = None
 logger = logs.getlogger(__name__)
 
 # multiprocessing function
-def create_formula_groundings(formula, unsatfailure=True):
+def create_formula_groundings(task, unsatfailure=True):
+    """
+    Generates the groundings of a formula, or of a part of its grounding space,
+    and accumulates their pseudo-likelihood statistics.
+
+    :param task:    a triple `(formula, split, first)`, where `split` is `None` or a
+                    pair `(varname, values)` restricting the grounding space to the
+                    given values of the variable `varname`, and `first` is `True` for
+                    the first part of the grounding space of `formula`.
+    :returns:       a pair of a dict mapping formula indices to dicts mapping
+                    variable indices to the statistics of their values, and the
+                    grounding profile of the task.
+    """
+    formula, split, first = task
     checkmem()
-    results = []
-    if global_bpll_grounding.mrf.mln.logic.islitconj(formula):
-        for res in global_bpll_grounding.itergroundings_fast(formula):
-            checkmem()
-            results.append(res)
+    mrf = global_bpll_grounding.mrf
+    # the statistics are recorded separately, since this may run in a child process
+    profile = GroundingProfile() if global_bpll_grounding.profile is not None else None
+    variants = formula if isinstance(formula, FormulaVariants) else None
+    if mrf.mln.logic.islitconj(formula if variants is None else variants.formula):
+        groundings = global_bpll_grounding.itergroundings_fast(formula if variants is None else variants.formula, variants, split)
     else:
-        for gf in formula.itergroundings(global_bpll_grounding.mrf, simplify=False):
-            checkmem()
+        groundings = compiled_formula_groundings(mrf, formula, unsatfailure=unsatfailure, split=split)
+    if profile is not None:
+        groundings = profile.track(mrf, formula, groundings, enumerated=first)
+    stats = {}
+    for fidx, stat in groundings:
+        checkmem()
+        if not stat: continue
+        d = stats.get(fidx)
+        if d is None:
+            d = stats[fidx] = {}
+        for varidx, validx, val in stat:
+            counts = d.get(varidx)
+            if counts is None:
+                counts = d[varidx] = [0] * mrf.variable(varidx).valuecount()
+            counts[validx] += val
+    return stats, profile
+
+
+def _partials(partial, split):
+    """
+    Yields the partial variable assignments the grounding space given by
+    `partial` is divided into by `split` (see :func:`create_formula_groundings`).
+    """
+    if split is None:
+        yield partial
+        return
+    varname, values = split
+    for value in values:
+        yield dict_union(ifnone(partial, {}), {varname: value})
+
+
+def compiled_formula_groundings(mrf, formula, unsatfailure=True, split=None):
+    """
+    Generates the pseudo-likelihood statistics of all groundings of `formula`
+    as pairs `(formula.idx, stat)`, where `stat` is a list of
+    `(varidx, validx, truth)` triples for all values of the variables in the
+    grounding that do not render it false.
+
+    The formula is evaluated by a compiled evaluator (see
+    :class:`logic.compiled.CompiledFormula`), so the ground formulas are
+    never instantiated and the world is modified in place instead of
+    being copied for every ground atom.
+
+    `formula` may also be a :class:`FormulaVariants` instance, whose variants
+    are then compiled only once. If `split` is given, only the part of the
+    grounding space it specifies is generated (see :func:`create_formula_groundings`).
+    """
+    variants = formula if isinstance(formula, FormulaVariants) else None
+    if variants is not None:
+        formula = variants.formula
+    try:
+        compiled = CompiledFormula(formula, mrf)
+    except FormulaCompilationError:
+        for res in _formula_groundings(mrf, formula if variants is None else variants, unsatfailure=unsatfailure, split=split):
+            yield res
+        return
+    truth = compiled.truth
+    evidence = mrf.evidence
+    world = list(evidence)
+    variables = {}
+    for idx, partial in ([(formula.idx, None)] if variants is None else variants.iterassignments()):
+        for values, gnd in chain.from_iterable(compiled.iterassignments(p) for p in _partials(partial, split)):
+            if unsatfailure and formula.weight == HARD and truth(evidence, gnd) == 0:
+                gf = formula.ground(mrf, dict(zip([v for v, _ in compiled.variables], values)))
+                print()
+                gf.print_structure(evidence)
+                raise SatisfiabilityException('MLN is unsatisfiable due to hard constraint violation {} (see above)'.format(mrf.formulas[idx]))
             stat = []
-            for gndatom in gf.gndatoms():
-                world = list(global_bpll_grounding.mrf.evidence)
-                var = global_bpll_grounding.mrf.variable(gndatom)
+            for atomidx in compiled.gndatom_indices(gnd):
+                if atomidx not in variables:
+                    var = mrf.variable(mrf.gndatom(atomidx))
+                    variables[atomidx] = (var, [a.idx for a in var.gndatoms])
+                var, atoms = variables[atomidx]
                 for validx, value in var.itervalues():
                     var.setval(value, world)
-                    truth = gf(world)
-                    if truth != 0:
-                        stat.append((var.idx, validx, truth))
-                    elif unsatfailure and gf.weight == HARD and gf(global_bpll_grounding.mrf.evidence) != 1:
-                        print()
-                        gf.print_structure(global_bpll_grounding.mrf.evidence)
-                        raise SatisfiabilityException('MLN is unsatisfiable due to hard constraint violation {} (see above)'.format(global_bpll_grounding.mrf.formulas[gf.idx]))
-            results.append((gf.idx, stat))
-    return results
+                    t = truth(world, gnd)
+                    if t != 0:
+                        stat.append((var.idx, validx, t))
+                for i in atoms:
+                    world[i] = evidence[i]
+            yield idx, stat
+
+
+def _formula_groundings(mrf, formula, unsatfailure=True, split=None):
+    if split is None:
+        groundings = formula.itergroundings(mrf, simplify=False)
+    else:
+        groundings = _split_groundings(mrf, formula, split)
+    world = WorldOverlay(mrf.evidence)
+    for gf in groundings:
+        stat = []
+        for gndatom in gf.gndatoms():
+            var = mrf.variable(gndatom)
+            for validx, value in var.itervalues():
+                var.setval(value, world)
+                truth = gf(world)
+                if truth != 0:
+                    stat.append((var.idx, validx, truth))
+                elif unsatfailure and gf.weight == HARD and gf(mrf.evidence) != 1:
+                    print()
+                    gf.print_structure(mrf.evidence)
+                    raise SatisfiabilityException('MLN is unsatisfiable due to hard constraint violation {} (see above)'.format(mrf.formulas[gf.idx]))
+            world.clear()
+        yield gf.idx, stat
+
+
+def _split_groundings(mrf, formula, split):
+    variants = formula if isinstance(formula, FormulaVariants) else None
+    if variants is not None:
+        formula = variants.formula
+    for idx, partial in ([(formula.idx, {})] if variants is None else variants.iterassignments()):
+        for partial_ in _partials(partial, split):
+            for assignment in formula.itervargroundings(mrf, partial=partial_):
+                gf = formula.ground(mrf, dict_union(partial_, assignment), simplify=False)
+                gf.idx = idx
+                yield gf
+
+
+class WorldOverlay(object):
+    """
+    A view of the evidence of an MRF in which the values of single ground atoms
+    can be overwritten, e.g. by :meth:`mln.mrfvars.MRFVariable.setval`, without
+    copying the evidence vector.
+    """
+
+    def __init__(self, evidence):
+        self.evidence = evidence
+        self.values = {}
+
+
+    def __getitem__(self, idx):
+        value = self.values.get(idx, self)
+        return self.evidence[idx] if value is self else value
+
+
+    def __setitem__(self, idx, value):
+        self.values[idx] = value
+
+
+    def clear(self):
+        self.values.clear()
 
 
 class BPLLGroundingFactory(FastConjunctionGrounding):
@@ -83,45 +226,49 @@ class BPLLGroundingFactory(FastConjunctionGrounding):
         self._varidx2fidx = defaultdict(set)
 
 
-    def itergroundings_fast(self, formula):
+    def itergroundings_fast(self, formula, variants=None, split=None):
         """
         Recursively generate the groundings of a conjunction. Prunes the
         generated grounding tree in case that a formula cannot be rendered
         true by subsequent literals.
+
+        If `variants` is given, `formula` is the formula shared by the
+        :class:`FormulaVariants` and the statistics of every grounding are
+        attributed to the variant it belongs to. If `split` is given, only
+        the part of the grounding space it specifies is generated (see
+        :func:`create_formula_groundings`).
         """
         # make a copy of the formula to avoid side effects
         formula = formula.ground(self.mrf, {}, partial=True)
         children = [formula] if not hasattr(formula, 'children') else formula.children
         # make equality constraints access their variable domains
-        # this is a _really_ dirty hack but it does the job ;-)
         vardoms = formula.vardoms()
-
-
-        def eqvardoms(self, v=None, c=None):
-            if v is None: v = defaultdict(set)
-            for a in self.args:
-                if self.mln.logic.isvar(a):
-                    v[a] = vardoms[a]
-            return v
-
         for child in children:
             if isinstance(child, Logic.Equality):
-                setattr(child, 'vardoms', types.MethodType(eqvardoms, child))
+                child.bind_vardoms(vardoms)
         lits = sorted(children, key=self._conjsort)
-        for gf in self._itergroundings_fast(formula, lits, 0, assignment={}, variables=[]):
-            yield gf
+        world = WorldOverlay(self.mrf.evidence)
+        for partial in _partials({}, split):
+            if variants is not None and not variants.admissible(partial):
+                continue
+            for gf in self._itergroundings_fast(formula, lits, 0, assignment=partial, variables=[], world=world, variants=variants):
+                yield gf
 
 
-    def _itergroundings_fast(self, formula, constituents, cidx, assignment, variables, falsevar=None, level=0):
+    def _itergroundings_fast(self, formula, constituents, cidx, assignment, variables, world, falsevar=None, level=0, variants=None):
         if cidx == len(constituents):
             # no remaining literals to ground. return the ground formula
             # and statistics
+            idx = formula.idx if variants is None else variants.variant(assignment)
+            if idx is None: return
             stat = [(varidx, validx, count) for (varidx, validx, count) in variables]
-            yield formula.idx, stat
+            yield idx, stat
             return
         c = constituents[cidx]
         # go through all remaining groundings of the current constituent
         for varass in c.itervargroundings(self.mrf, partial=assignment):
+            if variants is not None and not variants.admissible(varass):
+                continue
             gnd = c.ground(self.mrf, dict_union(varass, assignment))
             # check if it violates a hard constraint
             if formula.weight == HARD and gnd(self.mrf.evidence) < 1:
@@ -132,19 +279,19 @@ class BPLLGroundingFactory(FastConjunctionGrounding):
                 # grounding that follows
                 if gnd.truth(None) == 0: continue
                 for gf in self._itergroundings_fast(formula, constituents, cidx + 1, dict_union(assignment, varass),
-                                                    variables, falsevar, level + 1):
+                                                    variables, world, falsevar, level + 1, variants=variants):
                     yield gf
             else:
                 var = self.mrf.variable(gnd.gndatom)
-                world_ = list(self.mrf.evidence)
+                evidence = var.evidence_value()
                 stat = []
                 skip = False
                 falsevar_ = falsevar
                 vars_ = list(variables)
                 for validx, value in var.itervalues():
-                    var.setval(value, world_)
-                    truth = gnd(world_)
-                    if truth == 0 and value == var.evidence_value():
+                    var.setval(value, world)
+                    truth = gnd(world)
+                    if truth == 0 and value == evidence:
                         # if the evidence value renders the current
                         # consituent false and there was already a false
                         # literal in the grounding path, we can prune the
@@ -161,6 +308,7 @@ class BPLLGroundingFactory(FastConjunctionGrounding):
                             falsevar_ = var.idx
                     if truth > 0 and falsevar is None:
                         stat.append((var.idx, validx, truth))
+                world.clear()
                 if falsevar is not None and falsevar == var.idx:
                     # in case of non-mutual exclusive values take only the
                     # values that render all literals true
@@ -175,22 +323,51 @@ class BPLLGroundingFactory(FastConjunctionGrounding):
                     stat = set(variables).intersection(stat)
                     skip = not bool(stat)  # skip if no values remain
                 if skip: continue
-                for gf in self._itergroundings_fast(formula, constituents, cidx + 1, dict_union(assignment, varass), vars_ + stat, falsevar=falsevar_, level=level + 1):
+                for gf in self._itergroundings_fast(formula, constituents, cidx + 1, dict_union(assignment, varass), vars_ + stat, world, falsevar=falsevar_, level=level + 1, variants=variants):
                     yield gf
 
 
+    @property
+    def splitsize(self):
+        """
+        The minimal number of groundings of a formula for which its grounding
+        space is split into several tasks in multicore mode.
+        """
+        return ifnone(self._params.get('splitsize'), 10000)
+
+
+    def _tasks(self):
+        """
+        Yields the tasks for :func:`create_formula_groundings`. In multicore mode,
+        the grounding space of every formula with many groundings is split
+        into ranges of the domain of its first variable, so that a single
+        large formula is grounded by all worker processes.
+        """
+        processes = cpu_count() if self.multicore else 1
+        for formula in group_variants(self.formulas):
+            f = formula.formula if isinstance(formula, FormulaVariants) else formula
+            variables = [(v, d) for v, d in f.vardoms().items() if not isinstance(formula, FormulaVariants) or v not in formula.variables]
+            n = f.countgroundings(self.mrf) if variables else 0
+            if processes == 1 or n < self.splitsize:
+                yield formula, None, True
+                continue
+            varname, domname = variables[0]
+            values = list(self.mrf.domains[domname])
+            parts = min(len(values), processes * 4, int(ceil(n / float(self.splitsize))))
+            for i in range(parts):
+                yield formula, (varname, values[i * len(values) // parts:(i + 1) * len(values) // parts]), i == 0
+
+
     def _itergroundings(self, simplify=False, unsatfailure=False):
         global global_bpll_grounding
         global_bpll_grounding = self
         if self.multicore:
-            pool = Pool(maxtasksperchild=1)
+            pool = Pool(poolsize())
             try:
-                for gndresult in pool.imap(with_tracing(create_formula_groundings), self.formulas):
-                    for fidx, stat in gndresult:
-                        for (varidx, validx, val) in stat:
-                            self._varidx2fidx[varidx].add(fidx)
-                            self._addstat(fidx, varidx, validx, val)
-                        checkmem()
+                for stats, profile in pool.imap(with_tracing(create_formula_groundings), self._tasks()):
+                    if profile is not None: self.profile.merge(profile)
+                    self._mergestats(stats)
+                    checkmem()
                     yield None
             except Exception as e:
                 logger.error('Error in child process. Terminating pool...')
@@ -200,21 +377,23 @@ class BPLLGroundingFactory(FastConjunctionGrounding):
                 pool.terminate()
                 pool.join()
         else:
-            for gndresult in map(create_formula_groundings, self.formulas):
-                for fidx, stat in gndresult:
-                    for (varidx, validx, val) in stat:
-                        self._varidx2fidx[varidx].add(fidx)
-                        self._addstat(fidx, varidx, validx, val)
+            for stats, profile in map(create_formula_groundings, self._tasks()):
+                if profile is not None: self.profile.merge(profile)
+                self._mergestats(stats)
                 yield None
 
 
-    def _addstat(self, fidx, varidx, validx, inc=1):
-        if fidx not in self._stat:
-            self._stat[fidx] = {}
-        d = self._stat[fidx]
-        if varidx not in d:
-            d[varidx] = [0] * self.mrf.variable(varidx).valuecount()
-        d[varidx][validx] += inc
+    def _mergestats(self, stats):
+        for fidx, d in stats.items():
+            if fidx not in self._stat:
+                self._stat[fidx] = {}
+            stat = self._stat[fidx]
+            for varidx, counts in d.items():
+                self._varidx2fidx[varidx].add(fidx)
+                if varidx not in stat:
+                    stat[varidx] = counts
+                else:
+                    stat[varidx] = [c1 + c2 for c1, c2 in zip(stat[varidx], counts)]
 
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
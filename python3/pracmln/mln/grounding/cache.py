@@ -0,0 +1,206 @@
+# Markov Logic Networks - Memory-Bounded Cache of Ground Formulas
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import mmap
+import pickle
+import tempfile
+
+from dnutils import logs
+
+from .profile import sizeof
+from ..constants import auto
+from ...logic.common import Logic
+from ...utils.multicore import availmem
+
+
+logger = logs.getlogger(__name__)
+
+
+# the number of ground formulas that are written to disk at once
+CHUNK_SIZE = 10000
+
+# the fraction of the available memory (see utils.multicore.availmem) the
+# ground formulas kept in memory may occupy by default
+BUDGET = .5
+
+# the memory of every SAMPLE-th ground formula is measured to estimate the
+# memory of the cached ground formulas
+SAMPLE = 64
+
+
+def encode(gf):
+    """
+    Returns a compact representation of a ground formula consisting of tuples,
+    lists, strings and numbers only, in which ground atoms are represented by
+    their indices.
+    """
+    if isinstance(gf, Logic.GroundLit):
+        return (gf.gndatom.idx, gf.negated)
+    if isinstance(gf, Logic.TrueFalse):
+        return gf.value
+    if isinstance(gf, Logic.Equality):
+        return ('=', list(gf.args), gf.negated)
+    if isinstance(gf, Logic.ComplexFormula) and not isinstance(gf, Logic.Exist):
+        return (type(gf).__name__, [encode(child) for child in gf.children])
+    raise Exception('Cannot encode %s: %s' % (type(gf).__name__, str(gf)))
+
+
+def decode(code, mrf, idx=None):
+    """
+    Recreates a ground formula of the MRF `mrf` from the representation
+    returned by :func:`encode`. The ground literals of its children are the
+    ones shared by all ground formulas (see :meth:`logic.common.Logic.GroundAtom.literal`).
+
+    :param idx:    the index of the formula the ground formula belongs to.
+    """
+    mln = mrf.mln
+    logic = mln.logic
+    if type(code) is tuple:
+        if type(code[0]) is int:
+            return logic.gnd_lit(mrf.gndatom(code[0]), code[1], mln=mln, idx=idx)
+        if code[0] == '=':
+            return logic.equality(code[1], code[2], mln=mln, idx=idx)
+        children = [mrf.gndatom(c[0]).literal(c[1], mln) if type(c) is tuple and type(c[0]) is int
+                    else decode(c, mrf) for c in code[1]]
+        return logic.create(getattr(type(logic), code[0]), children, mln=mln, idx=idx)
+    return logic.true_false(code, mln=mln, idx=idx)
+
+
+class GroundingCache(object):
+    """
+    Stores ground formulas for subsequent passes over them within a memory
+    budget.
+
+    As long as the estimated memory of the cached ground formulas does not
+    exceed the budget, they are kept in memory. Beyond the budget, they are
+    encoded compactly (see :func:`encode`) and written in chunks to a
+    temporary file, which is memory-mapped and decoded chunk by chunk when
+    the ground formulas are iterated again.
+
+    :param mrf:          the MRF the ground formulas belong to.
+    :param budget:       the memory in bytes the ground formulas kept in memory may
+                         occupy, or `None` for no limit. By default, a fraction
+                         (`BUDGET`) of the memory available when the cache is created
+                         (see :func:`utils.multicore.availmem`).
+    :param chunksize:    the number of ground formulas written to disk at once.
+    """
+
+    def __init__(self, mrf, budget=auto, chunksize=CHUNK_SIZE):
+        self.mrf = mrf
+        self.budget = int(availmem() * BUDGET) if budget is auto else budget
+        self.chunksize = chunksize
+        self._memory = []
+        self._size = 0.
+        self._measured = 0
+        self._measuredsize = 0
+        # the encoded ground formulas that have not been written yet
+        self._pending = []
+        # the offset, length and number of ground formulas of every chunk in the file
+        self._chunks = []
+        self._spilled = 0
+        self._file = None
+        self._mmap = None
+
+
+    def __len__(self):
+        return len(self._memory) + self._spilled + len(self._pending)
+
+
+    @property
+    def spilled(self):
+        """
+        The number of ground formulas that are not kept in memory.
+        """
+        return self._spilled + len(self._pending)
+
+
+    def append(self, gf):
+        if not self.spilled and (self.budget is None or self._size <= self.budget):
+            self._memory.append(gf)
+            if len(self._memory) % SAMPLE == 1:
+                self._measured += 1
+                self._measuredsize += sizeof(gf)
+            self._size += self._measuredsize / self._measured
+            return
+        if not self.spilled:
+            logger.info('ground formulas exceed the memory budget of %.1f MB after %d groundings. '
+                        'Spilling them to disk...' % (self.budget / 2. ** 20, len(self._memory)))
+        self._pending.append((gf.idx, encode(gf)))
+        if len(self._pending) >= self.chunksize:
+            self._flush()
+
+
+    def _flush(self):
+        if not self._pending: return
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix='pracmln-', suffix='.gnd')
+        data = pickle.dumps(self._pending, pickle.HIGHEST_PROTOCOL)
+        self._file.seek(0, 2)
+        offset = self._file.tell()
+        self._file.write(data)
+        self._file.flush()
+        self._chunks.append((offset, len(data), len(self._pending)))
+        self._spilled += len(self._pending)
+        self._pending = []
+
+
+    def _chunk(self, i):
+        offset, length, _ = self._chunks[i]
+        if self._mmap is None or len(self._mmap) < offset + length:
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return pickle.loads(self._mmap[offset:offset + length])
+
+
+    def iterate(self, start=0):
+        """
+        Yields the ground formulas from position `start` to the end of the cache
+        at the time this method is called.
+        """
+        stop = len(self)
+        chunks = list(self._chunks)
+        pending = list(self._pending)
+        for i in range(start, min(stop, len(self._memory))):
+            yield self._memory[i]
+        pos = len(self._memory)
+        for i, (_, _, count) in enumerate(chunks):
+            if pos + count > start:
+                for idx, code in self._chunk(i)[max(0, start - pos):]:
+                    yield decode(code, self.mrf, idx)
+            pos += count
+        for idx, code in pending[max(0, start - pos):stop - pos]:
+            yield decode(code, self.mrf, idx)
+
+
+    def __iter__(self):
+        return self.iterate()
+
+
+    def close(self):
+        """
+        Removes the temporary file.
+        """
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -20,11 +20,18 @@
 # CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
 # TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import time
+
 from dnutils import logs, ProgressBar, ifnone
 
 from ..util import fstr, dict_union, StopWatch
 from ..constants import auto, HARD
 from ..errors import SatisfiabilityException
+from ...logic.common import Logic
+from .variants import group_variants
+from .profile import GroundingProfile
+from .cache import GroundingCache
+from ...utils.tracing import event
 
 
 logger = logs.getlogger(__name__)
@@ -42,6 +49,17 @@ class DefaultGroundingFactory:
                             evidence given.
     :param unsatfailure:    raises a :class:`mln.errors.SatisfiabilityException` if a 
                             hard logical constraint is violated by the evidence.
+    :param profile:         a :class:`mln.grounding.profile.GroundingProfile` the
+                            statistics of grounding are recorded in, or `True` to
+                            create a new one. Defaults to the `groundingprofile`
+                            of the MRF.
+    :param membudget:       the memory in bytes the cached ground formulas may occupy.
+                            Beyond it, they are spilled to a temporary file (see
+                            :class:`mln.grounding.cache.GroundingCache`). By default,
+                            it depends on the available memory; `None` means no limit.
+
+    If the MRF has a `sharedgrounding` (see :class:`mln.grounding.shared.SharedGrounding`),
+    the ground formulas are taken from it instead of grounding the formulas.
     """
     
     def __init__(self, mrf, simplify=False, unsatfailure=False, formulas=None, cache=auto, **params):
@@ -59,6 +77,8 @@ class DefaultGroundingFactory:
         self.watch = StopWatch()
         self.simplify = simplify
         self.unsatfailure = unsatfailure
+        profile = params.get('profile', getattr(mrf, 'groundingprofile', None))
+        self.profile = GroundingProfile() if profile is True else (None if profile is False else profile)
         
         
     @property
@@ -71,6 +91,11 @@ class DefaultGroundingFactory:
         return self._params.get('multicore', False)
     
     
+    @property
+    def membudget(self):
+        return self._params.get('membudget', auto)
+    
+    
     @property
     def iscached(self):
         return self._cache is not None and self.__cacheinit
@@ -85,7 +110,7 @@ class DefaultGroundingFactory:
         if False:#self.total_gf > self._cachesize:
             logger.warning('Number of formula groundings (%d) exceeds cache size (%d). Caching is disabled.' % (self.total_gf, self._cachesize))
         else:
-            self._cache = []
+            self._cache = GroundingCache(self.mrf, budget=self.membudget)
         self.__cacheinit = True
     
     
@@ -98,32 +123,64 @@ class DefaultGroundingFactory:
             self.grounder = iter(self._itergroundings(simplify=self.simplify, unsatfailure=self.unsatfailure))
         if self.usecache and not self.iscached:
             self._cacheinit()
-        counter = -1
+        counter = 0
+        start = time.time()
         while True:
-            counter += 1
             if self.iscached and len(self._cache) > counter:
-                yield self._cache[counter]
+                for gf in self._cache.iterate(counter):
+                    counter += 1
+                    yield gf
             elif not self.__cachecomplete:
                 try:
                     gf = next(self.grounder)
                 except StopIteration:
                     self.__cachecomplete = True
+                    event('ground.formulas', grounder=type(self).__name__, groundings=counter,
+                          duration=time.time() - start)
                     return
                 else:
                     if self._cache is not None:
                         self._cache.append(gf)
+                    counter += 1
                     yield gf
             else: return
         self.watch.finish('grounding')
         if self.verbose: print()
             
             
+    def _itersharedgroundings(self, simplify=False, unsatfailure=False):
+        """
+        Yields the ground formulas of the shared grounding of the MRF, simplified
+        with respect to the current evidence if `simplify` is `True`. Ground formulas
+        that are rendered true or false by the evidence are omitted in this case.
+        """
+        shared = self.mrf.sharedgrounding
+        evidence = self.mrf.evidence
+        for formula in self.formulas:
+            for gf in shared.groundings(formula):
+                if unsatfailure and gf.weight == HARD and gf(evidence) == 0:
+                    raise SatisfiabilityException('MLN is unsatisfiable due to hard constraint violation %s' % self.mrf.formulas[gf.idx])
+                if simplify:
+                    gf = gf.simplify(evidence)
+                    if isinstance(gf, Logic.TrueFalse): continue
+                yield gf
+
+
     def _itergroundings(self, simplify=False, unsatfailure=False):
+        if getattr(self.mrf, 'sharedgrounding', None) is not None:
+            for gf in self._itersharedgroundings(simplify=simplify, unsatfailure=unsatfailure):
+                yield gf
+            return
         if self.verbose: 
             bar = ProgressBar(color='green')
-        for i, formula in enumerate(self.formulas):
-            if self.verbose: bar.update((i+1) / float(len(self.formulas)))
-            for gndformula in formula.itergroundings(self.mrf, simplify=simplify):
+        groups = group_variants(self.formulas)
+        for i, formula in enumerate(groups):
+            if self.verbose: bar.update((i+1) / float(len(groups)))
+            # variants of a formula template are grounded as one formula
+            gndformulas = formula.itergroundings(self.mrf, simplify=simplify)
+            if self.profile is not None:
+                gndformulas = self.profile.track(self.mrf, formula, gndformulas)
+            for gndformula in gndformulas:
                 if unsatfailure and gndformula.weight == HARD and gndformula(self.mrf.evidence) == 0:
                     print()
                     gndformula.print_structure(self.mrf.evidence)
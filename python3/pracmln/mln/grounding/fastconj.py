@@ -22,18 +22,18 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 from dnutils import logs, ProgressBar
 
-import types
 from multiprocessing.pool import Pool
 
 from .default import DefaultGroundingFactory
+from .variants import FormulaVariants, group_variants
+from .profile import GroundingProfile
 from ..mlnpreds import FunctionalPredicate, SoftFunctionalPredicate, FuzzyPredicate
 from ..util import dict_union, rndbatches, cumsum
 from ..errors import SatisfiabilityException
 from ..constants import HARD
 from ...logic.common import Logic
 from ...logic.fuzzy import FuzzyLogic
-from ...utils.multicore import with_tracing
-from collections import defaultdict
+from ...utils.multicore import with_tracing, poolsize
 
 
 logger = logs.getlogger(__name__)
@@ -46,14 +46,21 @@ global_fastConjGrounding = None
 # multiprocessing function
 def create_formula_groundings(formulas):
     gfs = []
+    # the statistics are recorded separately, since this may run in a child process
+    profile = GroundingProfile() if global_fastConjGrounding.profile is not None else None
     for formula in sorted(formulas, key=global_fastConjGrounding._fsort):
+        variants = formula if isinstance(formula, FormulaVariants) else None
+        if variants is not None:
+            formula = variants.formula
         if global_fastConjGrounding.mrf.mln.logic.islitconj(formula) or global_fastConjGrounding.mrf.mln.logic.isclause(formula):
-            for gf in global_fastConjGrounding.itergroundings_fast(formula):
-                gfs.append(gf)
+            groundings = global_fastConjGrounding.itergroundings_fast(formula, variants=variants)
         else:
-            for gf in formula.itergroundings(global_fastConjGrounding.mrf, simplify=True):
-                gfs.append(gf)
-    return gfs
+            groundings = (formula if variants is None else variants).itergroundings(global_fastConjGrounding.mrf, simplify=True)
+        if profile is not None:
+            groundings = profile.track(global_fastConjGrounding.mrf, formula if variants is None else variants, groundings)
+        for gf in groundings:
+            gfs.append(gf)
+    return gfs, profile
 
 
 class FastConjunctionGrounding(DefaultGroundingFactory):
@@ -98,39 +105,30 @@ class FastConjunctionGrounding(DefaultGroundingFactory):
             return 1
 
 
-    def itergroundings_fast(self, formula):
+    def itergroundings_fast(self, formula, variants=None):
         """
         Recursively generate the groundings of a conjunction that do _not_
         have a definite truth value yet given the evidence.
+
+        If `variants` is given, `formula` is the formula shared by the
+        :class:`FormulaVariants` and every grounding is assigned the index
+        of the variant it belongs to.
         """
         # make a copy of the formula to avoid side effects
         formula = formula.ground(self.mrf, {}, partial=True, simplify=True)
         children = [formula] if not hasattr(formula, 'children') else formula.children
         # make equality constraints access their variable domains
-        # this is a _really_ dirty hack but it does the job ;-)
         variables = formula.vardoms()
-
-        def eqvardoms(self, v=None, c=None):
-            if v is None:
-                v = defaultdict(set)
-            for a in self.args:
-                if self.mln.logic.isvar(a):
-                    v[a] = variables[a]
-            return v
-
-
         for child in children:
             if isinstance(child, Logic.Equality):
-                # replace the vardoms method in this equality instance by
-                # our customized one
-                setattr(child, 'vardoms', types.MethodType(eqvardoms, child))
+                child.bind_vardoms(variables)
         lits = sorted(children, key=self._conjsort)
         truthpivot, pivotfct = (1, FuzzyLogic.min_undef) if isinstance(formula, Logic.Conjunction) else ((0, FuzzyLogic.max_undef) if isinstance(formula, Logic.Disjunction) else (None, None))
-        for gf in self._itergroundings_fast(formula, lits, 0, pivotfct, truthpivot, {}):
+        for gf in self._itergroundings_fast(formula, lits, 0, pivotfct, truthpivot, {}, variants=variants):
             yield gf
 
 
-    def _itergroundings_fast(self, formula, constituents, cidx, pivotfct, truthpivot, assignment, level=0):
+    def _itergroundings_fast(self, formula, constituents, cidx, pivotfct, truthpivot, assignment, level=0, variants=None):
         if truthpivot == 0 and (isinstance(formula, Logic.Conjunction) or self.mrf.mln.logic.islit(formula)):
             if formula.weight == HARD:
                 raise SatisfiabilityException('MLN is unsatisfiable given evidence due to hard constraint violation: {}'.format(str(formula)))
@@ -139,14 +137,21 @@ class FastConjunctionGrounding(DefaultGroundingFactory):
             return
         if cidx == len(constituents):
             # we have reached the end of the formula constituents
+            if variants is not None:
+                idx = variants.variant(assignment)
+                if idx is None: return
             gf = formula.ground(self.mrf, assignment, simplify=True)
             if isinstance(gf, Logic.TrueFalse):
                 return
+            if variants is not None:
+                gf.idx = idx
             yield gf
             return
         c = constituents[cidx]
         for varass in c.itervargroundings(self.mrf, partial=assignment):
             newass = dict_union(assignment, varass)
+            if variants is not None and not variants.admissible(newass):
+                continue
             ga = c.ground(self.mrf, newass)
             truth = ga.truth(self.mrf.evidence)
             if truth is None:
@@ -155,24 +160,30 @@ class FastConjunctionGrounding(DefaultGroundingFactory):
                 truthpivot_ = truth
             else:
                 truthpivot_ = pivotfct(truthpivot, truth)
-            for gf in self._itergroundings_fast(formula, constituents, cidx + 1, pivotfct, truthpivot_, newass, level + 1):
+            for gf in self._itergroundings_fast(formula, constituents, cidx + 1, pivotfct, truthpivot_, newass, level + 1, variants=variants):
                 yield gf
 
     def _itergroundings(self, simplify=True, unsatfailure=True):
+        if getattr(self.mrf, 'sharedgrounding', None) is not None:
+            # the groundings are always simplified and hard constraints are checked
+            for gf in self._itersharedgroundings(simplify=True, unsatfailure=True):
+                yield gf
+            return
         # generate all groundings
         if not self.formulas:
             return
         global global_fastConjGrounding
         global_fastConjGrounding = self
-        batches = list(rndbatches(self.formulas, 20))
+        batches = list(rndbatches(group_variants(self.formulas), 20))
         batchsizes = [len(b) for b in batches]
         if self.verbose:
             bar = ProgressBar(steps=sum(batchsizes), color='green')
             i = 0
         if self.multicore:
-            pool = Pool()
+            pool = Pool(poolsize())
             try:
-                for gfs in pool.imap(with_tracing(create_formula_groundings), batches):
+                for gfs, profile in pool.imap(with_tracing(create_formula_groundings), batches):
+                    if profile is not None: self.profile.merge(profile)
                     if self.verbose:
                         bar.inc(batchsizes[i])
                         bar.label(str(cumsum(batchsizes, i + 1)))
@@ -186,7 +197,8 @@ class FastConjunctionGrounding(DefaultGroundingFactory):
                 pool.terminate()
                 pool.join()
         else:
-            for gfs in map(create_formula_groundings, batches):
+            for gfs, profile in map(create_formula_groundings, batches):
+                if profile is not None: self.profile.merge(profile)
                 if self.verbose:
                     bar.inc(batchsizes[i])
                     bar.label(str(cumsum(batchsizes, i + 1)))
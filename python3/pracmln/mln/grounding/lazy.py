@@ -0,0 +1,198 @@
+# Markov Logic Networks - Lazy Grounding
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from collections import defaultdict
+
+from ..constants import HARD
+from ..errors import SatisfiabilityException, FormulaCompilationError
+from ...logic.common import Logic
+from ...logic.compiled import CompiledFormula
+
+
+class LazyGrounding(object):
+    """
+    Grounds formulas on demand, as in LazySAT.
+
+    In the default world, all ground atoms without evidence are false.
+    Initially, only the groundings that are not satisfied in this world
+    are generated. They are called *active*. An inactive grounding stays
+    satisfied as long as none of its ground atoms becomes true. When a
+    ground atom becomes true, it has to be activated by :meth:`activate`,
+    which generates all groundings it occurs in. These groundings are found
+    by indexing the literals of the formulas by their predicates and
+    matching their arguments with the arguments of the atom. The active
+    groundings therefore suffice to evaluate any world in which all true
+    atoms have been activated. In sparse relational domains they are
+    usually only a small fraction of all groundings.
+
+    Inactive groundings are enumerated by compiled evaluators (see
+    :class:`logic.compiled.CompiledFormula`) and are never instantiated.
+    Formulas that cannot be compiled are grounded completely.
+
+    :param mrf:             the MRF.
+    :param formulas:        the formulas to be grounded, e.g. the formulas of the
+                            MRF with their weights made positive.
+    :param simplify:        whether the ground formulas are simplified with respect
+                            to the evidence.
+    :param unsatfailure:    if `True`, a :class:`mln.errors.SatisfiabilityException`
+                            is raised for hard ground formulas that are false
+                            given the evidence.
+
+    :Example:
+
+    >>> lazy = LazyGrounding(mrf, mrf.formulas)
+    >>> world = lazy.world()
+    >>> gfs = list(lazy.itergroundings())
+    >>> gfs.extend(lazy.activate([i for i, v in enumerate(world) if v]))
+    """
+
+    def __init__(self, mrf, formulas, simplify=True, unsatfailure=False):
+        self.mrf = mrf
+        self.formulas = formulas
+        self.simplify = simplify
+        self.unsatfailure = unsatfailure
+        self._compiled = []
+        # predicate name -> list of (formula position, literal arguments)
+        self._index = defaultdict(list)
+        # (formula position, values of the variables) of the active groundings
+        self._active = set()
+        self._activated = set()
+        for i, f in enumerate(formulas):
+            try:
+                compiled = CompiledFormula(f, mrf)
+            except FormulaCompilationError:
+                compiled = None
+            self._compiled.append(compiled)
+            if compiled is None: continue
+            for lit in f.literals():
+                if isinstance(lit, Logic.Lit):
+                    self._index[lit.predname].append((i, lit.args))
+                elif isinstance(lit, Logic.GroundLit):
+                    self._index[lit.gndatom.predname].append((i, lit.gndatom.args))
+
+
+    @property
+    def active(self):
+        """
+        The number of active groundings of the formulas that could be compiled.
+        """
+        return len(self._active)
+
+
+    def world(self):
+        """
+        Returns the world that complies with the evidence and in which every
+        variable without evidence has the value with the fewest true ground atoms,
+        i.e. all ground atoms without evidence are false, except for the ones of
+        mutually exclusive variables.
+        """
+        world = list(self.mrf.evidence)
+        for var in self.mrf.variables:
+            evdict = var.value2dict(var.evidence_value(world))
+            if var.valuecount(evdict) > 1:
+                var.setval(min([v for _, v in var.itervalues(evdict)], key=sum), world)
+        return world
+
+
+    def itergroundings(self):
+        """
+        Yields the initially active ground formulas, i.e. the groundings that
+        are not satisfied if all atoms without evidence are false, and all
+        groundings of the formulas that could not be compiled.
+        """
+        for i, f in enumerate(self.formulas):
+            if self._compiled[i] is not None: continue
+            for gf in f.itergroundings(self.mrf, simplify=self.simplify):
+                gf = self._check(gf)
+                if gf is not None: yield gf
+        for gf in self.iterviolated([0 if v is None else v for v in self.mrf.evidence]):
+            yield gf
+
+
+    def iterviolated(self, world):
+        """
+        Activates and yields the groundings that are not active yet and
+        not satisfied in the given world.
+        """
+        for i, compiled in enumerate(self._compiled):
+            if compiled is None: continue
+            for values, gnd in compiled.iterassignments():
+                if compiled.truth(world, gnd) < 1:
+                    gf = self._ground(i, values)
+                    if gf is not None: yield gf
+
+
+    def activate(self, atoms):
+        """
+        Activates the groundings of the given ground atoms.
+
+        :param atoms:    an iterable over the indices of ground atoms that are true
+                         in the current world. Atoms with evidence and atoms that
+                         have already been activated are ignored.
+        :returns:        the list of ground formulas that have become active.
+        """
+        gfs = []
+        evidence = self.mrf.evidence
+        for atomidx in atoms:
+            if evidence[atomidx] is not None or atomidx in self._activated:
+                continue
+            self._activated.add(atomidx)
+            gndatom = self.mrf.gndatom(atomidx)
+            for i, args in self._index[gndatom.predname]:
+                partial = self._match(args, gndatom.args)
+                if partial is None: continue
+                for values, _ in self._compiled[i].iterassignments(partial):
+                    gf = self._ground(i, values)
+                    if gf is not None: gfs.append(gf)
+        return gfs
+
+
+    def _match(self, args, constants):
+        """
+        Returns the variable assignment that unifies the literal arguments
+        `args` with the constants of a ground atom, or `None` if they do not match.
+        """
+        logic = self.mrf.mln.logic
+        partial = {}
+        for arg, const in zip(args, constants):
+            if logic.isvar(arg):
+                if partial.setdefault(arg, const) != const:
+                    return None
+            elif arg != const:
+                return None
+        return partial
+
+
+    def _ground(self, i, values):
+        key = (i, values)
+        if key in self._active:
+            return None
+        self._active.add(key)
+        compiled = self._compiled[i]
+        assignment = dict(zip([v for v, _ in compiled.variables], values))
+        return self._check(self.formulas[i].ground(self.mrf, assignment, simplify=self.simplify))
+
+
+    def _check(self, gf):
+        if isinstance(gf, Logic.TrueFalse):
+            if self.unsatfailure and gf.weight == HARD and gf.truth() == 0:
+                raise SatisfiabilityException('MLN is unsatisfiable due to hard constraint violation %s' % self.mrf.formulas[gf.idx])
+            return None
+        return gf
@@ -0,0 +1,191 @@
+# Markov Logic Networks - Grounding Profiler
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import sys
+import time
+from collections import OrderedDict
+
+from ..util import elapsed_time_str
+from .variants import FormulaVariants
+from ...logic.common import Logic
+
+
+class FormulaProfile(object):
+    """
+    The grounding statistics of a single formula.
+
+    :member enumerated:    the number of groundings the grounder had to consider,
+                           i.e. the size of the grounding space of the formula.
+    :member emitted:       the number of ground formulas (or, for the BPLL grounder,
+                           statistics of ground formulas) the grounder generated.
+    :member time:          the time in seconds spent on grounding the formula.
+    :member memory:        the memory in bytes occupied by the emitted ground formulas.
+    """
+
+    def __init__(self, fidx):
+        self.fidx = fidx
+        self.enumerated = 0
+        self.emitted = 0
+        self.time = 0.
+        self.memory = 0
+
+
+    @property
+    def pruned(self):
+        """
+        The number of groundings that were not emitted, since their truth
+        value is determined by the evidence.
+        """
+        return max(0, self.enumerated - self.emitted)
+
+
+    def merge(self, other):
+        self.enumerated += other.enumerated
+        self.emitted += other.emitted
+        self.time += other.time
+        self.memory += other.memory
+
+
+def _members(obj):
+    """
+    Yields the values of the members of an object, which are stored in its
+    `__dict__` or, for the logical elements, in its `__slots__`.
+    """
+    if hasattr(obj, '__dict__'):
+        for value in vars(obj).values():
+            yield value
+    for clazz in type(obj).__mro__:
+        for name in clazz.__dict__.get('__slots__', ()):
+            if hasattr(obj, name):
+                yield getattr(obj, name)
+
+
+def sizeof(obj, seen=None):
+    """
+    Estimates the memory occupied by a ground formula or a grounding result.
+    Ground atoms, the ground literals shared by all ground formulas and any
+    other objects owned by the MRF or MLN are not counted.
+    """
+    if seen is None: seen = set()
+    if id(obj) in seen or isinstance(obj, Logic.GroundAtom) or (isinstance(obj, Logic.GroundLit) and obj.shared):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum([sizeof(o, seen) for o in obj])
+    elif isinstance(obj, dict):
+        size += sum([sizeof(k, seen) + sizeof(v, seen) for k, v in obj.items()])
+    elif isinstance(obj, Logic.Constraint):
+        size += sum([sizeof(v, seen) for v in _members(obj) if isinstance(v, (list, tuple, dict, str, int, float, Logic.Constraint))])
+    return size
+
+
+class GroundingProfile(object):
+    """
+    Collects the statistics of grounding per formula: how many groundings
+    were enumerated, pruned by the evidence and emitted, the time spent on
+    them and the memory of the emitted ground formulas.
+
+    A profile is passed to a grounding factory by the `profile` parameter or
+    attached to an MRF as its `groundingprofile`, in which case all grounding
+    factories working on the MRF record their statistics in it.
+
+    :Example:
+
+    >>> mrf = mln.ground(db)
+    >>> mrf.groundingprofile = GroundingProfile()
+    >>> MCSAT(mrf, queries='Cancer').run()
+    >>> mrf.groundingprofile.write(mrf.formulas, top=10)
+    """
+
+    def __init__(self):
+        self.formulas = OrderedDict()
+
+
+    def __getitem__(self, fidx):
+        if fidx not in self.formulas:
+            self.formulas[fidx] = FormulaProfile(fidx)
+        return self.formulas[fidx]
+
+
+    def __len__(self):
+        return len(self.formulas)
+
+
+    def merge(self, other):
+        """
+        Adds the statistics of another profile, e.g. one recorded in a child process.
+        """
+        for fidx, prof in other.formulas.items():
+            self[fidx].merge(prof)
+
+
+    def track(self, mrf, formula, groundings, enumerated=True):
+        """
+        Records the statistics of the groundings of `formula` generated by the
+        iterable `groundings` and yields them. The time spent on a grounding is
+        attributed to the formula it belongs to, i.e. to the respective variant
+        if `formula` is a :class:`mln.grounding.variants.FormulaVariants` instance.
+
+        :param groundings:    an iterable over ground formulas or tuples whose first
+                              element is the index of the formula.
+        :param enumerated:    whether the size of the grounding space of `formula` is
+                              to be recorded, which is `False` for all but the first
+                              of the parts a grounding space is split into.
+        """
+        fidxs = [idx for idx, _ in formula.iterassignments()] if isinstance(formula, FormulaVariants) else [formula.idx]
+        for fidx in fidxs:
+            if enumerated:
+                self[fidx].enumerated += mrf.formulas[fidx].countgroundings(mrf)
+        fidx = fidxs[0]
+        start = time.time()
+        for gnd in groundings:
+            fidx = gnd[0] if isinstance(gnd, tuple) else gnd.idx
+            prof = self[fidx]
+            prof.time += time.time() - start
+            prof.emitted += 1
+            prof.memory += sizeof(gnd)
+            yield gnd
+            start = time.time()
+        self[fidx].time += time.time() - start
+
+
+    def items(self, sort='time'):
+        """
+        Returns the profiles of the formulas sorted by one of their members,
+        `'time'`, `'enumerated'`, `'pruned'`, `'emitted'` or `'memory'`,
+        in descending order.
+        """
+        return sorted(self.formulas.values(), key=lambda p: getattr(p, sort), reverse=True)
+
+
+    def write(self, formulas, stream=sys.stdout, sort='time', top=None):
+        """
+        Writes a report of the grounding statistics.
+
+        :param formulas:    the formulas of the MRF the profile was recorded for.
+        :param sort:        the member to sort the formulas by (see :meth:`items`).
+        :param top:         the number of formulas to report, all by default.
+        """
+        stream.write('%12s %12s %12s %12s %12s  %s\n' % ('enumerated', 'pruned', 'emitted', 'time', 'memory', 'formula'))
+        for prof in self.items(sort)[:top]:
+            stream.write('%12d %12d %12d %12s %10.1fKB  %s\n' % (prof.enumerated, prof.pruned, prof.emitted,
+                                                                elapsed_time_str(prof.time), prof.memory / 1024.,
+                                                                str(formulas[prof.fidx])))
@@ -0,0 +1,69 @@
+# Markov Logic Networks - Evidence-Independent Shared Grounding
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from dnutils import logs
+
+
+logger = logs.getlogger(__name__)
+
+
+class SharedGrounding(object):
+    """
+    Stores the groundings of formulas that are not simplified with respect
+    to the evidence, so that they can be reused for several evidence
+    databases over the same domains.
+
+    A shared grounding is attached to an MRF as its `sharedgrounding`, in
+    which case all grounding factories working on the MRF take the ground
+    formulas from it and only simplify them with respect to the current
+    evidence, instead of grounding the formulas again. Formulas are grounded
+    on their first request. Since inference methods may transform the
+    formulas of the MRF, e.g. into negation normal form, the groundings are
+    stored per formula index and string representation.
+
+    :Example:
+
+    >>> mrf.sharedgrounding = SharedGrounding(mrf)
+    >>> for db in dbs:
+    ...     mrf.set_evidence(db.evidence, erase=True)
+    ...     MCSAT(mrf, queries='Cancer').run()
+    """
+
+    def __init__(self, mrf):
+        self.mrf = mrf
+        self._groundings = {}
+
+
+    def __len__(self):
+        return sum(map(len, self._groundings.values()))
+
+
+    def groundings(self, formula):
+        """
+        Returns the list of the ground formulas of `formula`, which are
+        not simplified.
+        """
+        key = (formula.idx, str(formula))
+        gfs = self._groundings.get(key)
+        if gfs is None:
+            gfs = list(formula.itergroundings(self.mrf, simplify=False))
+            self._groundings[key] = gfs
+            logger.debug('%d shared groundings of %s' % (len(gfs), str(formula)))
+        return gfs
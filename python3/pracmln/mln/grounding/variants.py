@@ -0,0 +1,237 @@
+# Markov Logic Networks - Shared Grounding of Formula Variants
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from collections import OrderedDict
+
+from ..constants import HARD
+from ..util import dict_union
+from ...logic.common import Logic
+
+
+class FormulaVariants(object):
+    """
+    A group of formulas that are identical up to the constants at some
+    of their literal arguments, such as the variants a formula template
+    with '+' variables is expanded to.
+
+    The variants are grounded as a single formula, in which the varying
+    constants are replaced by variables. Every grounding is dispatched to
+    the variant it belongs to by the values of these variables.
+
+    :member formula:      the formula shared by all variants, with the varying
+                          constants replaced by the variables in `variables`.
+                          Its index is the one of the first variant.
+    :member variables:    the names of the variables that distinguish the variants.
+    :member variants:     an ordered dict mapping the tuples of values of `variables`
+                          to the indices of the respective variant formulas.
+    """
+
+    def __init__(self, formula, variables, variants):
+        self.formula = formula
+        self.variables = variables
+        self.variants = variants
+        self.domains = dict([(v, set([values[i] for values in variants])) for i, v in enumerate(variables)])
+
+
+    @property
+    def idx(self):
+        return self.formula.idx
+
+
+    @property
+    def weight(self):
+        return self.formula.weight
+
+
+    def __len__(self):
+        return len(self.variants)
+
+
+    def variant(self, assignment):
+        """
+        Returns the index of the variant formula the given variable assignment
+        belongs to, or `None` if it does not belong to any of the variants.
+        """
+        return self.variants.get(tuple([assignment.get(v) for v in self.variables]))
+
+
+    def admissible(self, assignment):
+        """
+        Checks if the given (partial) variable assignment can still be
+        extended to an assignment that belongs to one of the variants.
+        """
+        for v in self.variables:
+            if v in assignment and assignment[v] not in self.domains[v]:
+                return False
+        return True
+
+
+    def iterassignments(self):
+        """
+        Yields pairs `(idx, assignment)` of the variant indices and the
+        assignments of :attr:`variables` that turn the shared formula into
+        the respective variant.
+        """
+        for values, idx in self.variants.items():
+            yield idx, dict(zip(self.variables, values))
+
+
+    def itergroundings(self, mrf, simplify=False):
+        """
+        Yields the groundings of all variants, in the same order as if the
+        variants were grounded one after another.
+        """
+        for idx, partial in self.iterassignments():
+            for assignment in self.formula.itervargroundings(mrf, partial=partial):
+                gf = self.formula.ground(mrf, dict_union(partial, assignment), simplify=simplify)
+                gf.idx = idx
+                yield gf
+
+
+def _signature(formula, logic, constants):
+    """
+    Computes a hashable representation of the structure of `formula` in which
+    all constants in the arguments of its literals are left blank. The constants
+    are appended to `constants` as `(value, domain)` pairs in the order of
+    their appearance.
+
+    Returns `None` if the formula contains constituents that cannot be lifted.
+    """
+    if isinstance(formula, Logic.Lit):
+        if formula.negated not in (True, False):
+            return None
+        argdoms = formula.mln.predicate(formula.predname).argdoms
+        args = []
+        for arg, dom in zip(formula.args, argdoms):
+            if logic.isvar(arg):
+                args.append(arg)
+            else:
+                args.append(None)
+                constants.append((arg, dom))
+        return ('lit', formula.negated, formula.predname, tuple(args))
+    elif isinstance(formula, Logic.GroundLit):
+        return ('gndlit', formula.negated, str(formula.gndatom))
+    elif isinstance(formula, Logic.TrueFalse):
+        return ('truefalse', formula.value)
+    elif isinstance(formula, Logic.Equality):
+        return ('eq', formula.negated, tuple(formula.args))
+    elif isinstance(formula, Logic.Exist):
+        child = _signature(formula.children[0], logic, constants)
+        if child is None: return None
+        return ('exist', tuple(formula.vars), child)
+    elif isinstance(formula, Logic.ComplexFormula):
+        children = []
+        for child in formula.children:
+            child = _signature(child, logic, constants)
+            if child is None: return None
+            children.append(child)
+        return (type(formula).__name__, tuple(children))
+    return None
+
+
+def _lift(formula, logic, replacements, pos):
+    """
+    Rebuilds `formula`, replacing its `i`-th constant literal argument by the
+    variable `replacements[i]`, unless it is `None`. `pos` is a one-element
+    list holding the number of constant arguments visited so far.
+    """
+    mln = formula.mln
+    if isinstance(formula, Logic.Lit):
+        args = []
+        for arg in formula.args:
+            if logic.isvar(arg):
+                args.append(arg)
+            else:
+                args.append(arg if replacements[pos[0]] is None else replacements[pos[0]])
+                pos[0] += 1
+        return logic.lit(formula.negated, formula.predname, args, mln=mln)
+    elif isinstance(formula, (Logic.GroundLit, Logic.TrueFalse, Logic.Equality)):
+        return formula.copy(idx=None)
+    elif isinstance(formula, Logic.Exist):
+        return logic.exist(list(formula.vars), _lift(formula.children[0], logic, replacements, pos), mln=mln)
+    return logic.create(type(formula), [_lift(c, logic, replacements, pos) for c in formula.children], mln=mln)
+
+
+def _variants(formulas, logic):
+    # collect the distinct constant columns and replace the ones that vary
+    # among the formulas by variables. columns with identical values and
+    # domains are replaced by the same variable.
+    columns = list(zip(*[constants for _, constants in formulas]))
+    replacements = []
+    variables = OrderedDict()
+    for column in columns:
+        values = tuple([value for value, _ in column])
+        if len(set(values)) == 1:
+            replacements.append(None)
+            continue
+        key = (values, column[0][1])
+        if key not in variables:
+            variables[key] = '+_%d' % len(variables)
+        replacements.append(variables[key])
+    f0 = formulas[0][0]
+    lifted = _lift(f0, logic, replacements, [0])
+    lifted.idx = f0.idx
+    variants = OrderedDict()
+    for i, (f, _) in enumerate(formulas):
+        variants[tuple([values[i] for values, _ in variables])] = f.idx
+    return FormulaVariants(lifted, list(variables.values()), variants)
+
+
+def group_variants(formulas):
+    """
+    Groups the given formulas into :class:`FormulaVariants` of formulas
+    that differ only in the constants of their literals, e.g. the variants
+    of a formula template.
+
+    :param formulas:    a list of formulas of an MRF.
+    :returns:           a list containing the formulas that have no variants
+                        as they are, and a :class:`FormulaVariants` instance
+                        at the position of the first formula of every group.
+    """
+    groups = OrderedDict()
+    result = []
+    for f in formulas:
+        if f.idx is None:
+            result.append(f)
+            continue
+        constants = []
+        sig = _signature(f, f.mln.logic, constants)
+        if sig is None:
+            result.append(f)
+            continue
+        key = (sig, tuple([dom for _, dom in constants]), f.weight == HARD)
+        values = tuple([value for value, _ in constants])
+        # formulas that coincide with a member of the group (e.g. duplicates)
+        # cannot be told apart by their constants and start a new group
+        while key in groups and values in groups[key][1]:
+            key = key + (None,)
+        if key not in groups:
+            groups[key] = ([], set())
+            result.append(key)
+        groups[key][0].append((f, constants))
+        groups[key][1].add(values)
+    for i, item in enumerate(result):
+        if not isinstance(item, tuple): continue
+        members = groups[item][0]
+        if len(members) == 1:
+            result[i] = members[0][0]
+        else:
+            result[i] = _variants(members, members[0][0].mln.logic)
+    return result
@@ -3,6 +3,7 @@ from .exact import EnumerationAsk
 from .mcsat import MCSAT, SampleSAT
 from .gibbs import GibbsSampler
 # from ipfpm import IPFPM
-from .maxwalk import SAMaxWalkSAT
+from .maxwalk import SAMaxWalkSAT, MaxWalkSAT
 from .wcspinfer import WCSPInference
 from .infer import Inference
+from .batch import BatchInference
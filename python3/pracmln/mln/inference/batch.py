@@ -0,0 +1,160 @@
+# Markov Logic Networks -- Batched Inference
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from collections import OrderedDict
+from multiprocessing import Pool
+
+from dnutils import logs
+
+from ..constants import ALL
+from ..database import Database
+from ..util import mergedom
+from ..grounding.shared import SharedGrounding
+from ...utils.multicore import with_tracing, poolsize
+
+
+logger = logs.getlogger(__name__)
+
+# this readonly global is for multiprocessing to exploit copy-on-write
+# on linux systems
+global_batch = None
+
+
+def _infer(args):
+    """
+    Runs the inference for a single database of the batch.
+    """
+    i, mrfidx = args
+    return global_batch.infer(global_batch.mrfs[mrfidx], global_batch.dbs[i], multicore=False)
+
+
+class BatchInference(object):
+    """
+    Runs an inference method for a list of evidence databases, grounding
+    the MLN only once for all databases sharing the same domains.
+
+    For every group of databases with the same domains, the MLN is
+    materialized and its ground atoms and variables are created once.
+    The evidence of the resulting MRF is then replaced by the evidence of
+    every database in turn and the inference method is run on it. The
+    formulas are grounded only once per group without simplification
+    (see :class:`mln.grounding.shared.SharedGrounding`), and the ground
+    formulas are merely simplified with respect to the evidence of every
+    database. Inference methods that ground lazily (`lazy=True`) do not
+    use the shared grounding.
+
+    :param mln:        the (learnt) MLN.
+    :param dbs:        a list of :class:`mln.database.Database` objects.
+    :param method:     the inference method, either a subclass of
+                       :class:`mln.inference.Inference` or its name as in
+                       :class:`mln.methods.InferenceMethods`.
+    :param queries:    the queries that are passed to every inference run.
+
+    Additional keyword parameters are passed to the inference method. If
+    `multicore` is `True`, the databases are distributed over a process
+    pool and the individual inference runs are single-threaded. The first
+    database of every group is processed beforehand, so that the workers
+    inherit the ground formulas.
+
+    :Example:
+
+    >>> results = BatchInference(mln, dbs, 'MC-SAT', queries='Cancer').run()
+    >>> results[0]['Cancer(Anna)']
+    """
+
+    def __init__(self, mln, dbs, method='MC-SAT', queries=ALL, **params):
+        from ..methods import InferenceMethods # avoid a circular import
+        self.mln = mln
+        self.dbs = [db if isinstance(db, Database) else Database.load(mln, db)[0] for db in dbs]
+        self.method = InferenceMethods.clazz(method) if isinstance(method, str) else method
+        self.queries = queries
+        self._params = params
+        self.mrfs = []
+
+
+    @property
+    def multicore(self):
+        return self._params.get('multicore', False)
+
+
+    def _ground(self):
+        """
+        Groups the databases by their domains and materializes and grounds the
+        MLN once per group.
+
+        :returns:    a list containing the index of the MRF of every database.
+        """
+        groups = OrderedDict()
+        mrfidx = []
+        for db in self.dbs:
+            domains = mergedom(self.mln.domains, db.domains)
+            key = tuple(sorted([(dom, tuple(sorted(values))) for dom, values in domains.items()]))
+            if key not in groups:
+                groups[key] = len(self.mrfs)
+                mrf = self.mln.materialize(db).ground(db)
+                mrf.sharedgrounding = SharedGrounding(mrf)
+                self.mrfs.append(mrf)
+            mrfidx.append(groups[key])
+        logger.debug('grounded %d MRFs for %d databases' % (len(self.mrfs), len(self.dbs)))
+        return mrfidx
+
+
+    def infer(self, mrf, db, **params):
+        """
+        Sets the evidence of `db` in `mrf` and runs the inference method on it.
+
+        :returns:    the dict of inference results.
+        """
+        mrf.erase()
+        mrf.set_evidence(dict([(atom, value) for atom, value in db.evidence.items() if mrf.gndatom(atom) is not None]), erase=False)
+        params = dict(self._params, **params)
+        return dict(self.method(mrf, self.queries, **params).run().results)
+
+
+    def run(self):
+        """
+        Runs the inference for all databases.
+
+        :returns:    a list of result dicts mapping the query atoms to their
+                     probabilities (or truth values), one for each database
+                     in the order they were given.
+        """
+        mrfidx = self._ground()
+        if self.multicore and len(self.dbs) > 1:
+            results = [None] * len(self.dbs)
+            first = [mrfidx.index(m) for m in range(len(self.mrfs))]
+            for i in first:
+                results[i] = self.infer(self.mrfs[mrfidx[i]], self.dbs[i], multicore=False)
+            global global_batch
+            global_batch = self
+            pool = Pool(poolsize())
+            try:
+                rest = [(i, m) for i, m in enumerate(mrfidx) if i not in first]
+                for (i, _), result in zip(rest, pool.imap(with_tracing(_infer), rest)):
+                    results[i] = result
+                return results
+            except Exception as e:
+                logger.error('Error in child process. Terminating pool...')
+                pool.close()
+                raise e
+            finally:
+                pool.terminate()
+                pool.join()
+        return [self.infer(self.mrfs[m], db) for db, m in zip(self.dbs, mrfidx)]
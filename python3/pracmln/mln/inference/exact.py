@@ -23,6 +23,8 @@
 # CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
 # TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import time
+
 from dnutils import logs, ProgressBar
 
 from .infer import Inference
@@ -32,7 +34,7 @@ from ..constants import auto, HARD
 from ..errors import SatisfiabilityException
 from ..grounding.fastconj import FastConjunctionGrounding
 from ..util import Interval, colorize
-from ...utils.multicore import with_tracing
+from ...utils.multicore import with_tracing, poolsize
 from ...logic.fol import FirstOrderLogic
 from ...logic.common import Logic
 from numpy.ma.core import exp
@@ -78,6 +80,13 @@ class EnumerationAsk(Inference):
     """
     Inference based on enumeration of (only) the worlds compatible with the
     evidence; supports soft evidence (assuming independence)
+
+    Additional keyword parameters:
+
+    :param fallback:    the inference method that is run on the remaining time
+                        budget if the enumeration of the worlds is expected to
+                        exceed it (see `timeout`). If `None`, an exception is raised
+                        instead (default: `'GibbsSampler'`).
     """
 
     def __init__(self, mrf, queries, **params):
@@ -91,6 +100,41 @@ class EnumerationAsk(Inference):
             variable.consistent(self.mrf.evidence, strict=isinstance(variable, FuzzyVariable))
 
 
+    @property
+    def fallback(self):
+        return self._params.get('fallback', 'GibbsSampler')
+
+
+    def _overbudget(self, start, k, worlds):
+        """
+        Returns whether the enumeration of all `worlds` is expected to exceed the
+        time budget after `k` worlds have been enumerated since `start`.
+        """
+        if self._deadline is None or k < 10:
+            return False
+        return (time.time() - start) / k * (worlds - k) > self.timeleft
+
+
+    def _fallback(self):
+        """
+        Runs the fallback inference method on the remaining time budget.
+        """
+        if self.fallback is None:
+            raise Exception('The enumeration of the possible worlds cannot be completed within the time budget.')
+        from ..methods import InferenceMethods # avoid a circular import
+        logger.warning('enumeration exceeds the time budget, falling back to %s' % self.fallback)
+        callback = None
+        if self.callback is not None:
+            def callback(snapshot):
+                info = dict([(k, v) for k, v in snapshot.items() if k not in ('results', 'time', 'final')])
+                self._progress(snapshot['results'], fallback=self.fallback, **info)
+        params = self._params + {'timeout': self.timeleft, 'callback': callback}
+        infer = InferenceMethods.clazz(self.fallback)(self.mrf, [str(q) for q in self.queries], **params)
+        results = infer.run().results
+        self.timedout = True
+        return results
+
+
     def _run(self):
         """
         verbose: whether to print results (or anything at all, in fact)
@@ -128,8 +172,10 @@ class EnumerationAsk(Inference):
         bar = None
         if self.verbose:
             bar = ProgressBar(steps=worlds, color='green')
+        start = time.time()
+        exceeded = False
         if self.multicore:
-            pool = Pool()
+            pool = Pool(poolsize())
             logger.debug('Using multiprocessing on {} core(s)...'.format(pool._processes))
             try:
                 for num, denum in pool.imap(with_tracing(eval_queries), self.mrf.worlds()):
@@ -138,6 +184,9 @@ class EnumerationAsk(Inference):
                     for i, v in enumerate(num):
                         numerators[i] += v
                     if self.verbose: bar.inc()
+                    if self._overbudget(start, k, worlds):
+                        exceeded = True
+                        break
             except Exception as e:
                 logger.error('Error in child process. Terminating pool...')
                 pool.close()
@@ -155,8 +204,13 @@ class EnumerationAsk(Inference):
                 k += 1
                 if self.verbose:
                     bar.update(float(k) / worlds)
-        logger.debug("%d worlds enumerated" % k)
+                if self._overbudget(start, k, worlds):
+                    exceeded = True
+                    break
         self._watch.finish('enumerating worlds')
+        if exceeded:
+            return self._fallback()
+        logger.debug("%d worlds enumerated" % k)
         if 'grounding' in self.grounder.watch.tags:
             self._watch.tags['grounding'] = self.grounder.watch['grounding']
         if denominator == 0:
@@ -24,27 +24,56 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import random
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from itertools import product
 
 import numpy
-from dnutils import ProgressBar
+from dnutils import ProgressBar, logs
 
 from .mcmc import MCMCInference
 from ..constants import ALL
 from ..grounding.fastconj import FastConjunctionGrounding
 from ...logic.common import Logic
+from ...utils.tracing import span
+
+
+logger = logs.getlogger(__name__)
 
 
 class GibbsSampler(MCMCInference):
+    """
+    Gibbs sampling. The conditional distributions a variable is sampled
+    from are also used for the Rao-Blackwellized estimates of the queries
+    (see :class:`mln.inference.mcmc.MCMCInference`).
+
+    Additional keyword parameters:
+
+    :param blocked:        (bool) if `True`, variables that are coupled by hard ground
+                           formulas or ground formulas with large weights are grouped
+                           into blocks, whose values are sampled jointly from their
+                           conditional distribution given the Markov blanket of the
+                           block. It is computed by enumerating the joint values of
+                           the block. Blocked sampling mixes considerably faster if
+                           single variables can hardly change their values.
+    :param blocksize:      the maximal number of joint values of a block (default: 32).
+    :param blockweight:    the minimal absolute weight of a ground formula for its
+                           variables to be grouped into a block (default: 2).
+    """
 
     def __init__(self, mrf, queries=ALL, **params):
         MCMCInference.__init__(self, mrf, queries, **params)
-        self.var2gf = defaultdict(set)
-        grounder = FastConjunctionGrounding(mrf, simplify=True, unsatfailure=True, cache=None)
-        for gf in grounder.itergroundings():
-            if isinstance(gf, Logic.TrueFalse): continue
-            vars_ = set([self.mrf.variable(a).idx for a in gf.gndatoms()])
-            for v in vars_: self.var2gf[v].add(gf)
+        self.var2gf = defaultdict(list)
+        with span('infer.setup', method=type(self).__name__):
+            grounder = FastConjunctionGrounding(mrf, simplify=True, unsatfailure=True, cache=None)
+            for gf in grounder.itergroundings():
+                if isinstance(gf, Logic.TrueFalse): continue
+                vars_ = set([self.mrf.variable(a).idx for a in gf.gndatoms()])
+                for v in vars_: self.var2gf[v].append(gf)
+            if self.blocked:
+                self.blocks = self._blocks()
+                logger.debug('sampling %d variables in %d blocks' % (sum(map(len, self.blocks)), len(self.blocks)))
+            else:
+                self.blocks = [[var] for var in self.mrf.variables]
     
     @property
     def chains(self):
@@ -53,44 +82,144 @@ class GibbsSampler(MCMCInference):
     @property
     def maxsteps(self):
         return self._params.get('maxsteps', 500)
+
+
+    @property
+    def blocked(self):
+        return self._params.get('blocked', False)
+
+
+    @property
+    def blocksize(self):
+        return self._params.get('blocksize', 32)
+
+
+    @property
+    def blockweight(self):
+        return self._params.get('blockweight', 2)
+
+
+    def _blocks(self):
+        """
+        Groups the variables without evidence into blocks. The ground formulas
+        that are hard or have an absolute weight of at least `blockweight` are
+        processed in the order of decreasing weights, and the blocks of their
+        variables are merged as long as the number of joint values of the merged
+        block does not exceed `blocksize`.
+
+        :returns:    the list of blocks, i.e. lists of variables, ordered by their
+                     first variables.
+        """
+        evidence = self.mrf.evidence
+        # the number of joint values of the blocks, indexed by their representative variables
+        size = {}
+        for var in self.mrf.variables:
+            valuecount = var.valuecount(evidence)
+            if valuecount > 1:
+                size[var.idx] = valuecount
+        parent = dict([(v, v) for v in size])
+        def find(v):
+            while parent[v] != v:
+                parent[v] = parent[parent[v]]
+                v = parent[v]
+            return v
+        gfs = dict([(id(gf), gf) for gfs in self.var2gf.values() for gf in gfs]).values()
+        strong = [gf for gf in gfs if gf.ishard or abs(gf.weight) >= self.blockweight]
+        for gf in sorted(strong, key=lambda gf: float('inf') if gf.ishard else abs(gf.weight), reverse=True):
+            roots = list(set([find(v) for v in [self.mrf.variable(a).idx for a in gf.gndatoms()] if v in size]))
+            if len(roots) < 2: continue
+            joint = 1
+            for r in roots: joint *= size[r]
+            if joint > self.blocksize: continue
+            for r in roots[1:]: parent[r] = roots[0]
+            size[roots[0]] = joint
+        blocks = OrderedDict()
+        for var in self.mrf.variables:
+            if var.idx in parent:
+                blocks.setdefault(find(var.idx), []).append(var)
+        return list(blocks.values())
+
+
+    def _blockprobs(self, block, world):
+        """
+        Returns the joint values of the variables in `block` and their conditional
+        probabilities given the Markov blanket of the block. A joint value is a
+        tuple of the (index, value) pairs of the variables.
+        """
+        gfs = dict([(id(gf), gf) for var in block for gf in self.var2gf[var.idx]]).values()
+        old = [tuple(var.evidence_value(world)) for var in block]
+        assignments = list(product(*[list(var.itervalues(self.mrf.evidence)) for var in block]))
+        sums = []
+        for assignment in assignments:
+            for var, (_, value) in zip(block, assignment):
+                var.setval(value, world)
+            s = 0
+            for gf in gfs:
+                truth = gf(world)
+                if gf.ishard:
+                    if truth == 0:
+                        s = None
+                        break
+                else:
+                    s += gf.weight * truth
+            sums.append(s)
+        for var, value in zip(block, old):
+            var.setval(value, world)
+        if all([s is None for s in sums]):
+            # as in MCMCInference._valueprobs, the joint values are equally likely
+            sums = [0] * len(sums)
+        m = max([s for s in sums if s is not None] or [0])
+        expsums = numpy.array([numpy.exp(s - m) if s is not None else 0 for s in sums])
+        return assignments, expsums / sum(expsums)
     
 
     class Chain(MCMCInference.Chain):
     
         def __init__(self, infer, queries):
             MCMCInference.Chain.__init__(self, infer, queries)
-            mrf = infer.mrf
-            
-        def _valueprobs(self, var, world):
-            sums = [0] * var.valuecount()
-            for gf in self.infer.var2gf[var.idx]:
-                possible_values = []
-                for i, value in var.itervalues(self.infer.mrf.evidence):
-                    possible_values.append(i)
-                    world_ = var.setval(value, list(world))
-                    truth = gf(world_)
-                    if truth == 0 and gf.ishard:
-                        sums[i] = None
-                    elif sums[i] is not None and not gf.ishard:
-                        sums[i] += gf.weight * truth
-                # set all impossible values to None (i.e. prob 0) since they
-                # might still be have a value of 0 in sums 
-                for i in [j for j in range(len(sums)) if j not in possible_values]: sums[i] = None
-            expsums = numpy.array([numpy.exp(s) if s is not None else 0 for s in sums])
-            Z = sum(expsums) 
-            probs = expsums / Z
-            return probs
+            # the distributions the variables have been sampled from in the last step
+            self._probs = {}
+
+
+        def _condprobs(self, var):
+            if var.idx in self._probs:
+                return self._probs[var.idx]
+            return MCMCInference.Chain._condprobs(self, var)
+
+        
+        def _sampleblock(self, block):
+            """
+            Samples the joint value of the variables in a block.
+            """
+            assignments, probs = self.infer._blockprobs(block, self.state)
+            r = random.uniform(0, 1)
+            idx = 0
+            s = probs[0]
+            while r > s and idx < len(probs) - 1:
+                idx += 1
+                s += probs[idx]
+            for i, (var, (_, value)) in enumerate(zip(block, assignments[idx])):
+                var.setval(value, self.state)
+                # the marginal distribution of the variable for the Rao-Blackwellized estimates
+                marginal = numpy.zeros(var.valuecount())
+                for assignment, p in zip(assignments, probs):
+                    marginal[assignment[i][0]] += p
+                self._probs[var.idx] = marginal
+
         
         def step(self):
-            mrf = self.infer.mrf
             # reassign values by sampling from the conditional distributions given the Markov blanket
-            state = list(self.state)
-            for var in mrf.variables:
+            for block in self.infer.blocks:
+                if len(block) > 1:
+                    self._sampleblock(block)
+                    continue
+                var = block[0]
                 # compute distribution to sample from
                 values = list(var.values())
                 if len(values) == 1: # do not sample if we have evidence 
                     continue  
-                probs = self._valueprobs(var, self.state)
+                probs = self.infer._valueprobs(var, self.state)
+                self._probs[var.idx] = probs
                 # check for soft evidence and greedily satisfy it if possible                
                 idx = None
 #                 if isinstance(var, BinaryVariable):
@@ -147,6 +276,9 @@ class GibbsSampler(MCMCInference):
             if self.verbose:
                 bar.inc()
                 bar.label('%d / %d' % (steps, self.maxsteps))
+            if self._due():
+                self._chainprogress(chains, steps)
+            if self.expired: break
 #                 if self.useConvergenceTest:
 #                     if chain.converged and numSteps >= minSteps:
 #                         converged += 1
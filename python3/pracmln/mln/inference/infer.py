@@ -30,9 +30,14 @@ from ..constants import ALL
 from ..mrfvars import MutexVariable, SoftMutexVariable, FuzzyVariable
 from ..util import StopWatch, elapsed_time_str, headline, tty, edict
 import sys
+import time
+import queue
+import threading
+import numpy
 from ..errors import NoSuchPredicateError
 from ..mlnpreds import SoftFunctionalPredicate, FunctionalPredicate
 from functools import reduce
+from ...utils.tracing import span
 
 logger = logs.getlogger(__name__)
 
@@ -53,6 +58,15 @@ class Inference(object):
     
     :param cw:         (bool) if `True`, the closed-world assumption will be applied 
                        to all but the query atoms.
+    :param timeout:    (optional) time budget of the inference in seconds. When it
+                       is exhausted, the inference stops and returns the results
+                       obtained so far, and :attr:`timedout` is set.
+    :param callback:   (optional) function that is called with snapshots of the
+                       intermediate results, i.e. dicts with the members `results`,
+                       `time` (the seconds since the start of the inference) and
+                       `final`, plus estimates of the convergence depending on the
+                       inference method. The last snapshot has `final` set to `True`.
+    :param interval:   the minimal time in seconds between two snapshots (default: 0.1).
     """
     
     def __init__(self, mrf, queries=ALL, **params):
@@ -67,10 +81,8 @@ class Inference(object):
                 queries = [queries]
             self.queries = self._expand_queries(queries)
         # fill in the missing truth values of variables that have only one remaining value
-        for variable in self.mrf.variables:
-            if variable.valuecount(self.mrf.evidence_dicti()) == 1: # the var is fully determined by the evidence
-                for _, value in variable.itervalues(self.mrf.evidence): break
-                self.mrf.set_evidence(variable.value2dict(value), erase=False)
+        evidence = numpy.array(self.mrf.evidence, dtype=float) # unknown truth values become nan
+        self._fill_determined_vars(evidence)
         # apply the closed world assumptions to the explicitly specified predicates
         if self.cwpreds:
             for pred in self.cwpreds:
@@ -78,25 +90,26 @@ class Inference(object):
                     if self.verbose: logger.warning('Closed world assumption will be applied to soft functional predicate %s' % pred)
                 elif isinstance(self.mln.predicate(pred), FunctionalPredicate):
                     raise Exception('Closed world assumption is inapplicable to functional predicate %s' % pred)
-                for gndatom in self.mrf.gndatoms:
-                    if gndatom.predname != pred: continue
-                    if self.mrf.evidence[gndatom.idx] is None:
-                        self.mrf.evidence[gndatom.idx] = 0
+                self._apply_cw(evidence, pred)
         # apply the closed world assumption to all remaining ground atoms that are not in the queries
         if self.closedworld:
             qpreds = set()
             for q in self.queries:
                 qpreds.update(q.prednames())
-            for gndatom in self.mrf.gndatoms:
-                if isinstance(self.mln.predicate(gndatom.predname), FunctionalPredicate) \
-                        or isinstance(self.mln.predicate(gndatom.predname), SoftFunctionalPredicate):
+            for pred in self.mln.prednames:
+                if isinstance(self.mln.predicate(pred), FunctionalPredicate) \
+                        or isinstance(self.mln.predicate(pred), SoftFunctionalPredicate):
                     continue
-                if gndatom.predname not in qpreds and self.mrf.evidence[gndatom.idx] is None:
-                    self.mrf.evidence[gndatom.idx] = 0
+                if pred not in qpreds:
+                    self._apply_cw(evidence, pred)
         for var in self.mrf.variables:
             if isinstance(var, FuzzyVariable):
                 var.consistent(self.mrf.evidence, strict=True)
         self._watch = StopWatch()
+        self._deadline = None
+        self._lastsnapshot = None
+        self._stopped = False
+        self.timedout = False
     
     
     @property
@@ -118,6 +131,63 @@ class Inference(object):
     @property
     def multicore(self):
         return self._params.get('multicore')
+
+
+    @property
+    def timeout(self):
+        return self._params.get('timeout')
+
+
+    @property
+    def callback(self):
+        return self._params.get('callback')
+
+
+    @property
+    def interval(self):
+        return self._params.get('interval', .1)
+
+
+    @property
+    def timeleft(self):
+        """
+        The remaining time budget in seconds, or `None` if there is no `timeout`.
+        """
+        if self._deadline is None:
+            return None
+        return max(0., self._deadline - time.time())
+
+
+    @property
+    def expired(self):
+        """
+        Whether the inference has to stop, since its time budget is exhausted
+        or it has been stopped by closing :meth:`iterrun`.
+        """
+        if self._stopped or self._deadline is not None and time.time() >= self._deadline:
+            self.timedout = True
+        return self.timedout
+
+
+    def _due(self):
+        """
+        Returns whether a snapshot of the intermediate results is to be reported.
+        """
+        return self.callback is not None and time.time() - self._lastsnapshot >= self.interval
+
+
+    def _progress(self, results, final=False, **info):
+        """
+        Reports a snapshot of the (intermediate) results to the `callback`.
+        Additional keyword arguments are added to the snapshot.
+        """
+        if self.callback is None:
+            return
+        now = time.time()
+        self._lastsnapshot = now
+        snapshot = {'results': dict(results), 'time': now - self._starttime, 'final': final}
+        snapshot.update(info)
+        self.callback(snapshot)
     
     
     @property
@@ -145,6 +215,59 @@ class Inference(object):
         return self._params.get('cw_preds', [])
         
 
+    def _fill_determined_vars(self, evidence):
+        """
+        Sets the truth values of all variables in the MRF that can only take
+        a single value given the evidence.
+        
+        Equivalent to asserting the only remaining value of every variable with
+        ``valuecount() == 1``, but computed in one pass over the ground atoms.
+        
+        :param evidence:    numpy array of the current evidence, with ``nan`` for unknown
+                            truth values. Is updated in place along with the MRF evidence.
+        """
+        variables = self.mrf.variables
+        if not variables: return
+        sizes = numpy.array([len(v.gndatoms) for v in variables], dtype=int)
+        offsets = numpy.concatenate(([0], numpy.cumsum(sizes)[:-1]))
+        atomidx = numpy.array([a.idx for v in variables for a in v.gndatoms], dtype=int)
+        values = evidence[atomidx]
+        unknown = numpy.isnan(values)
+        trues = numpy.add.reduceat((values == 1).astype(int), offsets)
+        unknowns = numpy.add.reduceat(unknown.astype(int), offsets)
+        mutex = numpy.array([isinstance(v, MutexVariable) for v in variables])
+        softmutex = numpy.array([isinstance(v, SoftMutexVariable) for v in variables])
+        fuzzy = numpy.array([isinstance(v, FuzzyVariable) for v in variables])
+        # variables with an invalid assignment: let the variable itself raise the error
+        invalid = (fuzzy & (unknowns > 0)) | ((mutex | softmutex) & (trues > 1)) | (mutex & (trues == 0) & (unknowns == 0))
+        if invalid.any():
+            var = variables[int(numpy.argmax(invalid))]
+            var.valuecount({a.idx: self.mrf.evidence[a.idx] for a in var.gndatoms})
+        # (soft) mutex variables with one true atom: all remaining ones are false
+        falses = numpy.repeat((mutex | softmutex) & (trues == 1), sizes) & unknown
+        # mutex variables with all but one false atom: the remaining one is true
+        truths = numpy.repeat(mutex & (trues == 0) & (unknowns == 1), sizes) & unknown
+        for mask, value in ((falses, 0), (truths, 1)):
+            indices = atomidx[mask]
+            evidence[indices] = value
+            for i in indices.tolist():
+                self.mrf.evidence[i] = value
+
+
+    def _apply_cw(self, evidence, predname):
+        """
+        Sets all ground atoms of the given predicate without a truth value to false.
+        
+        :param evidence:    numpy array of the current evidence, with ``nan`` for unknown
+                            truth values. Is updated in place along with the MRF evidence.
+        """
+        indices = numpy.array(self.mrf.gndatom_indices(predname), dtype=int)
+        indices = indices[numpy.isnan(evidence[indices])]
+        evidence[indices] = 0
+        for i in indices.tolist():
+            self.mrf.evidence[i] = 0
+
+
     def _expand_queries(self, queries):
         """ 
         Expands the list of queries where necessary, e.g. queries that are 
@@ -185,11 +308,59 @@ class Inference(object):
         # perform actual inference (polymorphic)
         if self.verbose: print('Inference engine: %s' % self.__class__.__name__)
         self._watch.tag('inference', verbose=self.verbose)
+        self._starttime = self._lastsnapshot = time.time()
+        self._deadline = None if self.timeout is None else self._starttime + self.timeout
+        self.timedout = False
         _weights_backup = list(self.mln.weights)
-        self._results = self._run()
+        with span('infer', method=type(self).__name__):
+            self._results = self._run()
         self.mln.weights = _weights_backup
         self._watch.finish('inference')
+        self._progress(self._results, final=True, timedout=self.timedout)
         return self
+
+
+    def iterrun(self):
+        """
+        Runs the inference in a background thread and yields the snapshots
+        of its intermediate results (see the `callback` parameter) as they
+        become available. The last snapshot has `final` set to `True`.
+        If the generator is closed early, the inference is stopped as if
+        its time budget were exhausted.
+
+        :Example:
+
+        >>> for snapshot in MCSAT(mrf, queries='Cancer', timeout=.2).iterrun():
+        ...     print(snapshot['time'], snapshot['results'])
+        """
+        snapshots = queue.Queue()
+        callback = self.callback
+        errors = []
+        def report(snapshot):
+            if callback is not None: callback(snapshot)
+            snapshots.put(snapshot)
+        def target():
+            try:
+                self.run()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                snapshots.put(None)
+        self._params['callback'] = report
+        self._stopped = False
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        try:
+            while True:
+                snapshot = snapshots.get()
+                if snapshot is None: break
+                yield snapshot
+        finally:
+            self._stopped = True
+            thread.join()
+            self._params['callback'] = callback
+        if errors:
+            raise errors[0]
     
     
     def write(self, stream=sys.stdout, color=None, sort='prob', group=True, reverse=True):
@@ -26,29 +26,39 @@
 
 import random
 from collections import defaultdict
+from multiprocessing import Pool
 
-from dnutils import ProgressBar
+from dnutils import ProgressBar, logs
 
 from .mcmc import MCMCInference
 from ..constants import HARD, ALL
 from ..grounding.fastconj import FastConjunctionGrounding
+from ..grounding.lazy import LazyGrounding
 from ...logic.common import Logic
+from ...utils.multicore import with_tracing, poolsize
+
+
+logger = logs.getlogger(__name__)
+
+# this readonly global is for multiprocessing to exploit copy-on-write
+# on linux systems
+global_maxwalksat = None
 
 
 class SAMaxWalkSAT(MCMCInference):
     """
     A MaxWalkSAT MPE solver using simulated annealing.
+
+    If `lazy` is `True`, the formulas are grounded lazily (see
+    :class:`mln.grounding.lazy.LazyGrounding`) and the search starts
+    from the world in which all atoms without evidence are false.
     """
     
     
     def __init__(self, mrf, queries=ALL, state=None, **params):
         MCMCInference.__init__(self, mrf, queries, **params)
-        if state is None:
-            self.state = self.random_world(self.mrf.evidence)
-        else:
-            self.state = state
         self.sum = 0
-        self.var2gf = defaultdict(set)
+        self.var2gf = defaultdict(list)
         self.weights = list(self.mrf.mln.weights)
         formulas = []
         for f in self.mrf.formulas:
@@ -56,12 +66,28 @@ class SAMaxWalkSAT(MCMCInference):
                 f_ = self.mrf.mln.logic.negate(f)
                 f_.weight = - f.weight
                 formulas.append(f_.nnf())
-        grounder = FastConjunctionGrounding(mrf, formulas=formulas, simplify=True, unsatfailure=True)
-        for gf in grounder.itergroundings():
-            if isinstance(gf, Logic.TrueFalse): continue
-            vars_ = set([self.mrf.variable(a).idx for a in gf.gndatoms()])
-            for v in vars_: self.var2gf[v].add(gf)
-            self.sum += (self.hardw if gf.weight == HARD else gf.weight) * (1 - gf(self.state))
+            else:
+                formulas.append(f)
+        if self.lazy:
+            self._lazy = LazyGrounding(mrf, formulas, simplify=True, unsatfailure=True)
+            self.state = self._lazy.world() if state is None else state
+            gndformulas = list(self._lazy.itergroundings())
+            gndformulas.extend(self._lazy.activate([i for i, v in enumerate(self.state) if v]))
+        else:
+            self.state = self.random_world(self.mrf.evidence) if state is None else state
+            gndformulas = FastConjunctionGrounding(mrf, formulas=formulas, simplify=True, unsatfailure=True).itergroundings()
+        for gf in gndformulas:
+            self._add_gndformula(gf)
+        # the weights of the negated formulas are only in effect while the solver runs
+        self._posweights = list(self.mrf.mln.weights)
+        self.mrf.mln.weights = self.weights
+
+
+    def _add_gndformula(self, gf):
+        if isinstance(gf, Logic.TrueFalse): return
+        vars_ = set([self.mrf.variable(a).idx for a in gf.gndatoms()])
+        for v in vars_: self.var2gf[v].append(gf)
+        self.sum += (self.hardw if gf.weight == HARD else gf.weight) * (1 - gf(self.state))
         
         
     @property
@@ -77,29 +103,41 @@ class SAMaxWalkSAT(MCMCInference):
     @property
     def maxsteps(self):
         return self._params.get('maxsteps', 500)
+
+
+    @property
+    def lazy(self):
+        return self._params.get('lazy', False)
     
     
     def _run(self):
+        self.mrf.mln.weights = self._posweights
         i = 0 
         i_max = self.maxsteps
         thr = self.thr
+        variables = self.mrf.variables
         if self.verbose:
             bar = ProgressBar(steps=i_max, color='green')
         while i < i_max and self.sum > self.thr:
             # randomly choose a variable to modify
-            var = self.mrf.variables[random.randint(0, len(self.mrf.variables)-1)]
+            var = variables[random.randint(0, len(variables)-1)]
             evdict = var.value2dict(var.evidence_value(self.mrf.evidence))
             valuecount = var.valuecount(evdict) 
             if valuecount == 1: # this is evidence 
                 continue
+            validx = random.randint(0, valuecount - 1)
+            value = [v for _, v in var.itervalues(evdict)][validx]
+            if self.lazy:
+                # ground the formulas of the atoms that become true. these groundings
+                # are satisfied in the current state, so the sum does not change
+                for gf in self._lazy.activate([a for a, v in var.value2dict(value).items() if v]):
+                    self._add_gndformula(gf)
             # compute the sum of relevant gf weights before the modification
             sum_before = 0
             for gf in self.var2gf[var.idx]:
                 sum_before += (self.hardw if gf.weight == HARD else gf.weight) * (1 - gf(self.state)) 
             # modify the state
-            validx = random.randint(0, valuecount - 1)
-            value = [v for _, v in var.itervalues(evdict)][validx]
-            oldstate = list(self.state)
+            oldvalue = tuple(var.evidence_value(self.state))
             var.setval(value, self.state)
             # compute the sum after the modification
             sum_after = 0
@@ -117,13 +155,338 @@ class SAMaxWalkSAT(MCMCInference):
 #                 keep = False # !!! no annealing
             # apply new objective value
             if keep: self.sum += improvement
-            else: self.state = oldstate
+            else: var.setval(oldvalue, self.state)
             # next iteration
             i += 1
             if self.verbose:
                 bar.label('sum = %f' % self.sum)
                 bar.inc()
+            if self._due():
+                self._progress(dict([(str(q), self.state[q.gndatom.idx]) for q in self.queries]), step=i, cost=self.sum)
+            if self.expired: break
         if self.verbose:
             print("SAMaxWalkSAT: %d iterations, sum=%f, threshold=%f" % (i, self.sum, self.thr))
         self.mrf.mln.weights = self.weights
         return dict([(str(q), self.state[q.gndatom.idx]) for q in self.queries])
+
+
+def _maxwalksat_try(args):
+    """
+    Runs a single try of the MaxWalkSAT solver in a child process.
+    """
+    seed, state = args
+    random.seed(seed)
+    return global_maxwalksat._try(state, progress=False)
+
+
+class MaxWalkSAT(MCMCInference):
+    """
+    A MaxWalkSAT MPE solver.
+
+    The solver minimizes the costs of a world, i.e. the sum of the weights
+    of the ground formulas that are not satisfied, where formulas with
+    negative weights are negated. Every step, an unsatisfied ground formula
+    is chosen at random and one of its variables is set to a new value: with
+    probability `noise` to a random one, otherwise to the one that decreases
+    the costs the most. The changes in costs of all values of a variable are
+    cached and only recomputed for the variables sharing a ground formula
+    with a variable that has been changed. A variable that has been changed
+    in the last `tabu` steps is not changed again, unless this leads to a
+    world with lower costs than the best one found so far.
+
+    The search is run `tries` times, each time starting from a new random
+    world, and the best world found is returned. If `multicore` is `True`,
+    the tries are run in parallel processes. If the time budget is exhausted
+    (see `timeout`), the best world found so far is returned.
+
+    Additional keyword parameters:
+
+    :param maxsteps:    the maximal number of steps of a try (default: 1000).
+    :param tries:       the number of tries (default: 1).
+    :param noise:       the probability of a random step (default: 0.5).
+    :param tabu:        the number of steps a variable that has been changed
+                        must not be changed again (default: 5).
+    :param hardw:       the weight of hard formulas (default: 10).
+    :param thr:         the search stops as soon as the costs do not exceed
+                        this threshold (default: 0).
+    :param lazy:        if `True`, the formulas are grounded lazily (see
+                        :class:`mln.grounding.lazy.LazyGrounding`) and every try
+                        starts from the world in which all atoms without evidence
+                        are false.
+    """
+
+    def __init__(self, mrf, queries=ALL, state=None, **params):
+        MCMCInference.__init__(self, mrf, queries, **params)
+        mln = self.mrf.mln
+        weights = list(mln.weights)
+        formulas = []
+        for f in self.mrf.formulas:
+            if f.weight == 0: continue
+            if f.weight < 0:
+                f_ = mln.logic.negate(f)
+                f_.weight = -f.weight
+                formulas.append(f_.nnf())
+            else:
+                formulas.append(f)
+        # the absolute weights of the formulas
+        self._fweights = dict([(f.idx, self.hardw if f.weight == HARD else f.weight) for f in formulas])
+        mln.weights = weights
+        self.gndformulas = []
+        self._gfvars = []
+        self.var2gf = defaultdict(list)
+        # the variables without evidence and their values
+        self._variables = {}
+        for var in self.mrf.variables:
+            evdict = var.value2dict(var.evidence_value(self.mrf.evidence))
+            if var.valuecount(evdict) > 1:
+                self._variables[var.idx] = [v for _, v in var.itervalues(evdict)]
+        if self.lazy:
+            self._lazy = LazyGrounding(mrf, formulas, simplify=True, unsatfailure=True)
+            self.state = self._lazy.world() if state is None else state
+            gndformulas = list(self._lazy.itergroundings())
+            gndformulas.extend(self._lazy.activate([i for i, v in enumerate(self.state) if v]))
+        else:
+            self.state = self.random_world(self.mrf.evidence) if state is None else state
+            gndformulas = FastConjunctionGrounding(mrf, formulas=formulas, simplify=True, unsatfailure=True).itergroundings()
+        self._reset(self.state)
+        for gf in gndformulas:
+            self._add_gndformula(gf)
+        self._initstate = state
+
+
+    @property
+    def maxsteps(self):
+        return self._params.get('maxsteps', 1000)
+
+
+    @property
+    def tries(self):
+        return self._params.get('tries', 1)
+
+
+    @property
+    def noise(self):
+        return self._params.get('noise', .5)
+
+
+    @property
+    def tabu(self):
+        return self._params.get('tabu', 5)
+
+
+    @property
+    def hardw(self):
+        return self._params.get('hardw', 10)
+
+
+    @property
+    def thr(self):
+        return self._params.get('thr', 0)
+
+
+    @property
+    def lazy(self):
+        return self._params.get('lazy', False)
+
+
+    def _reset(self, state):
+        """
+        Sets the current state of the search and computes the costs of all
+        ground formulas in it.
+        """
+        self.state = state
+        self.sum = 0
+        self._costs = []
+        self._unsat = []
+        self._unsatpos = {}
+        self._deltas = {}
+        self._lastchange = {}
+        for i in range(len(self.gndformulas)):
+            self._costs.append(0)
+            self._update(i)
+
+
+    def _add_gndformula(self, gf):
+        if isinstance(gf, Logic.TrueFalse): return
+        i = len(self.gndformulas)
+        self.gndformulas.append(gf)
+        vars_ = []
+        for atom in gf.gndatoms():
+            varidx = self.mrf.variable(atom).idx
+            if varidx in self._variables and varidx not in vars_:
+                vars_.append(varidx)
+        self._gfvars.append(vars_)
+        for v in vars_:
+            self.var2gf[v].append(i)
+            self._deltas.pop(v, None)
+        self._costs.append(0)
+        self._update(i)
+
+
+    def _cost(self, i):
+        return self._fweights[self.gndformulas[i].idx] * (1 - self.gndformulas[i](self.state))
+
+
+    def _update(self, i):
+        """
+        Recomputes the costs of the i-th ground formula in the current state
+        and updates the set of unsatisfied ground formulas.
+        """
+        cost = self._cost(i)
+        self.sum += cost - self._costs[i]
+        self._costs[i] = cost
+        if cost > 0 and i not in self._unsatpos:
+            self._unsatpos[i] = len(self._unsat)
+            self._unsat.append(i)
+        elif cost == 0 and i in self._unsatpos:
+            # replace the formula by the last one in the list
+            pos = self._unsatpos.pop(i)
+            last = self._unsat.pop()
+            if last != i:
+                self._unsat[pos] = last
+                self._unsatpos[last] = pos
+
+
+    def _delta(self, varidx):
+        """
+        Returns the changes in costs if the variable with the given index
+        is set to each of its values.
+        """
+        if varidx in self._deltas:
+            return self._deltas[varidx]
+        var = self.mrf.variable(varidx)
+        value = tuple(var.evidence_value(self.state))
+        deltas = []
+        for value_ in self._variables[varidx]:
+            if value_ == value:
+                deltas.append(0)
+                continue
+            var.setval(value_, self.state)
+            deltas.append(sum([self._cost(i) - self._costs[i] for i in self.var2gf[varidx]]))
+        var.setval(value, self.state)
+        self._deltas[varidx] = deltas
+        return deltas
+
+
+    def _setval(self, varidx, value):
+        """
+        Sets the variable with the given index to a new value and updates
+        the costs of its ground formulas.
+        """
+        self.mrf.variable(varidx).setval(value, self.state)
+        for i in self.var2gf[varidx]:
+            self._update(i)
+            for v in self._gfvars[i]:
+                self._deltas.pop(v, None)
+
+
+    def _activate(self, varidx):
+        """
+        Activates the groundings of the atoms of a variable that are true
+        in any of its values.
+        """
+        var = self.mrf.variable(varidx)
+        atoms = set([a for value in self._variables[varidx] for a, v in var.value2dict(value).items() if v])
+        for gf in self._lazy.activate(atoms):
+            self._add_gndformula(gf)
+
+
+    def _step(self, step, best):
+        """
+        Performs a single step of the search.
+
+        :param step:    the number of the step, which determines the tabu variables.
+        :param best:    the costs of the best world found so far.
+        """
+        vars_ = self._gfvars[self._unsat[random.randint(0, len(self._unsat) - 1)]]
+        if not vars_: return
+        if self.lazy:
+            for v in vars_: self._activate(v)
+        if random.random() < self.noise:
+            varidx = random.choice(vars_)
+            value = tuple(self.mrf.variable(varidx).evidence_value(self.state))
+            value = random.choice([v for v in self._variables[varidx] if v != value])
+            self._setval(varidx, value)
+            self._lastchange[varidx] = step
+            return
+        candidates = []
+        mindelta = None
+        for varidx in vars_:
+            tabu = step - self._lastchange.get(varidx, -self.tabu - 1) <= self.tabu
+            current = tuple(self.mrf.variable(varidx).evidence_value(self.state))
+            for value, delta in zip(self._variables[varidx], self._delta(varidx)):
+                if value == current:
+                    continue
+                if tabu and self.sum + delta >= best:
+                    continue
+                if mindelta is None or delta < mindelta:
+                    mindelta = delta
+                    candidates = [(varidx, value)]
+                elif delta == mindelta:
+                    candidates.append((varidx, value))
+        if not candidates: return
+        varidx, value = random.choice(candidates)
+        self._setval(varidx, value)
+        self._lastchange[varidx] = step
+
+
+    def _try(self, state, progress=True):
+        """
+        Runs a single try of the search starting from the given state.
+
+        :param progress:    whether snapshots of the best world are reported.
+        :returns:           a tuple of the costs of the best world found and the world.
+        """
+        self._reset(state)
+        best, beststate = self.sum, list(self.state)
+        step = 0
+        while step < self.maxsteps and best > self.thr and self._unsat and not self.expired:
+            self._step(step, best)
+            if self.sum < best:
+                best, beststate = self.sum, list(self.state)
+            step += 1
+            if progress and self._due():
+                self._progress(dict([(str(q), beststate[q.gndatom.idx]) for q in self.queries]), step=step, cost=best)
+        if self.verbose:
+            print('MaxWalkSAT: %d steps, sum=%f, threshold=%f' % (step, best, self.thr))
+        return best, beststate
+
+
+    def _initstates(self):
+        """
+        Returns the states the tries start from.
+        """
+        states = []
+        for t in range(self.tries):
+            if t == 0 and self._initstate is not None:
+                states.append(list(self._initstate))
+            elif self.lazy:
+                states.append(self._lazy.world())
+            else:
+                states.append(self.random_world(self.mrf.evidence))
+        return states
+
+
+    def _run(self):
+        states = self._initstates()
+        if self.multicore and len(states) > 1:
+            global global_maxwalksat
+            global_maxwalksat = self
+            pool = Pool(poolsize())
+            try:
+                results = list(pool.imap(with_tracing(_maxwalksat_try), [(random.random(), s) for s in states]))
+            except Exception as e:
+                logger.error('Error in child process. Terminating pool...')
+                pool.close()
+                raise e
+            finally:
+                pool.terminate()
+                pool.join()
+            if self.timeleft == 0: self.timedout = True
+        else:
+            results = []
+            for state in states:
+                results.append(self._try(state))
+                if results[-1][0] <= self.thr or self.expired: break
+        self.sum, self.state = min(results, key=lambda r: r[0])
+        return dict([(str(q), self.state[q.gndatom.idx]) for q in self.queries])
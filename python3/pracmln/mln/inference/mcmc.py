@@ -24,13 +24,18 @@
 # TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 import random
+import time
+from math import sqrt
 
-
+import numpy
 from dnutils import logs
 
 from .infer import Inference
+from ..mrfvars import FuzzyVariable
 from ..util import fstr
 from ..constants import ALL
+from ...logic.common import Logic
+from ...utils.tracing import event
 
 
 logger = logs.getlogger(__name__)
@@ -39,10 +44,82 @@ logger = logs.getlogger(__name__)
 class MCMCInference(Inference):
     """
     Abstract super class for Markov chain Monte Carlo-based inference.
+
+    Additional keyword parameters:
+
+    :param raoblackwell:    (bool) if `True`, the probability of a query that is
+                            a single ground literal is estimated by averaging its
+                            conditional probability given its Markov blanket over
+                            the steps of a chain, instead of the frequency of the
+                            steps in which it is true (Rao-Blackwellization). This
+                            reduces the variance of the estimates considerably.
+                            The conditional probabilities are computed from the
+                            ground formulas in :attr:`var2gf` (default: `True`).
     """
     
     def __init__(self, mrf, queries=ALL, **params):
         Inference.__init__(self, mrf, queries, **params)
+        self._lastresults = None
+        # maps a variable index to the ground formulas it occurs in
+        self.var2gf = None
+
+
+    @property
+    def raoblackwell(self):
+        return self._params.get('raoblackwell', True)
+
+
+    def _valueprobs(self, var, world):
+        """
+        Returns the conditional distribution of the values of the variable `var`
+        given the values of all other variables in `world`, i.e. given its Markov
+        blanket, as an array indexed by the value indices of the variable.
+        Values that are ruled out by the evidence or violate a hard ground formula
+        have probability 0. If every value admitted by the evidence violates a
+        hard ground formula, these values are equally likely.
+        """
+        sums = [None] * var.valuecount()
+        admissible = []
+        old = tuple(var.evidence_value(world))
+        for i, value in var.itervalues(self.mrf.evidence):
+            var.setval(value, world)
+            admissible.append(i)
+            sums[i] = 0
+            for gf in self.var2gf[var.idx]:
+                truth = gf(world)
+                if gf.ishard:
+                    if truth == 0:
+                        sums[i] = None
+                        break
+                else:
+                    sums[i] += gf.weight * truth
+        var.setval(old, world)
+        if all([s is None for s in sums]):
+            # e.g. in a world that does not satisfy the hard constraints yet
+            for i in admissible: sums[i] = 0
+        # subtract the largest sum to prevent overflows
+        m = max([s for s in sums if s is not None] or [0])
+        expsums = numpy.array([numpy.exp(s - m) if s is not None else 0 for s in sums])
+        return expsums / sum(expsums)
+
+
+    def _chainprogress(self, chaingroup, step):
+        """
+        Reports a snapshot of the intermediate results of the chains. As
+        estimates of the convergence, it contains the largest change of a
+        probability since the last snapshot (`delta`), the largest standard
+        error of a probability over the chains (`stderr`, if there are
+        several chains) and whether all chains have `converged`.
+        """
+        results, var = chaingroup.results()
+        delta = None
+        if self._lastresults is not None:
+            delta = max([abs(p - self._lastresults[q]) for q, p in results.items()] or [0])
+        self._lastresults = results
+        chains = len(chaingroup.chains)
+        stderr = max([sqrt(v / chains) for v in var] or [0]) if chains > 1 else None
+        self._progress(results, step=step, delta=delta, stderr=stderr,
+                       converged=all([c.converged for c in chaingroup.chains]))
         
 
     def random_world(self, evidence=None):
@@ -77,10 +154,35 @@ class MCMCInference(Inference):
             self.truths = [0] * len(self.queries)
             self.converged = False
             self.lastresult = 10
+            self.lasttime = time.time()
             self.infer = infer
             # copy the current  evidence as this chain's state
             # initialize remaining variables randomly (but consistently with the evidence)
             self.state = infer.random_world()
+            # for Rao-Blackwellized queries, the variable, the indices of its values
+            # in which the query atom is true and whether the query is negated
+            self._rb = [self._rbquery(q) if infer.raoblackwell else None for q in queries]
+
+
+        def _rbquery(self, query):
+            if isinstance(query, Logic.GroundLit):
+                atom, negated = query.gndatom, query.negated
+            elif isinstance(query, Logic.GroundAtom):
+                atom, negated = query, False
+            else:
+                return None
+            var = self.infer.mrf.variable(atom)
+            if isinstance(var, FuzzyVariable):
+                return None
+            return var, [i for i, v in var.itervalues() if var.value2dict(v)[atom.idx]], negated
+
+
+        def _condprobs(self, var):
+            """
+            Returns the conditional distribution of the values of `var` in the
+            current state.
+            """
+            return self.infer._valueprobs(var, self.state)
         
         
         def update(self, state):
@@ -88,7 +190,13 @@ class MCMCInference(Inference):
             self.state = state
             # keep track of counts for queries
             for i, q in enumerate(self.queries):
-                self.truths[i] += q(self.state)
+                if self._rb[i] is None:
+                    self.truths[i] += q(self.state)
+                else:
+                    var, trueidx, negated = self._rb[i]
+                    probs = self._condprobs(var)
+                    p = sum([probs[j] for j in trueidx])
+                    self.truths[i] += 1 - p if negated else p
             # check if converged !!! TODO check for all queries
             if self.steps % 50 == 0:
                 result = self.results()[0]
@@ -96,6 +204,10 @@ class MCMCInference(Inference):
                 if diff < 0.001:
                     self.converged = True
                 self.lastresult = result
+                now = time.time()
+                event('mcmc.chain', method=type(self.infer).__name__, steps=self.steps,
+                      rate=50. / max(now - self.lasttime, 1e-9), delta=diff, converged=self.converged)
+                self.lasttime = now
             # keep track of counts for soft evidence
             if self.soft_evidence is not None:
                 for se in self.soft_evidence:
@@ -33,8 +33,10 @@ from dnutils import logs, ProgressBar, out
 from .mcmc import MCMCInference
 from ..constants import ALL, HARD
 from ..grounding.fastconj import FastConjunctionGrounding
+from ..grounding.lazy import LazyGrounding
 from ..util import item
 from ...logic.common import Logic
+from ...utils.tracing import span
 
 
 logger = logs.getlogger(__name__)
@@ -70,38 +72,29 @@ class MCSAT(MCMCInference):
 #         for f in self.mrf.formulas:
 #             if f.ishard: continue
 #             f.weight  = min(w_stdev, f.weight)
-        grounder = FastConjunctionGrounding(self.mrf, formulas=self.formulas, simplify=True, verbose=self.verbose)
         self.gndformulas = []
-        for gf in grounder.itergroundings():
-            if isinstance(gf, Logic.TrueFalse): continue
-            self.gndformulas.append(gf.cnf())
-        self._watch.tags.update(grounder.watch.tags)
-#         self.gndformulas, self.formulas = Logic.cnf(grounder.itergroundings(), self.mln.formulas, self.mln.logic, allpos=True)
-        # get clause data
-        logger.debug("gathering clause data...")
+        self.var2gf = defaultdict(list)
         self.gf2clauseidx = {} # ground formula index -> tuple (idxFirstClause, idxLastClause+1) for use with range
         self.clauses = [] # list of clauses, where each entry is a list of ground literals
         #self.GAoccurrences = {} # ground atom index -> list of clause indices (into self.clauses)
-        i_clause = 0
-        # process all ground formulas
-        for i_gf, gf in enumerate(self.gndformulas):
-            # get the list of clauses
-            if isinstance(gf, Logic.Conjunction):
-                clauses = [clause for clause in gf.children if not isinstance(clause, Logic.TrueFalse)]
-            elif not isinstance(gf, Logic.TrueFalse):
-                clauses = [gf]
-            else: continue
-            self.gf2clauseidx[i_gf] = (i_clause, i_clause + len(clauses))
-            # process each clause
-            for c in clauses:
-                if hasattr(c, "children"):
-                    lits = c.children
-                else: # unit clause
-                    lits = [c]
-                # add clause to list
-                self.clauses.append(lits)
-                # next clause index
-                i_clause += 1
+        if self.lazy:
+            self._lazy = LazyGrounding(self.mrf, self.formulas, simplify=True)
+            gndformulas = self._lazy.itergroundings()
+        else:
+            grounder = FastConjunctionGrounding(self.mrf, formulas=self.formulas, simplify=True, verbose=self.verbose)
+            gndformulas = grounder.itergroundings()
+#         self.gndformulas, self.formulas = Logic.cnf(grounder.itergroundings(), self.mln.formulas, self.mln.logic, allpos=True)
+        # get clause data
+        logger.debug("gathering clause data...")
+        for gf in gndformulas:
+            if self.expired:
+                logger.warning('time budget exhausted while grounding, %d ground formulas were generated' % len(self.gndformulas))
+                break
+            if isinstance(gf, Logic.TrueFalse): continue
+            self._add_gndformula(gf)
+        if not self.lazy:
+            self._watch.tags.update(grounder.watch.tags)
+        i_clause = len(self.clauses)
         # add clauses for soft evidence atoms
         for se in []:#self.softEvidence:
             se["numTrue"] = 0.0
@@ -123,6 +116,36 @@ class MCSAT(MCMCInference):
             se["idxClauseNegative"] = (idxFirst, i_clause)
             
             
+    def _add_gndformula(self, gf):
+        """
+        Converts a ground formula to CNF and adds it and its clauses to the knowledge base.
+
+        :returns:    the index of the ground formula.
+        """
+        gf = gf.cnf()
+        i_gf = len(self.gndformulas)
+        self.gndformulas.append(gf)
+        if self.raoblackwell and not isinstance(gf, Logic.TrueFalse):
+            for varidx in set([self.mrf.variable(a).idx for a in gf.gndatoms()]):
+                self.var2gf[varidx].append(gf)
+        # get the list of clauses
+        if isinstance(gf, Logic.Conjunction):
+            clauses = [clause for clause in gf.children if not isinstance(clause, Logic.TrueFalse)]
+        elif not isinstance(gf, Logic.TrueFalse):
+            clauses = [gf]
+        else: return i_gf
+        self.gf2clauseidx[i_gf] = (len(self.clauses), len(self.clauses) + len(clauses))
+        # process each clause
+        for c in clauses:
+            if hasattr(c, "children"):
+                lits = c.children
+            else: # unit clause
+                lits = [c]
+            # add clause to list
+            self.clauses.append(lits)
+        return i_gf
+
+
     def _formula_clauses(self, f):
         # get the list of clauses
         if isinstance(f, Logic.Conjunction):
@@ -173,6 +196,16 @@ class MCSAT(MCMCInference):
     def initalgo(self):
         return self._params.get('initalgo', 'SampleSAT')
     
+    @property
+    def lazy(self):
+        return self._params.get('lazy', False)
+
+
+    @property
+    def raoblackwell(self):
+        # the conditional probabilities would require the inactive groundings
+        return self._params.get('raoblackwell', True) and not self.lazy
+    
     
     def _run(self):
         """
@@ -193,7 +226,8 @@ class MCSAT(MCMCInference):
         """
         logger.debug("starting MC-SAT with maxsteps=%d, softevidence=%s" % (self.maxsteps, self.softevidence))
         # initialize the KB and gather required info
-        self._initkb()
+        with span('infer.setup', method=type(self).__name__):
+            self._initkb()
         # print CNF KB
         logger.debug("CNF KB:")
         for gf in self.gndformulas:
@@ -208,6 +242,11 @@ class MCSAT(MCMCInference):
         for i in range(self.chains):
             chain = MCMCInference.Chain(self, self.queries)
             chaingroup.chain(chain)
+            if self.lazy:
+                # start from the sparse default world and activate its true atoms
+                chain.state = self._lazy.world()
+                for gf in self._lazy.activate([i for i, v in enumerate(chain.state) if v]):
+                    self._add_gndformula(gf)
             # satisfy hard constraints using initialization algorithm
             M = []
             NLC = []
@@ -220,7 +259,7 @@ class MCSAT(MCMCInference):
                         NLC.append(gf)
             if M or NLC:
                 logger.debug('Running SampleSAT')
-                chain.state = SampleSAT(self.mrf, chain.state, M, NLC, self, p=self.p).run() # Note: can't use p=1.0 because there is a chance of getting into an oscillating state
+                chain.state = self._sample(chain, M, NLC, lambda gf: gf.weight == HARD)
         if logger.level == logs.DEBUG:
             self.mrf.print_world_vars(chain.state)
         self.step = 1        
@@ -233,6 +272,8 @@ class MCSAT(MCMCInference):
             for chain in chaingroup.chains:
                 # choose a subset of the satisfied formulas and sample a state that satisfies them
                 state = self._satisfy_subset(chain)
+                # a sample interrupted by the deadline may violate the selected clauses
+                if self.expired: break
                 # update chain counts
                 chain.update(state)
             if self.verbose:
@@ -240,8 +281,14 @@ class MCSAT(MCMCInference):
                 bar.label('%d / %d' % (self.step, self.maxsteps))
             # intermediate results
             self.step += 1
+            if self._due():
+                self._chainprogress(chaingroup, self.step - 1)
+            if self.expired: break
         # get results
         self.step -= 1
+        for chain in chaingroup.chains:
+            # the time budget was exhausted before the first sample
+            if not chain.steps: chain.update(chain.state)
         results = chaingroup.results()
         return results[0]
     
@@ -254,15 +301,12 @@ class MCSAT(MCMCInference):
         M = []
         NLC = []
         for gfidx, gf in enumerate(self.gndformulas):
-            if gf(chain.state) == 1 or gf.ishard:
-                expweight = math.exp(gf.weight)
-                u = random.uniform(0, expweight)
-                if u > 1:
-                    if gf.islogical():
-                        clause_range = self.gf2clauseidx[gfidx]
-                        M.extend(list(range(*clause_range)))
-                    else:
-                        NLC.append(gf)
+            if (gf(chain.state) == 1 or gf.ishard) and self._select(gf):
+                if gf.islogical():
+                    clause_range = self.gf2clauseidx[gfidx]
+                    M.extend(list(range(*clause_range)))
+                else:
+                    NLC.append(gf)
         # add soft evidence constraints
         if False:# self.softevidence:
             for se in self.softevidence:
@@ -289,7 +333,47 @@ class MCSAT(MCMCInference):
                         M.extend(list(range(*se["idxClauseNegative"])))
                     #print "negative case: add=%s, %s, %f should become %f" % (add, map(str, [map(str, self.clauses[i]) for i in range(*se["idxClauseNegative"])]), p, se["p"])
         # (uniformly) sample a state that satisfies them
-        return SampleSAT(self.mrf, chain.state, M, NLC, self, p=self.p).run()
+        return self._sample(chain, M, NLC, self._select)
+
+
+    def _select(self, gf):
+        """
+        Decides whether a satisfied ground formula is to be satisfied in the
+        next sample, which is the case with probability 1 - exp(-w).
+        """
+        expweight = math.exp(gf.weight)
+        u = random.uniform(0, expweight)
+        return u > 1
+
+
+    def _sample(self, chain, M, NLC, select):
+        """
+        Samples a state that satisfies the clauses with the indices in `M` and
+        the non-logical constraints `NLC`.
+
+        In lazy mode, the groundings of the atoms that are true in the sample
+        are activated. Since they are satisfied in the current state of the
+        chain, the decision whether they have to be satisfied is made only now
+        by `select`. If a selected grounding is violated by the sample, it is
+        added to the constraints and a new state is sampled.
+        """
+        while True:
+            # Note: can't use p=1.0 because there is a chance of getting into an oscillating state
+            state = SampleSAT(self.mrf, chain.state, M, NLC, self, p=self.p).run()
+            if not self.lazy or self.expired:
+                return state
+            resample = False
+            for gf in self._lazy.activate([i for i, v in enumerate(state) if v]):
+                gfidx = self._add_gndformula(gf)
+                gf = self.gndformulas[gfidx]
+                if isinstance(gf, Logic.TrueFalse) or not select(gf): continue
+                if gf.islogical():
+                    M.extend(list(range(*self.gf2clauseidx[gfidx])))
+                else:
+                    NLC.append(gf)
+                resample = resample or gf(state) != 1
+            if not resample:
+                return state
     
     
     def _prob_constraints_deviation(self):
@@ -371,9 +455,16 @@ class SampleSAT:
     
     
     def run(self):
+        """
+        Returns a state that satisfies the constraints. If the time budget of the
+        inference is exhausted before such a state is found, the current state is
+        returned and :attr:`Inference.timedout` is set.
+        """
         # sampling by enumerating all worlds
         worlds = []
         for world in self.mrf.worlds():
+            if self.infer.expired:
+                return self.state
             skip = False
             for clause in list(self.clauses.values()):
                 if not clause.satisfied_in_world(world):
@@ -385,6 +476,7 @@ class SampleSAT:
         return state
         steps = 0
         while self.unsatisfied:
+            if self.infer.expired: break
             steps += 1
             # make a WalkSat move or a simulated annealing move
             if random.uniform(0, 1) <= self.p:
@@ -21,6 +21,8 @@
 # TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 from collections import defaultdict
+from itertools import product
+from math import exp, log
 
 from dnutils import logs
 
@@ -28,8 +30,10 @@ from .infer import Inference
 from ..constants import infty, HARD
 from ..errors import SatisfiabilityException, MRFValueException
 from ..grounding.fastconj import FastConjunctionGrounding
+from ..grounding.lazy import LazyGrounding
 from ..mrfvars import FuzzyVariable
-from ..util import (combinations, dict_union, Interval, temporary_evidence)
+from ..util import dict_union, Interval, temporary_evidence
+from ...utils.tracing import span, event
 from ...wcsp import Constraint, WCSP
 from ...logic.common import Logic
 
@@ -38,20 +42,169 @@ logger = logs.getlogger(__name__)
 
 
 class WCSPInference(Inference):
+    """
+    Exact MPE inference by conversion of the MRF into a WCSP, which is
+    solved by toulbar2.
+    
+    Additional keyword parameters:
+    
+    :param timeout:    (optional) time budget in seconds. The solver is stopped
+                       when it is exhausted and the best solution found so far is
+                       returned. Every improved solution is reported to the
+                       `callback` together with its `cost`.
+    :param k:          (int) number of best solutions to be computed. After 
+                       inference, they are available together with their costs 
+                       in :attr:`WCSPInference.solutions`.
+    :param marginal:   (bool) if `True`, the most probable assignment of the query 
+                       atoms is computed, where all other atoms are summed out 
+                       approximately over the `k` best solutions (marginal MAP).
+    :param cuttingplane:    (bool) if `True`, the MPE is computed by cutting plane
+                       inference: the WCSP is first built from the ground formulas
+                       that are violated if all atoms without evidence are false
+                       only. The ground formulas violated by its solution are added
+                       and the WCSP is solved again until the solution does not
+                       violate any further ground formulas. Inactive ground formulas
+                       are checked without being instantiated (see
+                       :class:`mln.grounding.lazy.LazyGrounding`). If the time
+                       budget is exhausted, the solution of the last iteration
+                       is returned.
+    """
     
     def __init__(self, mrf, queries, **params):
         Inference.__init__(self, mrf, queries, **params)
+        self.solutions = []
+
+
+    @property
+    def k(self):
+        return self._params.get('k', 1)
+    
+    
+    @property
+    def marginal(self):
+        return self._params.get('marginal', False)
+
+
+    @property
+    def cuttingplane(self):
+        return self._params.get('cuttingplane', False)
 
 
     def _run(self):
-        result_ = {}
         with temporary_evidence(self.mrf):
             self.converter = WCSPConverter(self.mrf, multicore=self.multicore, verbose=self.verbose)
-            result = self.result_dict(verbose=self.verbose)
-            for query in self.queries:
-                query = str(query)
-                result_[query] = result[query] if query in result else self.mrf[query]
+            if self.cuttingplane:
+                if self.k > 1 or self.marginal:
+                    raise Exception('Cutting plane inference only supports the computation of a single MPE solution.')
+                wcsp, solution, cost = self._cuttingplane()
+                solutions = [] if solution is None else [(cost, solution)]
+            else:
+                with span('infer.setup', method=type(self).__name__):
+                    wcsp = self.converter.convert()
+                if self.k > 1 or self.marginal:
+                    solutions = wcsp.kbest(self.k, timeout=self.timeleft)
+                else:
+                    solution, cost = wcsp.solve(timeout=self.timeleft, callback=self._callback(wcsp), multicore=self.multicore)
+                    solutions = [] if solution is None else [(cost, solution)]
+            if not solutions:
+                if self.expired:
+                    raise Exception('No solution has been found within the time budget.')
+                raise Exception('MLN is unsatisfiable.')
+            # the solver is stopped when the time budget is exhausted
+            if self.timeleft == 0: self.timedout = True
+            divisor = wcsp.divisor if wcsp.divisor is not None else 0
+            self.solutions = [(self._queryresults(solution), cost * divisor) for cost, solution in solutions]
+        if self.marginal:
+            return self._marginalmap()
+        return dict(self.solutions[0][0])
+    
+    
+    def _cuttingplane(self):
+        """
+        Solves the WCSP of an increasing set of ground formulas until its
+        solution violates no further ground formulas.
+
+        :returns:    the final WCSP, its solution and the costs of the solution.
+        """
+        mln = self.mrf.mln
+        weights = list(mln.weights)
+        lazy = LazyGrounding(self.mrf, self.converter.formulas(), simplify=True, unsatfailure=True)
+        mln.weights = weights
+        with span('infer.setup', method=type(self).__name__):
+            gndformulas = list(lazy.itergroundings())
+        iteration = 0
+        while True:
+            iteration += 1
+            wcsp = self.converter.convert(gndformulas)
+            if wcsp.constraints:
+                solution, cost = wcsp.solve(timeout=self.timeleft, multicore=self.multicore)
+                if solution is None:
+                    return wcsp, None, None
+                world = list(self.mrf.evidence)
+                for varidx, validx in enumerate(solution):
+                    self.converter.variables[varidx].setval(self.converter.domains[varidx][validx], world)
+            else: # no constraints yet, so any world is optimal
+                world = lazy.world()
+                solution = [self.converter.val2idx[i][tuple(var.evidence_value(world))] for i, var in sorted(self.converter.variables.items())]
+                cost = 0
+            violated = list(lazy.iterviolated(world))
+            logger.debug('cutting plane iteration %d: %d ground formulas, %d violated' % (iteration, len(gndformulas), len(violated)))
+            event('infer.cuttingplane', iteration=iteration, groundings=len(gndformulas), violated=len(violated))
+            if self.callback is not None:
+                self._progress(self._queryresults(solution), cost=cost * (wcsp.divisor or 0), iteration=iteration, violated=len(violated))
+            if not violated or self.expired:
+                return wcsp, solution, cost
+            gndformulas.extend(violated)
+
+
+    def _queryresults(self, solution):
+        """
+        Returns a dict mapping the queries to their truth values in the given
+        WCSP solution.
+        """
+        result = self._solution2dict(solution)
+        result_ = {}
+        for query in self.queries:
+            query = str(query)
+            result_[query] = result[query] if query in result else self.mrf[query]
         return result_
+
+
+    def _callback(self, wcsp):
+        """
+        Returns the function reporting the intermediate solutions of `wcsp`
+        to the `callback`, if there is one.
+        """
+        if self.callback is None:
+            return None
+        return lambda cost, solution: self._progress(self._queryresults(solution), cost=cost * wcsp.divisor)
+
+
+    def _solution2dict(self, solution):
+        """
+        Returns a dict mapping the ground atom names to their truth values
+        in the given WCSP solution.
+        """
+        result = {}
+        for varidx, validx in enumerate(solution):
+            value = self.converter.domains[varidx][validx]
+            result.update(self.converter.variables[varidx].value2dict(value))
+        return dict([(str(self.mrf.gndatom(idx)), val) for idx, val in result.items()])
+    
+    
+    def _marginalmap(self):
+        """
+        Returns the assignment of the query atoms with the highest probability
+        mass among the best solutions, i.e. the probabilities of the solutions
+        agreeing on the query atoms are summed up.
+        """
+        scores = defaultdict(list)
+        for result, cost in self.solutions:
+            scores[tuple(sorted(result.items()))].append(-cost)
+        def logsum(x):
+            m = max(x)
+            return m + log(sum([exp(x_ - m) for x_ in x]))
+        return dict(max(scores, key=lambda a: logsum(scores[a])))
     
     
     def result_dict(self, verbose=False):
@@ -59,14 +212,10 @@ class WCSPInference(Inference):
         Returns a Database object with the most probable truth assignment.
         """
         wcsp = self.converter.convert()
-        solution, _ = wcsp.solve()
+        solution, _ = wcsp.solve(timeout=self.timeout, multicore=self.multicore)
         if solution is None:
             raise Exception('MLN is unsatisfiable.')
-        result = {}
-        for varidx, validx in enumerate(solution):
-            value = self.converter.domains[varidx][validx]
-            result.update(self.converter.variables[varidx].value2dict(value))
-        return dict([(str(self.mrf.gndatom(idx)), val) for idx, val in result.items()])
+        return self._solution2dict(solution)
 
 
 
@@ -82,8 +231,7 @@ class WCSPConverter(object):
         self.constraints = {} # mapping the signature of a constaint to its constraint object
         self.verbose = verbose
         self._createvars()
-        self.wcsp = WCSP()
-        self.wcsp.domsizes = [len(self.domains[i]) for i in self.variables]
+        self.wcsp = None
         self.multicore = multicore
     
     
@@ -97,31 +245,32 @@ class WCSPConverter(object):
         self.atom2var = {} # maps ground atom indices to their variable index
         self.val2idx = defaultdict(dict)
         varidx = 0
+        evidence = self.mrf.evidence_dicti()
         for variable in self.mrf.variables:
             if isinstance(variable, FuzzyVariable): # fuzzy variables are not subject to reasoning
                 continue
-            if variable.valuecount(self.mrf.evidence_dicti()) == 1: # the var is fully determined by the evidence
-                for _, value in variable.itervalues(self.mrf.evidence_dicti()):
+            if variable.valuecount(evidence) == 1: # the var is fully determined by the evidence
+                for _, value in variable.itervalues(evidence):
                     break
                 self.mrf.set_evidence(variable.value2dict(value), erase=False)
+                evidence.update(variable.value2dict(value))
                 continue
             self.variables[varidx] = variable
             for gndatom in variable.gndatoms:
                 self.atom2var[gndatom.idx] = varidx
-            for validx, (_, value) in enumerate(variable.itervalues(self.mrf.evidence_dicti())):
+            for validx, (_, value) in enumerate(variable.itervalues(evidence)):
                 self.domains[varidx].append(value)
                 self.val2idx[varidx][value] = validx
             varidx += 1
 
-    def convert(self):
+    def formulas(self):
         """
-        Performs a conversion from an MLN into a WCSP.
+        Returns the formulas the WCSP is built from, i.e. the formulas of the
+        MRF with non-zero weights in negation normal form, where formulas with
+        negative weights are negated. Note that the weights of negated formulas
+        are set to their absolute values in the MLN.
         """
-        # mln to be restored after inference
-        self._weights = list(self.mrf.mln.weights)
-        mln = self.mrf.mln
-        logic = mln.logic
-        # preprocess the formulas
+        logic = self.mrf.mln.logic
         formulas = []
         for f in self.mrf.formulas:
             if f.weight == 0: 
@@ -130,10 +279,27 @@ class WCSPConverter(object):
                 f = logic.negate(f)
                 f.weight = -f.weight
             formulas.append(f.nnf())
-        # preprocess the ground formulas
-#         grounder = DefaultGroundingFactory(self.mrf, formulas=formulas, simplify=True, unsatfailure=True, multicore=self.multicore, verbose=self.verbose)
-        grounder = FastConjunctionGrounding(self.mrf, simplify=True, unsatfailure=True, formulas=formulas, multicore=self.multicore, verbose=self.verbose, cache=0)
-        for gf in grounder.itergroundings():
+        return formulas
+
+
+    def convert(self, gndformulas=None):
+        """
+        Performs a conversion from an MLN into a WCSP.
+        
+        :param gndformulas:    (optional) the ground formulas the WCSP is built from,
+                               which must be groundings of the formulas returned by
+                               :meth:`formulas`. By default, all groundings are used.
+        """
+        # mln to be restored after inference
+        self._weights = list(self.mrf.mln.weights)
+        formulas = self.formulas()
+        self.wcsp = WCSP()
+        self.wcsp.domsizes = [len(self.domains[i]) for i in self.variables]
+        if gndformulas is None:
+            # preprocess the ground formulas
+            grounder = FastConjunctionGrounding(self.mrf, simplify=True, unsatfailure=True, formulas=formulas, multicore=self.multicore, verbose=self.verbose, cache=0)
+            gndformulas = grounder.itergroundings()
+        for gf in gndformulas:
             if isinstance(gf, Logic.TrueFalse):
                 if gf.weight == HARD and gf.truth() == 0:
                     raise SatisfiabilityException('MLN is unsatisfiable: hard constraint %s violated' % self.mrf.mln.formulas[gf.idx])
@@ -259,18 +425,22 @@ class WCSPConverter(object):
             for d in domains: worlds *= len(d)
             if worlds > 1000000:
                 logger.warning('!!! WARNING: %d POSSIBLE WORLDS ARE GOING TO BE EVALUATED. KEEP IN SIGHT YOUR MEMORY CONSUMPTION !!!' % worlds)
-            for c in combinations(domains):
-                world = [0] * len(self.mrf.gndatoms)
+            # the formula only depends on the atoms of its variables, so
+            # it is evaluated in a local world containing just these
+            world = dict([(atom.idx, 0) for v in varindices for atom in self.variables[v].gndatoms])
+            for c in product(*domains):
                 assignment = []
                 for varidx, value in zip(varindices, c):
-                    world = self.variables[varidx].setval(value, world)
+                    self.variables[varidx].setval(value, world)
                     assignment.append(self.val2idx[varidx][value])
                 # the MRF feature imposed by this formula 
                 truth = formula(world)
                 if truth is None:
+                    world_ = [0] * len(self.mrf.gndatoms)
+                    for atomidx, value in world.items(): world_[atomidx] = value
                     print('POSSIBLE WORLD:')
                     print('===============')
-                    self.mrf.print_world_vars(world)
+                    self.mrf.print_world_vars(world_)
                     print('GROUND FORMULA:')
                     print('===============')
                     formula.print_structure(world)
@@ -33,12 +33,11 @@ from dnutils import logs, out
 from dnutils.console import barstr
 from numpy.ma.core import sqrt, log
 
-from ..constants import HARD
 from ..errors import SatisfiabilityException
-from ..grounding.bpll import BPLLGroundingFactory
-from ..grounding.default import DefaultGroundingFactory
-from .common import DiscriminativeLearner, AbstractLearner
-from ..util import fsum, temporary_evidence
+from ..grounding.bpll import BPLLGroundingFactory, compiled_formula_groundings
+from ..grounding.variants import group_variants
+from .common import DiscriminativeLearner, AbstractLearner, LocalConditionals, soft_weights, cov_hessian
+from ..util import fsum
 
 logger = logs.getlogger(__name__)
 
@@ -52,49 +51,31 @@ class BPLL(AbstractLearner):
     This learner is fairly efficient, as it computes f and grad based only
     on a sufficient statistic.
     '''
+
+    _checkpoint_attrs = ('_stat', '_varidx2fidx')
     
     def __init__(self, mrf, **params):
         AbstractLearner.__init__(self, mrf, **params)
         self._pls = None
         self._stat = None
         self._varidx2fidx = None
+        self._logpls = None
+        self._flatpls = None
         self._lastw = None
+        self._blockcache = None
+
+    @property
+    def usehessp(self):
+        return True
         
     def _prepare(self):
         logger.debug("computing statistics...") 
         self._compute_statistics()
 #         print self._stat
     
-    def _pl(self, varidx, w):
-        '''
-        Computes the pseudo-likelihoods for the given variable under weights w. 
-        '''
-        var = self.mrf.variable(varidx)
-        values = var.valuecount()
-        gfs = self._varidx2fidx.get(varidx)
-        if gfs is None: # no list was saved, so the truth of all formulas is unaffected by the variable's value
-            # uniform distribution applies
-            p = 1.0 / values
-            return [p] * values
-        sums = [0] * values#numpy.zeros(values)
-        for fidx in gfs:
-            for validx, n in enumerate(self._stat[fidx][varidx]):
-                if w[fidx] == HARD: 
-                    # set the prob mass of every value violating a hard constraint to None
-                    # to indicate a globally inadmissible value. We will set those ones to 0 afterwards.
-                    if n == 0: sums[validx] = None
-                elif sums[validx] is not None:
-                    # don't set it if this value has already been assigned marked as inadmissible.
-                    sums[validx] += n * w[fidx]
-        expsums = [numpy.exp(s) if s is not None else 0 for s in sums]#numpy.exp(numpy.array(sums))
-        z = sum(expsums)
-        if z == 0: raise SatisfiabilityException('MLN is unsatisfiable: all probability masses of variable %s are zero.' % str(var))
-        return [w_ / z for w_ in expsums]
-#         sum_max = numpy.max(sums)
-#         sums -= sum_max
-#         expsums = numpy.sum(numpy.exp(sums))
-#         s = numpy.log(expsums)    
-#         return numpy.exp(sums - s)
+    @property
+    def variables(self):
+        return self.mrf.variables
 
     def write_pls(self):
         for var in self.mrf.variables:
@@ -102,34 +83,84 @@ class BPLL(AbstractLearner):
             for i, value in var.itervalues():
                 print('    ', barstr(width=50, color='magenta', percent=self._pls[var.idx][i]) + ('*' if var.evidence_value_index() == i else ' '), i, value)
 
+    def _blocks(self):
+        '''
+        Returns triples `(varidx, fidxs, counts)` of the variables, the formulas
+        they are involved in and the matrices of the formula counts for every
+        value of the variables.
+        '''
+        return self._cache()[1]
+
+    def _conditionals(self):
+        '''
+        Returns the :class:`LocalConditionals` of the variables.
+        '''
+        return self._cache()[2]
+
+    def _cache(self):
+        # the count matrices and the conditionals are cached as long as
+        # the statistics remain the same
+        if self._blockcache is None or self._blockcache[0] is not self._stat:
+            blocks = []
+            uniform = []
+            for var in self.variables:
+                fidxs = self._varidx2fidx.get(var.idx)
+                if fidxs is None: # the truth of all formulas is unaffected by the variable's value
+                    uniform.append(var)
+                    continue
+                fidxs = sorted(fidxs)
+                counts = numpy.array([self._stat[fidx][var.idx] for fidx in fidxs], numpy.float64).T
+                blocks.append((var.idx, fidxs, counts))
+            cond = LocalConditionals(blocks, [self.mrf.variable(varidx).evidence_value_index() for varidx, _, _ in blocks])
+            # the uniform distributions contribute a constant to the pseudo-log-likelihood
+            self._blockcache = (self._stat, blocks, cond, -fsum([numpy.log(var.valuecount()) for var in uniform]))
+        return self._blockcache
+
     def _compute_pls(self, w):
         if self._pls is None or self._lastw is None or self._lastw != list(w):
-            self._pls = [self._pl(var.idx, w) for var in self.mrf.variables]
+            cond = self._conditionals()
+            logpls, logz = cond.logprobs(*soft_weights(w))
+            unsat = numpy.nonzero(numpy.isneginf(logz))[0]
+            if len(unsat):
+                raise SatisfiabilityException('MLN is unsatisfiable: all probability masses of variable %s are zero.' % str(self.mrf.variable(cond.keys[unsat[0]])))
+            self._logpls = logpls
+            self._flatpls = numpy.exp(logpls)
+            # variables without statistics are uniformly distributed
+            self._pls = [None] * len(self.mrf.variables)
+            for varidx, pls in zip(cond.keys, cond.split(self._flatpls)):
+                self._pls[varidx] = pls
+            for var in self.mrf.variables:
+                if self._pls[var.idx] is None:
+                    self._pls[var.idx] = numpy.ones(var.valuecount()) / var.valuecount()
             self._lastw = list(w)
 #             self.write_pls()
     
     def _f(self, w):
         self._compute_pls(w)
-        probs = []
-        for var in self.mrf.variables:
-            p = self._pls[var.idx][var.evidence_value_index()]
-            if p == 0: p = 1e-10 # prevent 0 probabilities
-            probs.append(p)
-        return fsum(list(map(log, probs)))
+        # evidence values violating hard formulas get a probability of 1e-10 instead
+        # of 0. as opposed to clipping all probabilities, this keeps f consistent with
+        # its gradient for large weights
+        logpls = self._logpls[self._conditionals().evrows]
+        logpls = numpy.where(numpy.isneginf(logpls), numpy.log(1e-10), logpls)
+        return fsum(logpls) + self._cache()[3]
 
     def _grad(self, w):
         self._compute_pls(w)
-        grad = numpy.zeros(len(self.mrf.formulas), numpy.float64)        
-        for fidx, varval in self._stat.items():
-            for varidx, counts in varval.items():
-                evidx = self.mrf.variable(varidx).evidence_value_index()
-                g = counts[evidx]
-                for i, val in enumerate(counts):
-                    g -= val * self._pls[varidx][i]
-                grad[fidx] += g
+        grad = self._conditionals().grad(self._flatpls, len(self.mrf.formulas))
         self.grad_opt_norm = sqrt(float(fsum([x * x for x in grad])))
         return numpy.array(grad)
 
+    def _hessp(self, w, v):
+        self._compute_pls(w)
+        return self._conditionals().hessp(self._flatpls, v)
+
+    def _hessian(self, w):
+        self._compute_pls(w)
+        hessian = numpy.zeros((len(self.mrf.formulas), len(self.mrf.formulas)), numpy.float64)
+        for varidx, fidxs, counts in self._blocks():
+            hessian[numpy.ix_(fidxs, fidxs)] += cov_hessian(counts, self._pls[varidx])
+        return hessian
+
     def _addstat(self, fidx, varidx, validx, inc=1):
         if fidx not in self._stat:
             self._stat[fidx] = {}
@@ -144,17 +175,12 @@ class BPLL(AbstractLearner):
         '''
         self._stat = {}
         self._varidx2fidx = defaultdict(set)
-        grounder = DefaultGroundingFactory(self.mrf, simplify=False, unsatfailure=True, verbose=self.verbose, cache=0)
-        for f in grounder.itergroundings():
-            for gndatom in f.gndatoms():
-                var = self.mrf.variable(gndatom)
-                with temporary_evidence(self.mrf):
-                    for validx, value in var.itervalues():
-                        var.setval(value, self.mrf.evidence)
-                        truth = f(self.mrf.evidence) 
-                        if truth != 0:
-                            self._varidx2fidx[var.idx].add(f.idx)
-                            self._addstat(f.idx, var.idx, validx, truth)
+        # the variants of formula templates are compiled and grounded only once
+        for formula in group_variants(self.mrf.formulas):
+            for fidx, stat in compiled_formula_groundings(self.mrf, formula, unsatfailure=True):
+                for varidx, validx, truth in stat:
+                    self._varidx2fidx[varidx].add(fidx)
+                    self._addstat(fidx, varidx, validx, truth)
                 
                 
 class DPLL(BPLL, DiscriminativeLearner):
@@ -162,35 +188,16 @@ class DPLL(BPLL, DiscriminativeLearner):
     Discriminative pseudo-log-likelihood learning.
     '''
 
-    def _f(self, w, **params):
-        self._compute_pls(w)
-        probs = []
-        for var in self.mrf.variables:
-            if var.predicate.name in self.epreds: continue
-            p = self._pls[var.idx][var.evidence_value_index()]
-            if p == 0: p = 1e-10 # prevent 0 probabilities
-            probs.append(p)
-        return fsum(list(map(log, probs)))
-
-    def _grad(self, w, **params):        
-        self._compute_pls(w)
-        grad = numpy.zeros(len(self.mrf.formulas), numpy.float64)        
-        for fidx, varval in self._stat.items():
-            for varidx, counts in varval.items():
-                if self.mrf.variable(varidx).predicate.name in self.epreds: continue
-                evidx = self.mrf.variable(varidx).evidence_value_index()
-                g = counts[evidx]
-                for i, val in enumerate(counts):
-                    g -= val * self._pls[varidx][i]
-                grad[fidx] += g
-        self.grad_opt_norm = sqrt(float(fsum([x * x for x in grad])))
-        return numpy.array(grad)
+    @property
+    def variables(self):
+        return [var for var in self.mrf.variables if var.predicate.name not in self.epreds]
 
 
 class BPLL_CG(BPLL):
     
     def _prepare(self):
-        grounder = BPLLGroundingFactory(self.mrf, multicore=self.multicore, verbose=self.verbose)
+        grounder = BPLLGroundingFactory(self.mrf, multicore=self.multicore, verbose=self.verbose,
+                                        splitsize=self._params.get('splitsize'))
         for _ in grounder.itergroundings(): pass
         self._stat = grounder._stat
         self._varidx2fidx = grounder._varidx2fidx
@@ -199,7 +206,8 @@ class BPLL_CG(BPLL):
 class DBPLL_CG(DPLL):
     
     def _prepare(self):
-        grounder = BPLLGroundingFactory(self.mrf, multicore=self.multicore, verbose=self.verbose)
+        grounder = BPLLGroundingFactory(self.mrf, multicore=self.multicore, verbose=self.verbose,
+                                        splitsize=self._params.get('splitsize'))
         for _ in grounder.itergroundings(): pass
         self._stat = grounder._stat
         self._varidx2fidx = grounder._varidx2fidx
@@ -22,29 +22,55 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 from dnutils import logs
 
-from .common import AbstractLearner, DiscriminativeLearner
+from .common import AbstractLearner, DiscriminativeLearner, compiled_groundings, LocalConditionals, soft_weights, cov_hessian
 import random
 from collections import defaultdict
-from ..util import fsum, dict_union, temporary_evidence
+from multiprocessing import Pool, cpu_count
+from ..util import fsum
 from numpy.ma.core import log, sqrt
 import numpy
 from ...logic.common import Logic
-from ..constants import HARD
+from ...utils.multicore import with_tracing, poolsize
 from ..errors import SatisfiabilityException
+from ..grounding.variants import group_variants
 
 
 logger = logs.getlogger(__name__)
 
+# this readonly global is for multiprocessing to exploit copy-on-write
+# on linux systems
+global_cll = None
+
+
+# multiprocessing function
+def _compute_partition_statistics(pidx):
+    return pidx, global_cll._partition_statistics(global_cll.partitions[pidx])
+
 
 class CLL(AbstractLearner):
     """
     Implementation of composite-log-likelihood learning.
+
+    The variables of the MRF are divided into partitions of `partsize`
+    variables, either randomly (`partitioning='random'`) or such that
+    variables sharing many ground formulas end up in the same partition
+    (`partitioning='graph'`). The ground formulas are computed only once
+    and are reused for every repetition with new partitions.
     """
     
     def __init__(self, mrf, **params):
         AbstractLearner.__init__(self, mrf, **params)
         self.partitions = []
         self.repart = 0
+        self._groundings = None
+        self._blockcache = None
+        self._logprobs = None
+        self._flatprobs = None
+
+
+    @property
+    def usehessp(self):
+        return True
 
 
     @property
@@ -52,6 +78,11 @@ class CLL(AbstractLearner):
         return self._params.get('partsize', 1)
 
 
+    @property
+    def partitioning(self):
+        return self._params.get('partitioning', 'random')
+
+
     @property
     def maxiter(self):
         return self._params.get('maxiter', 10)
@@ -63,7 +94,6 @@ class CLL(AbstractLearner):
     
     
     def _prepare(self):
-        # create random partition of the ground atoms
         self.partitions = []
         self.atomidx2partition = {}
         self.partition2formulas = defaultdict(set)
@@ -74,12 +104,17 @@ class CLL(AbstractLearner):
         self.iter = 0
         self.probs = {}
         self._stat = {}
-        size = self.partsize
-        variables = list(self.variables)
-        if size > 1:
-            random.shuffle(variables)
-        while len(variables) > 0:
-            vars_ = variables[:size if len(variables) > size else len(variables)]
+        # the grounding does not depend on the partitions, so it is
+        # computed only once and reused in every repetition
+        if self._groundings is None:
+            self._ground()
+        if self.partitioning == 'random':
+            partitions = self._random_partitions()
+        elif self.partitioning == 'graph':
+            partitions = self._graph_partitions()
+        else:
+            raise Exception('Unknown partitioning strategy: %s' % self.partitioning)
+        for vars_ in partitions:
             partidx = len(self.partitions)
             partition = CLL.Partition(self.mrf, vars_, partidx)
             # create the mapping from atoms to their partitions
@@ -89,14 +124,89 @@ class CLL(AbstractLearner):
             self.valuecounts[partidx] = partition.valuecount()
             self.partitions.append(partition)
             self.evidx[partidx] = partition.evidenceidx()
-            variables = variables[len(partition.variables):]
         logger.debug('CLL created %d partitions' % len(self.partitions))
         self._compute_statistics()
 
         
     def repeat(self):
         return True
-        
+
+
+    def _random_partitions(self):
+        # create random partition of the ground atoms
+        size = self.partsize
+        variables = list(self.variables)
+        if size > 1:
+            random.shuffle(variables)
+        return [variables[i:i + size] for i in range(0, len(variables), size)]
+
+
+    def _graph_partitions(self):
+        """
+        Groups strongly coupled variables into the same partitions.
+
+        Starting from a randomly chosen seed variable, every partition is
+        grown greedily by the variable that shares the most ground formulas
+        with the variables already in the partition, until it contains
+        `partsize` variables or has no more unassigned neighbors.
+        """
+        size = self.partsize
+        variables = list(self.variables)
+        random.shuffle(variables)
+        partitions = []
+        assigned = set()
+        for seed in variables:
+            if seed.idx in assigned: continue
+            partition = [seed]
+            assigned.add(seed.idx)
+            coupling = defaultdict(int)
+            neighbor = seed.idx
+            while len(partition) < size:
+                for varidx, count in self._coupling.get(neighbor, {}).items():
+                    if varidx not in assigned:
+                        coupling[varidx] += count
+                if not coupling: break
+                neighbor = max(coupling, key=lambda v: (coupling[v], -v))
+                del coupling[neighbor]
+                partition.append(self.mrf.variable(neighbor))
+                assigned.add(neighbor)
+            partitions.append(partition)
+        return partitions
+
+
+    def _ground(self):
+        """
+        Grounds all formulas once and stores the groundings together with
+        the variables they depend on, as well as the co-occurrence graph of
+        the variables in the ground network.
+        """
+        self._groundings = []
+        self._evaluators = []
+        self._varidx2gidx = defaultdict(list)
+        self._coupling = defaultdict(dict)
+        varidxs = set([var.idx for var in self.variables])
+        # the variants of formula templates are compiled and grounded only once
+        for formula in group_variants(self.mrf.formulas):
+            evalidx = None
+            for fidx, compiled, gnd, atoms in compiled_groundings(self.mrf, formula):
+                variables = []
+                for atomidx in atoms:
+                    varidx = self.mrf.variable(self.mrf.gndatom(atomidx)).idx
+                    if varidx in varidxs and varidx not in variables:
+                        variables.append(varidx)
+                if not variables: continue
+                if evalidx is None:
+                    evalidx = len(self._evaluators)
+                    self._evaluators.append(compiled)
+                gidx = len(self._groundings)
+                self._groundings.append((fidx, evalidx, gnd))
+                for varidx in variables:
+                    self._varidx2gidx[varidx].append(gidx)
+                    for varidx2 in variables:
+                        if varidx2 != varidx:
+                            self._coupling[varidx][varidx2] = self._coupling[varidx].get(varidx2, 0) + 1
+        logger.debug('CLL cached %d ground formulas' % len(self._groundings))
+
         
     def _addstat(self, fidx, pidx, validx, inc=1):
         if fidx not in self._stat:
@@ -113,175 +223,146 @@ class CLL(AbstractLearner):
     def _compute_statistics(self):
         self._stat = {}
         self.partition2formulas = defaultdict(set)
-        for formula in self.mrf.formulas:
-            literals = []
-            for lit in formula.literals():
-                literals.append(lit)
-            # in case of a conjunction, rearrange the literals such that 
-            # equality constraints are evaluated first
-            isconj = self.mrf.mln.logic.islitconj(formula)
-            if isconj:
-                literals = sorted(literals, key=lambda l: -1 if isinstance(l, Logic.Equality) else 1)
-            self._compute_stat_rec(literals, [], {}, formula, isconj=isconj)
-    
+        if self.multicore and len(self.partitions) > 1:
+            global global_cll
+            global_cll = self
+            pool = Pool(poolsize())
+            try:
+                for pidx, stat in pool.imap(with_tracing(_compute_partition_statistics), range(len(self.partitions)),
+                                            chunksize=max(1, len(self.partitions) // (4 * cpu_count()))):
+                    self._merge_statistics(pidx, stat)
+            except Exception as e:
+                logger.error('Error in child process. Terminating pool...')
+                pool.close()
+                raise e
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            for partition in self.partitions:
+                self._merge_statistics(partition.idx, self._partition_statistics(partition))
+
+
+    def _merge_statistics(self, pidx, stat):
+        for fidx, counts in stat.items():
+            self.partition2formulas[pidx].add(fidx)
+            for validx, n in counts.items():
+                self._addstat(fidx, pidx, validx, n)
+
+
+    def _partition_statistics(self, partition):
+        """
+        Computes the sufficient statistics of a partition, i.e. the truth values
+        of the ground formulas it appears in for every value of the partition,
+        while all other atoms keep their evidence values.
+
+        :returns:    a dict mapping formula indices to dicts mapping the
+                     indices of the partition values to the (nonzero)
+                     truth values of the groundings.
+        """
+        gidxs = set()
+        for var in partition.variables:
+            gidxs.update(self._varidx2gidx.get(var.idx, ()))
+        groundings = [self._groundings[i] for i in sorted(gidxs)]
+        truths = [e.truth for e in self._evaluators]
+        world = list(self.mrf.evidence)
+        stat = defaultdict(lambda: defaultdict(int))
+        for value in partition.itervalues():
+            validx = partition.valueidx(value)
+            for atomidx, v in partition.value2dict(value).items():
+                world[atomidx] = v
+            for fidx, evalidx, gnd in groundings:
+                t = truths[evalidx](world, gnd)
+                if t != 0:
+                    stat[fidx][validx] += t
+        return dict([(fidx, dict(counts)) for fidx, counts in stat.items()])
     
-    def _compute_stat_rec(self, literals, gndliterals, var_assign, formula, f_gndlit_parts=None, processed=None, isconj=False):
+
+    def _blocks(self):
         """
-        TODO: make sure that there are no equality constraints in the conjunction!
+        Returns triples `(pidx, fidxs, counts)` of the partitions, the formulas
+        they are involved in and the matrices of the formula counts for every
+        value of the partitions.
         """
+        return self._cache()[1]
 
-        if len(literals) == 0:
-            # at this point, we have a fully grounded conjunction in gndliterals
-            # create a mapping from a partition to the ground literals in this formula
-            # (criterion no. 1, applies to all kinds of formulas)
-            part2gndlits = defaultdict(list)
-            part_with_f_lit = None
-            for gndlit in gndliterals:
-                if isinstance(gndlit, Logic.Equality) or hasattr(self, 'qpreds') and gndlit.gndatom.predname not in self.qpreds: continue
-                part = self.atomidx2partition[gndlit.gndatom.idx]
-                part2gndlits[part].append(gndlit)
-                if gndlit(self.mrf.evidence) == 0:
-                    part_with_f_lit = part
-
-            # if there is a false ground literal we only need to take into account
-            # the partition comprising this literal (criterion no. 2)
-            # there is maximally one such partition with false literals in the conjunction
-            # because of criterion no. 5
-            if isconj and part_with_f_lit is not None:
-                gndlits = part2gndlits[part_with_f_lit]
-                part2gndlits = {part_with_f_lit: gndlits}
-            if not isconj: # if we don't have a conjunction, ground the formula with the given variable assignment
-                # print 'formula', formula
-                gndformula = formula.ground(self.mrf, var_assign)
-                # print 'gndformula', gndformula
-                # stop()
-            for partition, gndlits in part2gndlits.items():
-                # for each partition, select the ground atom truth assignments
-                # in such a way that the conjunction is rendered true. There
-                # is precisely one such assignment for each partition. (criterion 3/4)
-                evidence = {}
-                if isconj:
-                    for gndlit in gndlits:
-                        evidence[gndlit.gndatom.idx] = 0 if gndlit.negated else 1
-                for world in partition.itervalues(evidence):
-                    # update the sufficient statistics for the given formula, partition and world value
-                    worldidx = partition.valueidx(world)
-                    if isconj:
-                        truth = 1
-                    else:
-                        # temporarily set the evidence in the MRF, compute the truth value of the 
-                        # formula and remove the temp evidence
-                        with temporary_evidence(self.mrf):
-                            for atomidx, value in partition.value2dict(world).items():
-                                self.mrf.set_evidence({atomidx: value}, erase=True)
-                            truth = gndformula(self.mrf.evidence)
-                            if truth is None:
-                                print(gndformula)
-                                print(gndformula.print_structure(self.mrf.evidence))
-
-                    if truth != 0:
-                        self.partition2formulas[partition.idx].add(formula.idx)
-                        self._addstat(formula.idx, partition.idx, worldidx, truth)
-            return
-            
-        lit = literals[0]
-        # ground the literal with the existing assignments
-        gndlit = lit.ground(self.mrf, var_assign, partial=True)
-        for assign in Logic.iter_eq_varassignments(gndlit, formula, self.mrf) if isinstance(gndlit, Logic.Equality) else gndlit.itervargroundings(self.mrf):
-            # copy the arguments to avoid side effects
-            # if f_gndlit_parts is None: f_gndlit_parts = set()
-            # else: f_gndlit_parts = set(f_gndlit_parts)
-            if processed is None: processed = []
-            else: processed = list(processed)
-            # ground with the remaining free variables
-            gndlit_ = gndlit.ground(self.mrf, assign)
-            truth = gndlit_(self.mrf.evidence)
-            # treatment of equality constraints
-            if isinstance(gndlit_, Logic.Equality):
-                if isconj:
-                    if truth == 1:
-                        self._compute_stat_rec(literals[1:], gndliterals, dict_union(var_assign, assign), formula, f_gndlit_parts, processed, isconj)
-                    else: continue
-                else:
-                    self._compute_stat_rec(literals[1:], gndliterals + [gndlit_], dict_union(var_assign, assign), formula, f_gndlit_parts, processed, isconj) 
-                continue
-            atom = gndlit_.gndatom
-
-            if atom.idx in processed: continue
-            
-            # if we encounter a gnd literal that is false by the evidence
-            # and there is already a false one in this grounding from a different
-            # partition, we can stop the grounding process here. The gnd conjunction
-            # will never ever be rendered true by any of this partitions values (criterion no. 5)
-            isevidence = hasattr(self, 'qpreds') and gndlit_.gndatom.predname not in self.qpreds
-            #assert isEvidence == False
-            if isconj and truth == 0:
-                if f_gndlit_parts is not None and atom not in f_gndlit_parts:
-                    continue
-                elif isevidence: continue
-                else:
-                    self._compute_stat_rec(literals[1:], gndliterals + [gndlit_], dict_union(var_assign, assign), formula, self.atomidx2partition[atom.idx], processed, isconj) 
+
+    def _conditionals(self):
+        """
+        Returns the :class:`LocalConditionals` of the partitions.
+        """
+        return self._cache()[2]
+
+
+    def _cache(self):
+        # the count matrices and the conditionals are cached as long as
+        # the statistics remain the same
+        if self._blockcache is None or self._blockcache[0] is not self._stat:
+            blocks = []
+            uniform = []
+            for pidx in range(len(self.partitions)):
+                fidxs = sorted(self.partition2formulas.get(pidx, ()))
+                if not fidxs: # no formula is affected by the values of the partition
+                    uniform.append(pidx)
                     continue
-            elif isconj and isevidence:
-                self._compute_stat_rec(literals[1:], gndliterals, dict_union(var_assign, assign), formula, f_gndlit_parts, processed, isconj) 
-                continue
-                 
-            self._compute_stat_rec(literals[1:], gndliterals + [gndlit_], dict_union(var_assign, assign), formula, f_gndlit_parts, processed, isconj) 
-    
+                counts = numpy.array([self._stat[fidx][pidx] for fidx in fidxs], numpy.float64).T
+                blocks.append((pidx, fidxs, counts))
+            cond = LocalConditionals(blocks, [self.evidx[pidx] for pidx, _, _ in blocks])
+            # the uniform distributions contribute a constant to the composite log-likelihood
+            self._blockcache = (self._stat, blocks, cond, uniform, -fsum([numpy.log(self.valuecounts[pidx]) for pidx in uniform]))
+        return self._blockcache
+
 
     def _compute_probs(self, w):
-        probs = {}#numpy.zeros(len(self.partitions))
-        for pidx in range(len(self.partitions)):
-            expsums = [0] * self.valuecounts[pidx]
-            for fidx in self.partition2formulas[pidx]:
-                for i, v in enumerate(self._stat[fidx][pidx]):
-                    if w[fidx] == HARD:
-                        if v == 0: expsums[i] = None
-                    elif expsums[i] is not None:
-#                         out('adding', v, '*', w[fidx], 'to', i)
-                        expsums[i] += v * w[fidx]
-#                         stop(expsums)
-#             sum_max = numpy.max(sums)
-#             sums -= sum_max
-#             expsums = numpy.sum(numpy.exp(sums))
-#             s = numpy.log(expsums)
-#             probs[pidx] = numpy.exp(sums - s)
-#             out(w)
-            expsum = numpy.array([numpy.exp(s) if s is not None else 0 for s in expsums])# leave out the inadmissible values
-            z = fsum(expsum)
-            if z == 0: raise SatisfiabilityException('MLN is unsatisfiable: all probability masses of partition %s are zero.' % str(self.partitions[pidx]))
-            probs[pidx] = expsum / z
-            self.probs[pidx] = expsum
+        cond = self._conditionals()
+        logprobs, logz = cond.logprobs(*soft_weights(w))
+        unsat = numpy.nonzero(numpy.isneginf(logz))[0]
+        if len(unsat):
+            raise SatisfiabilityException('MLN is unsatisfiable: all probability masses of partition %s are zero.' % str(self.partitions[cond.keys[unsat[0]]]))
+        self._logprobs = logprobs
+        self._flatprobs = numpy.exp(logprobs)
+        probs = dict(zip(cond.keys, cond.split(self._flatprobs)))
+        for pidx in self._cache()[3]:
+            probs[pidx] = numpy.ones(self.valuecounts[pidx]) / self.valuecounts[pidx]
         self.probs = probs
         return probs
-        
 
-    def _f(self, w):
+
+    def _update_probs(self, w):
         if self.current_wts is None or list(w) != self.current_wts:
             self.current_wts = list(w)
             self.probs = self._compute_probs(w)
-        likelihood = numpy.zeros(len(self.partitions))
-        for pidx in range(len(self.partitions)):
-            p = self.probs[pidx][self.evidx[pidx]]
-            if p == 0: p = 1e-10
-            likelihood[pidx] += p
+
+
+    def _f(self, w):
+        self._update_probs(w)
+        # evidence values violating hard formulas get a probability of 1e-10 instead
+        # of 0. as opposed to clipping all probabilities, this keeps f consistent with
+        # its gradient for large weights
+        logprobs = self._logprobs[self._conditionals().evrows]
+        logprobs = numpy.where(numpy.isneginf(logprobs), numpy.log(1e-10), logprobs)
         self.iter += 1
-        return fsum(list(map(log, likelihood)))
+        return fsum(logprobs) + self._cache()[4]
             
             
     def _grad(self, w, **params):    
-        if self.current_wts is None or not list(w) != self.current_wts:
-            self.current_wts = w
-            self.probs = self._compute_probs(w)
-        grad = numpy.zeros(len(w))
-        for fidx, partitions in self._stat.items():
-            for part, values in partitions.items():
-                v = values[self.evidx[part]]
-                for i, val in enumerate(values):
-                    v -= self.probs[part][i] * val
-                grad[fidx] += v
+        self._update_probs(w)
+        grad = self._conditionals().grad(self._flatprobs, len(w))
         self.grad_opt_norm = sqrt(float(fsum([x * x for x in grad])))
         return numpy.array(grad)
+
+
+    def _hessp(self, w, v):
+        self._update_probs(w)
+        return self._conditionals().hessp(self._flatprobs, v)
+
+
+    def _hessian(self, w):
+        self._update_probs(w)
+        hessian = numpy.zeros((len(w), len(w)), numpy.float64)
+        for pidx, fidxs, counts in self._blocks():
+            hessian[numpy.ix_(fidxs, fidxs)] += cov_hessian(counts, self.probs[pidx])
+        return hessian
     
     
     class Partition(object):
@@ -353,10 +434,8 @@ class CLL(AbstractLearner):
                  ...
             """
             idx = 0
-            for i, (var, val) in enumerate(zip(self.variables, value)):
-                exponential = 2 ** (len(self.variables) - i - 1)
-                validx = var.valueidx(val)
-                idx += validx * exponential
+            for var, val in zip(self.variables, value):
+                idx = idx * var.valuecount() + var.valueidx(val)
             return idx
                     
                 
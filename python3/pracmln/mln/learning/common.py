@@ -26,9 +26,17 @@
 from dnutils import logs, out
 
 from . import optimize
+import os
 import sys
+import time
+import pickle
+import hashlib
 from numpy.ma.core import exp
 from ..constants import HARD
+from ..errors import FormulaCompilationError
+from ..grounding.variants import FormulaVariants
+from ...logic.compiled import CompiledFormula
+from ...utils.tracing import tracer, span, event
 
 
 try:
@@ -39,6 +47,160 @@ except:
 logger = logs.getlogger(__name__)
 
 
+def _dump(obj, path):
+    # write to a temporary file first, so a crash cannot leave a corrupt file
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def soft_weights(w):
+    '''
+    Splits the weight vector `w` into a float vector of the soft weights, in
+    which hard weights are zero, and a boolean mask of the hard formulas.
+    '''
+    hard = numpy.array([w_ == HARD for w_ in w], dtype=bool)
+    return numpy.array([0. if h else float(w_) for w_, h in zip(w, hard)], numpy.float64), hard
+
+
+class LocalConditionals(object):
+    '''
+    The conditional distributions of a set of variables (or partitions of
+    variables) given all other atoms, which are log-linear in the formula
+    weights, i.e. the log-probability of the `i`-th value of a variable is
+    the sum of the formula weights multiplied by the counts of the true
+    groundings `n[i]`, normalized over all its values.
+
+    All conditionals are stored as one sparse list of counts, so they are
+    computed vectorized and in log space: the normalization uses a max-shifted
+    log-sum-exp, and values violating a hard formula (i.e. with a zero count
+    for it) get a log-probability of `-inf`.
+
+    :param blocks:      a list of triples `(key, fidxs, counts)`, where `counts`
+                        is the matrix of the counts of the formulas `fidxs`
+                        with one row for every value of the variable `key`.
+    :param evidence:    the indices of the evidence values of the blocks.
+    '''
+
+    def __init__(self, blocks, evidence):
+        self.keys = [key for key, _, _ in blocks]
+        self.sizes = numpy.array([counts.shape[0] for _, _, counts in blocks], dtype=int)
+        self.offsets = numpy.concatenate(([0], numpy.cumsum(self.sizes)[:-1])).astype(int)
+        self.blockid = numpy.repeat(numpy.arange(len(blocks)), self.sizes)
+        self.evrows = self.offsets + numpy.array(evidence, dtype=int)
+        rows, cols, vals, zrows, zcols = [[]], [[]], [[]], [[]], [[]]
+        for (_, fidxs, counts), offset in zip(blocks, self.offsets):
+            fidxs = numpy.array(fidxs, dtype=int)
+            r, c = numpy.nonzero(counts)
+            rows.append(r + offset)
+            cols.append(fidxs[c])
+            vals.append(counts[r, c])
+            r, c = numpy.nonzero(counts == 0)
+            zrows.append(r + offset)
+            zcols.append(fidxs[c])
+        self.rows, self.cols, self.zrows, self.zcols = [numpy.concatenate(x).astype(int) for x in (rows, cols, zrows, zcols)]
+        self.vals = numpy.concatenate(vals).astype(numpy.float64)
+        self.isev = numpy.zeros(len(self.blockid), numpy.float64)
+        self.isev[self.evrows] = 1
+
+    def __len__(self):
+        return len(self.keys)
+
+    def logprobs(self, w, hard):
+        '''
+        Computes the log-probabilities of all values of all blocks.
+
+        :param w:       the soft weights (see :func:`soft_weights`).
+        :param hard:    the boolean mask of the hard formulas.
+        :returns:       the flat array of log-probabilities and the array of
+                        the log-normalization constants of the blocks, which
+                        is `-inf` for blocks that have no admissible value.
+        '''
+        if not len(self):
+            return numpy.zeros(0), numpy.zeros(0)
+        sums = numpy.bincount(self.rows, weights=self.vals * w[self.cols], minlength=len(self.blockid))
+        if hard.any():
+            sums[numpy.bincount(self.zrows, weights=hard[self.zcols], minlength=len(self.blockid)) > 0] = -numpy.inf
+        maxes = numpy.maximum.reduceat(sums, self.offsets)
+        maxes[numpy.isneginf(maxes)] = 0
+        with numpy.errstate(divide='ignore'):
+            logz = maxes + numpy.log(numpy.add.reduceat(numpy.exp(sums - maxes[self.blockid]), self.offsets))
+        return sums - logz[self.blockid], logz
+
+    def split(self, values):
+        '''
+        Splits a flat array of the values of all blocks into a list of arrays.
+        '''
+        return [values[o:o + n] for o, n in zip(self.offsets, self.sizes)]
+
+    def grad(self, probs, n):
+        '''
+        Computes the gradient of the sum of the log-probabilities of the
+        evidence values, i.e. the evidence counts minus the expected counts.
+
+        :param probs:    the flat array of probabilities of all values.
+        :param n:        the number of formulas.
+        '''
+        return numpy.bincount(self.cols, weights=self.vals * (self.isev[self.rows] - probs[self.rows]), minlength=n)
+
+    def hessp(self, probs, v):
+        '''
+        Computes the product of the Hessian of the sum of the log-probabilities
+        of the evidence values, i.e. the negative sum of the covariance matrices
+        of the counts, with the vector `v`.
+        '''
+        nv = numpy.bincount(self.rows, weights=self.vals * v[self.cols], minlength=len(self.blockid))
+        mean = numpy.add.reduceat(probs * nv, self.offsets) if len(self) else numpy.zeros(0)
+        pn = self.vals * probs[self.rows]
+        return numpy.bincount(self.cols, weights=pn * (mean[self.blockid[self.rows]] - nv[self.rows]), minlength=len(v))
+
+
+def cov_hessian(counts, probs):
+    '''
+    Computes the negative covariance matrix of the formula counts `counts`
+    (with one row for every value of a variable) under the distribution
+    `probs` over the values, which is the Hessian of the log of the
+    conditional distribution of the variable.
+    '''
+    mean = probs.dot(counts)
+    return numpy.outer(mean, mean) - counts.T.dot(counts * probs[:, numpy.newaxis])
+
+
+class _GroundFormulaTruth(object):
+    '''
+    Evaluates instantiated ground formulas with the interface of a
+    :class:`logic.compiled.CompiledFormula`.
+    '''
+
+    @staticmethod
+    def truth(world, gf):
+        return gf(world)
+
+
+def compiled_groundings(mrf, formula):
+    '''
+    Yields tuples `(fidx, evaluator, gnd, atoms)` for all groundings of `formula`,
+    where `evaluator.truth(world, gnd)` computes the truth value of the grounding
+    `gnd` in `world` and `atoms` are the indices of its ground atoms.
+
+    If possible, the formula is compiled (see :class:`logic.compiled.CompiledFormula`),
+    otherwise the ground formulas are instantiated. `formula` may also be a
+    :class:`mln.grounding.variants.FormulaVariants` instance.
+    '''
+    variants = formula if isinstance(formula, FormulaVariants) else None
+    try:
+        compiled = CompiledFormula(formula if variants is None else variants.formula, mrf)
+    except FormulaCompilationError:
+        evaluator = _GroundFormulaTruth()
+        for gf in formula.itergroundings(mrf, simplify=False):
+            yield gf.idx, evaluator, gf, [a.idx for a in gf.gndatoms()]
+        return
+    for idx, partial in ([(formula.idx, None)] if variants is None else variants.iterassignments()):
+        for gnd in compiled.itergroundings(partial):
+            yield idx, compiled, gnd, compiled.gndatom_indices(gnd)
+
+
 class AbstractLearner(object):
     '''
     Abstract base class for every MLN learning algorithm.
@@ -70,6 +232,10 @@ class AbstractLearner(object):
     def usef(self):
         return True
 
+    @property
+    def usehessp(self):
+        return False
+
     @property
     def multicore(self):
         return self._params.get('multicore', False)
@@ -116,17 +282,30 @@ class AbstractLearner(object):
             else:
                 sys.stdout.write('  log P(D|w) = %f\r' % likelihood)
             sys.stdout.flush()
+        self._fvalue = likelihood + prior
         return likelihood + prior
 
     def grad(self, weights):
         w = self._add_fixweights(weights)
         grad = self._grad(w)
         self._grad_ = grad
+        self._checkpoint(w)
         # add gaussian prior
         if self.prior_stdev is not None:
             for i, weight in enumerate(w):
                 grad[i] -= 1./(self.prior_stdev ** 2) * weight
-        return self._filter_fixweights(grad)
+        grad = self._filter_fixweights(grad)
+        if tracer.enabled:
+            self._trace_iteration(grad)
+        return grad
+
+    def _trace_iteration(self, grad):
+        now = time.time()
+        self._iteration += 1
+        event('learn.iteration', learner=type(self).__name__, iteration=self._iteration, f=self._fvalue,
+              gradnorm=float(numpy.linalg.norm(grad)),
+              duration=None if self._lastiteration is None else now - self._lastiteration)
+        self._lastiteration = now
 
     def __call__(self, weights):
         return self.likelihood(weights)
@@ -174,19 +353,158 @@ class AbstractLearner(object):
         if not 'scipy' in sys.modules:
             raise Exception("Scipy was not imported! Install numpy and scipy if you want to use weight learning.")
         # initial parameter vector: all zeros or weights from formulas
-        self._w = [0] * len(self.mrf.formulas)
-        for f in self.mrf.formulas:
-            if self.mrf.mln.fixweights[f.idx] or self.use_init_weights or f.weight == HARD:
-                self._w[f.idx] = f.weight
-        runs = 0
+        self._w = self._initial_weights(self.mrf.mln)
+        runs, checkpoint = self._resume()
         while runs < self.maxrepeat:
-            self._prepare()
-            self._optimize(**self._params)
+            if checkpoint is None or not self._restore_statistics():
+                with span('learn.prepare', learner=type(self).__name__, run=runs):
+                    self._prepare()
+                self._save_statistics()
+            self._run = runs
+            with span('learn.optimize', learner=type(self).__name__, run=runs) as s:
+                self._optimize(**self._params)
+                s.attrs['optimizer'] = getattr(self._optimizer, 'optimizer', type(self._optimizer).__name__)
             self._cleanup()
+            checkpoint = None
             runs += 1
+            self._save_checkpoint(runs)
             if not self.repeat(): break
         return self.weights
 
+    @property
+    def warmstart(self):
+        return self._params.get('warmstart')
+
+    @property
+    def checkpoint(self):
+        return self._params.get('checkpoint')
+
+    @property
+    def checkpoint_interval(self):
+        return self._params.get('checkpoint_interval', 60)
+
+    @property
+    def resume(self):
+        return self._params.get('resume', False)
+
+    def _initial_weights(self, mln):
+        '''
+        Returns the weight vector the optimization starts with. The weights
+        of fixed-weight and hard formulas are taken from `mln`, the others are
+        zero or, for warm starts, the weights of the formulas with the same
+        string representation in the MLN given by the `warmstart` parameter.
+        '''
+        warmstart = {}
+        if self.warmstart is not None:
+            for f in self.warmstart.formulas:
+                # the weights of MLNs loaded from files may be given as strings
+                try: warmstart[str(f)] = float(f.weight)
+                except (TypeError, ValueError): pass
+        w = [0] * len(mln.formulas)
+        for f in mln.formulas:
+            if mln.fixweights[f.idx] or self.use_init_weights or f.weight == HARD:
+                w[f.idx] = f.weight
+            elif str(f) in warmstart and warmstart[str(f)] != HARD:
+                w[f.idx] = warmstart[str(f)]
+        return w
+
+    def _statistics(self):
+        '''
+        Returns a dict of the precomputed statistics that are saved in
+        checkpoints, mapping attribute names to their values.
+        '''
+        return dict([(attr, getattr(self, attr)) for attr in self._checkpoint_attrs])
+
+    def _set_statistics(self, stats):
+        for attr, value in stats.items():
+            setattr(self, attr, value)
+
+    # the attributes holding the statistics computed by _prepare()
+    _checkpoint_attrs = ()
+    # the state of the optimization for checkpointing
+    _run = 0
+    _optimizer = None
+    _optstate = None
+    _lastcheckpoint = 0
+    # the state of the tracing of the optimization iterations
+    _fvalue = None
+    _iteration = 0
+    _lastiteration = None
+
+    def _fingerprint(self):
+        '''
+        Computes a hash of the learning problem, i.e. the learner, the formulas
+        and the training data, which the saved statistics depend on.
+        '''
+        h = hashlib.md5(type(self).__name__.encode())
+        for f in self.mrf.formulas:
+            h.update(str(f).encode())
+        for atom in self.mrf.gndatoms:
+            h.update(str(atom).encode())
+        h.update(repr(self.mrf.evidence).encode())
+        return h.hexdigest()
+
+    def _resume(self):
+        '''
+        Restores the weights of the checkpoint file if `resume` is set.
+
+        :returns:    the number of finished runs and the checkpoint, or `(0, None)`
+                     if there is no checkpoint to resume from.
+        '''
+        if not self.resume or self.checkpoint is None or not os.path.exists(self.checkpoint):
+            return 0, None
+        with open(self.checkpoint, 'rb') as f:
+            checkpoint = pickle.load(f)
+        if len(checkpoint['w']) != len(self._w):
+            raise Exception('Checkpoint %s does not match the formulas of the MLN.' % self.checkpoint)
+        logger.info('resuming from checkpoint %s (run %d)' % (self.checkpoint, checkpoint['run']))
+        self._w = checkpoint['w']
+        self._optstate = checkpoint['optimizer']
+        return checkpoint['run'], checkpoint
+
+    def _restore_statistics(self):
+        '''
+        Loads the statistics saved along with the checkpoint, if they have been
+        computed for the same learning problem.
+
+        :returns:    `True` if the statistics have been restored.
+        '''
+        path = self.checkpoint + '.stat'
+        if not self._checkpoint_attrs or not os.path.exists(path):
+            return False
+        with open(path, 'rb') as f:
+            fingerprint, stats = pickle.load(f)
+        if fingerprint != self._fingerprint():
+            logger.info('training data has changed. Recomputing the statistics...')
+            return False
+        self._set_statistics(stats)
+        return True
+
+    def _save_statistics(self):
+        if self.checkpoint is None or not self._checkpoint_attrs: return
+        _dump((self._fingerprint(), self._statistics()), self.checkpoint + '.stat')
+
+    def _save_checkpoint(self, run, w=None):
+        '''
+        Writes the current weights and the state of the optimizer to the
+        checkpoint file.
+
+        :param run:    the number of finished runs.
+        :param w:      the full weight vector. Defaults to the learnt weights.
+        '''
+        if self.checkpoint is None: return
+        _dump({'run': run,
+               'w': list(self._w if w is None else w),
+               'optimizer': self._optimizer.state if w is not None and hasattr(self._optimizer, 'state') else None},
+              self.checkpoint)
+        self._lastcheckpoint = time.time()
+
+    def _checkpoint(self, w):
+        # called after every gradient evaluation
+        if self.checkpoint is None: return
+        if time.time() - self._lastcheckpoint >= self.checkpoint_interval:
+            self._save_checkpoint(self._run, w)
+
     def _prepare(self):
         pass
 
@@ -199,34 +517,42 @@ class AbstractLearner(object):
             opt = optimize.DirectDescent(w, self, **params)        
         elif optimizer == "diagonalNewton":
             opt = optimize.DiagonalNewton(w, self, **params)  
+        elif optimizer == "sgd":
+            opt = optimize.StochasticGradient(w, self, state=self._optstate, **params)
         else:
             opt = optimize.SciPyOpt(optimizer, w, self, **params)        
+        self._optimizer = opt
+        self._optstate = None
         w = opt.run()
         self._w = self._add_fixweights(w)
 
-    def hessian(self, wt):
-        wt = self._reconstructFullWeightVectorWithFixedWeights(wt)
-        wt = list(map(float, wt))
-        fullHessian = self._hessian(wt)
-        return self._projectMatrixToNonFixedWeightIndices(fullHessian)
-
-    def _projectMatrixToNonFixedWeightIndices(self, matrix):
-        if len(self._fixedWeightFormulas) == 0:
-            return matrix
-        dim = len(self.mln.formulas) - len(self._fixedWeightFormulas)
-        proj = numpy.zeros((dim, dim), numpy.float64)
-        i2 = 0
-        for i in range(len(self.mln.formulas)):
-            if (i in self._fixedWeightFormulas):
-                continue
-            j2 = 0
-            for j in range(len(self.mln.formulas)):
-                if (j in self._fixedWeightFormulas):
-                    continue
-                proj[i2][j2] = matrix[i][j]
-                j2 += 1
-            i2 += 1            
-        return proj
+    def hessian(self, weights):
+        w = self._add_fixweights(weights)
+        idx = self._filter_fixweights(list(range(len(w))))
+        hessian = numpy.asarray(self._hessian(w))[numpy.ix_(idx, idx)]
+        # add gaussian prior
+        if self.prior_stdev is not None:
+            hessian = hessian - numpy.eye(len(idx)) / (self.prior_stdev ** 2)
+        return hessian
+
+    def hessp(self, weights, v):
+        '''
+        Computes the product of the Hessian of the objective function at
+        `weights` with the vector `v`. As for the gradient, the entries of
+        fixed weights and hard formulas are left out of both vectors.
+        '''
+        w = self._add_fixweights(weights)
+        idx = self._filter_fixweights(list(range(len(w))))
+        v_ = numpy.zeros(len(w), numpy.float64)
+        v_[idx] = v
+        hv = numpy.asarray(self._hessp(w, v_))[idx]
+        # add gaussian prior
+        if self.prior_stdev is not None:
+            hv = hv - numpy.asarray(v, numpy.float64) / (self.prior_stdev ** 2)
+        return hv
+
+    def _hessp(self, w, v):
+        raise Exception("The learner '%s' does not provide Hessian-vector products; use another optimizer!" % str(type(self)))
 
     def _hessian(self, wt):
         raise Exception("The learner '%s' does not provide a Hessian computation; use another optimizer!" % str(type(self)))
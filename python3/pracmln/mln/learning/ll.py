@@ -23,10 +23,14 @@
 # CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
 # TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import random
+from collections import defaultdict
+
 from dnutils import ProgressBar
 
 from .common import *
 from ..grounding.default import DefaultGroundingFactory
+from ..grounding.variants import group_variants
 from ..constants import HARD
 from ..errors import SatisfiabilityException
 
@@ -35,6 +39,8 @@ class LL(AbstractLearner):
     """
     Exact Log-Likelihood learner.
     """
+
+    _checkpoint_attrs = ('_stat', '_eworld_idx')
     
     def __init__(self, mrf, **params):
         AbstractLearner.__init__(self, mrf, **params)
@@ -108,3 +114,182 @@ class LL(AbstractLearner):
             for gf in grounder.itergroundings():
                 truth = gf(world)
                 if truth != 0: values[gf.idx] = values.get(gf.idx, 0) + truth
+
+
+class SLL(LL):
+    """
+    Sampling-based Log-Likelihood learner.
+
+    The expected formula counts in the gradient of the log-likelihood are
+    estimated from Gibbs samples instead of enumerating all possible worlds.
+    By default, the Markov chains are persistent, i.e. they are continued
+    across the iterations of the optimizer. If `cd` is given, contrastive
+    divergence is used instead: the chains are restarted from the training
+    database for every gradient and run for `cd` steps.
+
+    As the objective function cannot be computed from samples, the weights
+    are optimized by stochastic gradient ascent (`optimizer='sgd'`). For MRFs
+    with at most `maxworlds` possible worlds, the learner falls back to the
+    exact computation of :class:`LL`.
+    """
+
+    def __init__(self, mrf, **params):
+        LL.__init__(self, mrf, **params)
+        self._groundings = None
+        self._chains = None
+        self._exact = self.mrf.countworlds() <= self.maxworlds
+
+
+    @property
+    def maxworlds(self):
+        return self._params.get('maxworlds', 1024)
+
+
+    @property
+    def chains(self):
+        return self._params.get('chains', 1)
+
+
+    @property
+    def samples(self):
+        return self._params.get('samples', 50)
+
+
+    @property
+    def burnin(self):
+        return self._params.get('burnin', 20)
+
+
+    @property
+    def cd(self):
+        return self._params.get('cd')
+
+
+    @property
+    def exact(self):
+        return self._exact
+
+
+    @property
+    def _checkpoint_attrs(self):
+        # the samplers' grounding is not saved in checkpoints
+        return LL._checkpoint_attrs if self.exact else ()
+
+
+    def _prepare(self):
+        if self.exact:
+            LL._prepare(self)
+        elif self._groundings is None:
+            self._ground()
+
+
+    def _optimize(self, optimizer=None, **params):
+        if optimizer is None:
+            optimizer = 'bfgs' if self.exact else 'sgd'
+        LL._optimize(self, optimizer, **params)
+
+
+    def _ground(self):
+        # the grounding is computed once and reused by all chains
+        self._groundings = []
+        self._evaluators = []
+        self._varidx2gidx = defaultdict(list)
+        for formula in group_variants(self.mrf.formulas):
+            evalidx = None
+            for fidx, evaluator, gnd, atoms in compiled_groundings(self.mrf, formula):
+                if evalidx is None:
+                    evalidx = len(self._evaluators)
+                    self._evaluators.append(evaluator)
+                gidx = len(self._groundings)
+                self._groundings.append((fidx, evalidx, gnd))
+                for varidx in set([self.mrf.variable(self.mrf.gndatom(a)).idx for a in atoms]):
+                    self._varidx2gidx[varidx].append(gidx)
+        self._dataworld = list(self.mrf.evidence)
+        self._datacounts = self._counts(self._dataworld)
+
+
+    def _counts(self, world):
+        """
+        Computes the numbers of true groundings of all formulas in `world`.
+        """
+        truths = [e.truth for e in self._evaluators]
+        counts = numpy.zeros(len(self.mrf.formulas), numpy.float64)
+        for fidx, evalidx, gnd in self._groundings:
+            counts[fidx] += truths[evalidx](world, gnd)
+        return counts
+
+
+    def _step(self, world, w):
+        """
+        Performs one sweep of Gibbs sampling over all variables in `world`
+        under the weights `w`.
+        """
+        truths = [e.truth for e in self._evaluators]
+        for var in self.mrf.variables:
+            values = [value for _, value in var.itervalues()]
+            groundings = [self._groundings[i] for i in self._varidx2gidx.get(var.idx, ())]
+            sums = []
+            for value in values:
+                var.setval(value, world)
+                s = 0
+                for fidx, evalidx, gnd in groundings:
+                    truth = truths[evalidx](world, gnd)
+                    if w[fidx] == HARD:
+                        if truth < 1:
+                            s = None
+                            break
+                    else:
+                        s += w[fidx] * truth
+                sums.append(s)
+            admissible = [s for s in sums if s is not None]
+            if not admissible:
+                raise SatisfiabilityException('MLN is unsatisfiable: all values of variable %s violate hard constraints.' % str(var))
+            smax = max(admissible)
+            expsums = [numpy.exp(s - smax) if s is not None else 0 for s in sums]
+            r = random.uniform(0, sum(expsums))
+            idx = 0
+            acc = expsums[0]
+            while r > acc and idx < len(values) - 1:
+                idx += 1
+                acc += expsums[idx]
+            var.setval(values[idx], world)
+
+
+    def _expected_counts(self, w):
+        """
+        Estimates the expected numbers of true groundings of all formulas under
+        the weights `w` from the samples of the Markov chains.
+        """
+        if self.cd is not None:
+            chains = [list(self._dataworld) for _ in range(self.chains)]
+            for chain in chains:
+                for _ in range(self.cd):
+                    self._step(chain, w)
+            return sum([self._counts(chain) for chain in chains]) / len(chains)
+        if self._chains is None:
+            # the chains start in the training database, which satisfies all hard constraints
+            self._chains = [list(self._dataworld) for _ in range(self.chains)]
+            for chain in self._chains:
+                for _ in range(self.burnin):
+                    self._step(chain, w)
+        counts = numpy.zeros(len(self.mrf.formulas), numpy.float64)
+        for chain in self._chains:
+            for _ in range(self.samples):
+                self._step(chain, w)
+                counts += self._counts(chain)
+        return counts / (len(self._chains) * self.samples)
+
+
+    def _f(self, w):
+        if self.exact:
+            return LL._f(self, w)
+        raise Exception("The learner '%s' cannot compute the log-likelihood of an MRF with more than %d possible worlds; use the optimizer 'sgd'!" % (self.__class__.__name__, self.maxworlds))
+
+
+    def _grad(self, w):
+        if self.exact:
+            return LL._grad(self, w)
+        grad = self._datacounts - self._expected_counts(w)
+        for f in self.mrf.formulas:
+            if w[f.idx] == HARD: grad[f.idx] = 0
+        return grad
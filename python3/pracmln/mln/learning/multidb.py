@@ -26,9 +26,11 @@ from .common import AbstractLearner
 import sys
 from ..util import StopWatch, edict
 from multiprocessing import Pool
-from ...utils.multicore import with_tracing, _methodcaller, checkmem
+from ...utils.multicore import with_tracing, poolsize, _methodcaller, checkmem
 import numpy
+import hashlib
 from ..constants import HARD
+from ...utils.tracing import span
 
 
 logger = logs.getlogger(__name__)
@@ -73,7 +75,7 @@ class MultipleDatabaseLearner(AbstractLearner):
         if self.verbose:
             bar = ProgressBar(steps=len(dbs), color='green')
         if self.multicore:
-            pool = Pool(maxtasksperchild=1)
+            pool = Pool(poolsize(), maxtasksperchild=1)
             logger.debug('Setting up multi-core processing for {} cores'.format(pool._processes))
             try:
                 for i, learner in pool.imap(with_tracing(_setup_learner), self._iterdbs(method)):
@@ -117,7 +119,7 @@ class MultipleDatabaseLearner(AbstractLearner):
         # in separate processes, so we turn it off 
         if False:  # self.multicore:
             likelihood = 0
-            pool = Pool()
+            pool = Pool(poolsize())
             try:
                 for i, (f_, d_) in enumerate(pool.imap(with_tracing(_methodcaller('_f', sideeffects=True)), [(l, w) for l in self.learners])):
                     self.learners[i].__dict__ = d_
@@ -138,7 +140,7 @@ class MultipleDatabaseLearner(AbstractLearner):
         if False:  # self.multicore:
             # it turned out that it doesn't pay off to evaluate the gradient  
             # in separate processes, so we turn it off 
-            pool = Pool()
+            pool = Pool(poolsize())
             try:
                 for i, (grad_, d_) in enumerate(pool.imap(with_tracing(_methodcaller('_grad', sideeffects=True)), [(l, w) for l in self.learners])):
                     self.learners[i].__dict__ = d_
@@ -154,11 +156,22 @@ class MultipleDatabaseLearner(AbstractLearner):
             for learner in self.learners: grad += learner._grad(w)
         return grad
 
+    @property
+    def usehessp(self):
+        return all([l.usehessp for l in self.learners])
+
+    def _hessp(self, w, v):
+        # like the function value, the products are cheap compared to the
+        # overhead of distributing them over a process pool
+        hv = numpy.zeros(len(self.mln.formulas), numpy.float64)
+        for learner in self.learners: hv += learner._hessp(w, v)
+        return hv
+
     def _hessian(self, w):
         N = len(self.mln.formulas)
         hessian = numpy.matrix(numpy.zeros((N, N)))
         if self.multicore:
-            pool = Pool()
+            pool = Pool(poolsize())
             try:
                 for h in pool.imap(with_tracing(_methodcaller('_hessian')), [(l, w) for l in self.learners]):
                     hessian += h
@@ -178,7 +191,7 @@ class MultipleDatabaseLearner(AbstractLearner):
         if self.verbose:
             bar = ProgressBar(steps=len(self.dbs), color='green')
         if self.multicore:
-            pool = Pool(maxtasksperchild=1)
+            pool = Pool(poolsize(), maxtasksperchild=1)
             try:
                 for i, (_, d_) in enumerate(pool.imap(with_tracing(_methodcaller('_prepare', sideeffects=True)), self.learners)):
                     checkmem()
@@ -221,16 +234,35 @@ class MultipleDatabaseLearner(AbstractLearner):
         if 'scipy' not in sys.modules:
             raise Exception("Scipy was not imported! Install numpy and scipy "
                             "if you want to use weight learning.")
-        runs = 0
-        self._w = [0] * len(self.mln.formulas)
+        # initial parameter vector: all zeros or weights from formulas
+        self._w = self._initial_weights(self.mln)
+        runs, checkpoint = self._resume()
         while runs < self.maxrepeat:
-            self._prepare()
-            # initial parameter vector: all zeros or weights from formulas
-            for f in self.mln.formulas:
-                if self.mln.fixweights[f.idx] or self.use_init_weights or f.ishard:
-                    self._w[f.idx] = f.weight
-            self._optimize(**self._params)
+            if checkpoint is None or not self._restore_statistics():
+                with span('learn.prepare', learner=type(self).__name__, run=runs):
+                    self._prepare()
+                self._save_statistics()
+            self._run = runs
+            with span('learn.optimize', learner=type(self).__name__, run=runs) as s:
+                self._optimize(**self._params)
+                s.attrs['optimizer'] = getattr(self._optimizer, 'optimizer', type(self._optimizer).__name__)
             self._cleanup()
+            checkpoint = None
             runs += 1
+            self._save_checkpoint(runs)
             if not any([l.repeat() for l in self.learners]): break
         return self.weights
+
+    @property
+    def _checkpoint_attrs(self):
+        return self.learners[0]._checkpoint_attrs
+
+    def _statistics(self):
+        return [l._statistics() for l in self.learners]
+
+    def _set_statistics(self, stats):
+        for learner, stats_ in zip(self.learners, stats):
+            learner._set_statistics(stats_)
+
+    def _fingerprint(self):
+        return hashlib.md5(''.join([l._fingerprint() for l in self.learners]).encode()).hexdigest()
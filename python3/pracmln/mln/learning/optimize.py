@@ -8,7 +8,7 @@ from dnutils import logs
 
 try:
     import numpy
-    from scipy.optimize import fmin_bfgs, fmin_cg, fmin_ncg, fmin_tnc, fmin_l_bfgs_b, fsolve, fmin_slsqp, fmin, fmin_powell
+    from scipy.optimize import fmin_bfgs, fmin_cg, fmin_ncg, fmin_tnc, fmin_l_bfgs_b, fsolve, fmin_slsqp, fmin, fmin_powell, minimize
 except:
     sys.stderr.write("Warning: Failed to import SciPy/NumPy (http://www.scipy.org)! Parameter learning with PyMLNs is disabled.\n")
 
@@ -77,6 +77,55 @@ class DirectDescent(object):
         return self.wt
 
 
+class StochasticGradient(object):
+    """
+    Stochastic gradient ascent with per-weight adaptive step sizes (AdaGrad)
+    for learners that can only estimate the gradient, e.g. from samples.
+    The weights returned are the average over the second half of the
+    iterations, which smoothes out the noise of the gradient estimates.
+
+    The optimizer can be resumed from a previous :attr:`state`.
+    """
+
+    def __init__(self, wt, learner, gtol=1e-3, maxiter=None, learningrate=.5, state=None, **params):
+        self.learner = learner
+        self.gtol = gtol
+        self.maxiter = 100 if maxiter is None else maxiter
+        self.learningrate = learningrate
+        self.wt = numpy.array(wt, dtype=numpy.float64)
+        if state is None:
+            self.step = 0
+            self.sqsum = numpy.zeros(len(self.wt))
+            self.avg = numpy.zeros(len(self.wt))
+            self.n = 0
+        else:
+            self.step = state['step']
+            self.sqsum = numpy.array(state['sqsum'])
+            self.avg = numpy.array(state['avg'])
+            self.n = state['n']
+
+    @property
+    def state(self):
+        return {'step': self.step, 'sqsum': list(self.sqsum), 'avg': list(self.avg), 'n': self.n}
+
+    def run(self):
+        log = logs.getlogger(self.__class__.__name__)
+        log.info('starting optimization with %s... (learning rate=%f)' % (self.__class__.__name__, self.learningrate))
+        while self.step < self.maxiter:
+            grad = numpy.array(self.learner.grad(self.wt), dtype=numpy.float64)
+            norm = numpy.linalg.norm(grad)
+            log.debug('step %d: |grad| = %f' % (self.step, norm))
+            if norm < self.gtol:
+                break
+            self.sqsum += grad ** 2
+            self.wt = self.wt + self.learningrate * grad / (numpy.sqrt(self.sqsum) + 1e-8)
+            if self.step >= self.maxiter // 2:
+                self.avg += self.wt
+                self.n += 1
+            self.step += 1
+        return self.avg / self.n if self.n else self.wt
+
+
 class DiagonalNewton(object):
     
     def __init__(self, wt, problem, gtol=0.01, maxSteps=None):
@@ -188,6 +237,8 @@ class SciPyOpt(object):
 
         optimizer = self.optimizer
         p = self.problem
+        # initial weights may be integers, which some optimizers update in place
+        self.wt = numpy.array(self.wt, numpy.float64)
         f = p.f
         grad = p.grad
         
@@ -217,10 +268,22 @@ class SciPyOpt(object):
             log.info("f-opt: %.16f\nfunction evaluations: %d\nwarning flags: %d\n" % (-f_opt, func_calls, warn_flags))
         elif optimizer == "ncg":            
             params = dict([k_v2 for k_v2 in iter(self.optParams.items()) if k_v2[0] in ["avextol", "epsilon", "maxiter"]])
+            # use the analytic Hessian-vector products if the learner provides them
+            if getattr(p, 'usehessp', False):
+                params['fhess_p'] = lambda wt, v: -p.hessp(wt, v)
             log.info("starting optimization with %s... %s" % (optimizer, params))
-            wt, f_opt, func_calls, grad_calls, warn_flags = fmin_ncg(neg_f, self.wt, fprime=neg_grad, args=(), full_output=True, **params)
+            wt, f_opt, func_calls, grad_calls, hess_calls, warn_flags = fmin_ncg(neg_f, self.wt, fprime=neg_grad, args=(), full_output=True, **params)
             log.info("optimization done with %s..." % optimizer)
             log.info("f-opt: %.16f\nfunction evaluations: %d\nwarning flags: %d\n" % (-f_opt, func_calls, warn_flags))
+        elif optimizer in ("trust-ncg", "trust-krylov", "newton-cg"):
+            if not getattr(p, 'usehessp', False):
+                raise Exception("The optimizer '%s' requires a learner providing Hessian-vector products." % optimizer)
+            options = dict([k_v for k_v in iter(self.optParams.items()) if k_v[0] in ["gtol", "xtol", "maxiter", "initial_trust_radius", "max_trust_radius"]])
+            log.info("starting optimization with %s... %s" % (optimizer, options))
+            result = minimize(neg_f, self.wt, method=optimizer, jac=neg_grad, hessp=lambda wt, v: -p.hessp(wt, v), options=options)
+            wt, f_opt = result.x, result.fun
+            log.info("optimization done with %s..." % optimizer)
+            log.info("f-opt: %.16f\nfunction evaluations: %d\nmessage: %s\n" % (-f_opt, result.nfev, result.message))
         elif optimizer == "fmin":
             params = dict([k_v3 for k_v3 in iter(self.optParams.items()) if k_v3[0] in ["xtol", "ftol", "maxiter"]])
             log.info("starting optimization with %s... %s" % (optimizer, params))
@@ -232,10 +295,12 @@ class SciPyOpt(object):
             wt = fmin_powell(neg_f, self.wt, args=(), full_output=True, **params)
             log.info("optimization done with %s..." % optimizer)
         elif optimizer == 'l-bfgs-b':
-            params = dict([k_v5 for k_v5 in iter(self.optParams.items()) if k_v5[0] in ["gtol", "epsilon", "maxiter", 'bounds']])
-            log.info("starting optimization with %s... %s" % (optimizer, params))
+            params = dict([k_v5 for k_v5 in iter(self.optParams.items()) if k_v5[0] in ["pgtol", "factr", "m", "epsilon", "maxiter", 'bounds']])
+            if 'gtol' in self.optParams and 'pgtol' not in params:
+                params['pgtol'] = self.optParams['gtol']
             if 'bounds' in params:
-                params['bounds'] = (params['bounds'],) * len(self.wt)
+                params['bounds'] = self._bounds(params['bounds'])
+            log.info("starting optimization with %s... %s" % (optimizer, params))
             wt, f_opt, d = fmin_l_bfgs_b(neg_f, self.wt, fprime=neg_grad, **params)
             log.info("optimization done with %s..." % optimizer)
             log.info("f-opt: %.16f\n" % (-f_opt))
@@ -244,6 +309,23 @@ class SciPyOpt(object):
         
         return wt
 
+    def _bounds(self, bounds):
+        """
+        Returns the box constraints for the weights that are optimized.
+        `bounds` is either a single `(min, max)` pair applying to all
+        weights or a list of such pairs for all formulas of the MLN, of
+        which the ones of fixed weights and hard formulas are left out.
+        Bounds can be `None` to leave a weight unbounded in one direction.
+        """
+        bounds = list(bounds)
+        if len(bounds) == 2 and all([b is None or isinstance(b, (int, float)) for b in bounds]):
+            return [tuple(bounds)] * len(self.wt)
+        if len(bounds) != len(self.wt):
+            bounds = self.problem._filter_fixweights(bounds)
+        if len(bounds) != len(self.wt):
+            raise Exception('Expected %d bounds, got %d.' % (len(self.wt), len(bounds)))
+        return [tuple(b) for b in bounds]
+
 # try:
 #     from playdoh import Fitness, maximize, MAXCPU, GA, PSO, print_table
 #     from numpy import exp, tile, array
@@ -20,36 +20,47 @@
 # TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-from .inference.gibbs import GibbsSampler
-from .inference.mcsat import MCSAT
-from .inference.exact import EnumerationAsk
-from .inference.wcspinfer import WCSPInference
-from .inference.maxwalk import SAMaxWalkSAT
-from .learning.cll import CLL, DCLL
-from .learning.ll import LL
-from .learning.bpll import BPLL, DPLL , BPLL_CG, DBPLL_CG
+from importlib import import_module
+
 
 class Enum(object):
+    """
+    Maps the ids of classes, i.e. their names, to their descriptions.
+    
+    The classes are given by the modules (relative to this package) they
+    are defined in, which are not imported before a class is requested.
+    """
     
     def __init__(self, items):
-        self.id2name = dict([(clazz.__name__, name) for (clazz, name) in items])
-        self.name2id = dict([(name, clazz.__name__) for (clazz, name) in items])
-        self.id2clazz = dict([(clazz.__name__, clazz) for (clazz, _) in items])
+        self.id2name = dict([(clazz, name) for (_, clazz, name) in items])
+        self.name2id = dict([(name, clazz) for (_, clazz, name) in items])
+        self._id2module = dict([(clazz, module) for (module, clazz, _) in items])
+    
+    
+    @property
+    def id2clazz(self):
+        return dict([(id_, self._clazz(id_)) for id_ in self._id2module])
+    
+    
+    def _clazz(self, id_):
+        return getattr(import_module(self._id2module[id_], __package__), id_)
     
     
     def __getattr__(self, id_):
-        if id_ in self.id2clazz:
-            return self.id2clazz[id_]
-        raise KeyError('Enum does not define %s, only %s' % (id_, list(self.id2clazz.keys())))
+        if id_.startswith('_'):
+            raise AttributeError(id_)
+        if id_ in self._id2module:
+            return self._clazz(id_)
+        raise KeyError('Enum does not define %s, only %s' % (id_, list(self._id2module.keys())))
     
     
     def clazz(self, key):
         if type(key).__name__ == 'type':
             key = key.__name__ 
-        if key in self.id2clazz:
-            return self.id2clazz[str(key)]
+        if key in self._id2module:
+            return self._clazz(str(key))
         else:
-            return self.id2clazz[self.name2id[key]]
+            return self._clazz(self.name2id[key])
         raise KeyError('No such element "%s"' % key)
     
     def id(self, key):
@@ -72,28 +83,29 @@ class Enum(object):
     
 InferenceMethods = Enum(
     (
-     (GibbsSampler, 'Gibbs sampling'), 
-     (MCSAT, 'MC-SAT'), 
+     ('.inference.gibbs', 'GibbsSampler', 'Gibbs sampling'), 
+     ('.inference.mcsat', 'MCSAT', 'MC-SAT'), 
 #      (FuzzyMCSAT,  'Fuzzy MC-SAT'),
 #      (IPFPM, 'IPFP-M'), 
-     (EnumerationAsk, 'Enumeration-Ask (exact)'),
-     (WCSPInference, 'WCSP (exact MPE with toulbar2)'),
-     (SAMaxWalkSAT, 'Max-Walk-SAT with simulated annealing (approx. MPE)')
+     ('.inference.exact', 'EnumerationAsk', 'Enumeration-Ask (exact)'),
+     ('.inference.wcspinfer', 'WCSPInference', 'WCSP (exact MPE with toulbar2)'),
+     ('.inference.maxwalk', 'SAMaxWalkSAT', 'Max-Walk-SAT with simulated annealing (approx. MPE)'),
+     ('.inference.maxwalk', 'MaxWalkSAT', 'Max-Walk-SAT (approx. MPE)')
     ))
 
 
 LearningMethods = Enum(
      (
-      (CLL, 'composite-log-likelihood'),
-      (DCLL, '[discriminative] composite-log-likelihood'),
-      (LL, "log-likelihood"),
-      (DPLL, '[discriminative] pseudo-log-likelihood'),
-      (BPLL, 'pseudo-log-likelihood'),
-      (BPLL_CG, 'pseudo-log-likelihood (fast conjunction grounding)'),
-      (DBPLL_CG, '[discriminative] pseudo-log-likelihood (fast conjunction grounding)')
+      ('.learning.cll', 'CLL', 'composite-log-likelihood'),
+      ('.learning.cll', 'DCLL', '[discriminative] composite-log-likelihood'),
+      ('.learning.ll', 'LL', "log-likelihood"),
+      ('.learning.ll', 'SLL', "sampling-based log-likelihood"),
+      ('.learning.bpll', 'DPLL', '[discriminative] pseudo-log-likelihood'),
+      ('.learning.bpll', 'BPLL', 'pseudo-log-likelihood'),
+      ('.learning.bpll', 'BPLL_CG', 'pseudo-log-likelihood (fast conjunction grounding)'),
+      ('.learning.bpll', 'DBPLL_CG', '[discriminative] pseudo-log-likelihood (fast conjunction grounding)')
 #     'MLNBoost': 'MLN-BOOST',
 #     'WPLL': 'Weighted Pseudo-likelihood',
-      #"SLL": "sampling-based log-likelihood via direct descent",
 #      "PLL": "pseudo-log-likelihood (deprecated)",
 #      "VP": "[discriminative] Voted Perceptron",
 #      "CD": "[discriminative] Contrastive Divergence",
@@ -121,6 +133,6 @@ if __name__ =='__main__':
     print(InferenceMethods.id2name)
     print(InferenceMethods.name2id)
     print(LearningMethods.names())
-    print(InferenceMethods.clazz(MCSAT))
+    print(InferenceMethods.clazz('MCSAT'))
     print(InferenceMethods.name('WCSPInference'))
     
@@ -54,6 +54,8 @@ class MRF(object):
     :member _gndatoms_indices:     dict mapping ground atom index to Logic.GroundAtom object
     :member _evidence:             vector of evidence truth values of all ground atoms
     :member _variables:            dict mapping variable names to their :class:`mln.mrfvars.MRFVariable` instance.
+    :member groundingprofile:      a :class:`mln.grounding.profile.GroundingProfile` all grounding
+                                   factories working on this MRF record their statistics in, or `None`.
     
     :param mln:    the MLN tied to this MRF.
     :param db:     the database that the MRF shall be grounded with.
@@ -71,6 +73,8 @@ class MRF(object):
         self._variables_by_gndatomidx = {} # gnd atom idx
         self._gndatoms = {}
         self._gndatoms_by_idx = {} 
+        self._gndatomidx_by_predname = {} # pred name -> list of gnd atom indices
+        self.groundingprofile = None
         # get combined domain
         self.domains = mergedom(self.mln.domains, db.domains)
 #         self.softEvidence = list(mln.posteriorProbReqs) # constraints on posterior 
@@ -294,8 +298,9 @@ class MRF(object):
         
         Raises an MRFValueException if the MRF is inconsistent.
         '''
+        evidence = self.evidence_dicti()
         for variable in self.variables:
-            variable.consistent(self.evidence_dicti(), strict=strict)
+            variable.consistent(evidence, strict=strict)
 
     def gndatom(self, identifier, *args):
         '''
@@ -335,6 +340,13 @@ class MRF(object):
         else:
             return self.new_gndatom(identifier, *args)
 
+    def gndatom_indices(self, predname):
+        '''
+        Returns the list of indices of all ground atoms of the predicate with the given name,
+        in ascending order.
+        '''
+        return self._gndatomidx_by_predname.get(predname, [])
+
     def variable(self, identifier):
         '''
         Returns the :class:`mln.mrfvars.MRFVariable` instance of the variable with the name or index `var`,
@@ -368,6 +380,7 @@ class MRF(object):
         gndatom.idx = len(self._gndatoms)
         self._gndatoms[str(gndatom)] = gndatom
         self._gndatoms_by_idx[gndatom.idx] = gndatom
+        self._gndatomidx_by_predname.setdefault(gndatom.predname, []).append(gndatom.idx)
         # add the ground atom to the variable it belongs
         # to or create a new one if it doesn't exists.
         predicate = self.mln.predicate(gndatom.predname)
@@ -541,7 +554,7 @@ class MRF(object):
         for ga in sorted(l):
             stream.write(str(ga) + '\n')
 
-    def apply_prob_constraints(self, constraints, method=InferenceMethods.EnumerationAsk, 
+    def apply_prob_constraints(self, constraints, method=None, 
                                    thr=1.0e-3, steps=20, fittingMCSATSteps=5000, 
                                    fittingParams=None, given=None, queries=None, 
                                    maxThreshold=None, greedy=False, probabilityFittingResultFileName=None, **args):
@@ -599,6 +612,8 @@ class MRF(object):
                 req["gndExpr"] = str(gndFormula)
                 req["gndFormula"] = gndFormula
 
+        if method is None:
+            method = InferenceMethods.EnumerationAsk
         # iterative fitting algorithm
         step = 1 # fitting round
         fittingStep = 1 # actual IPFP iteration
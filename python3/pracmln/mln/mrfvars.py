@@ -39,6 +39,8 @@ class MRFVariable(object):
     must have a fixed index.
     """
     
+    __slots__ = ('mrf', 'gndatoms', 'idx', 'name', 'predicate')
+    
     def __init__(self, mrf, name, predicate, *gndatoms):
         """
         :param mrf:         the instance of the MRF that this variable is added to
@@ -259,6 +261,8 @@ class FuzzyVariable(MRFVariable):
     It does not support iteration over values or value indexing.
     """
     
+    __slots__ = ()
+    
     def consistent(self, world, strict=False):
         value = self.evidence_value(world)[0]
         if value is not None:
@@ -290,6 +294,8 @@ class BinaryVariable(MRFVariable):
     The first value is always the false one.
     """
     
+    __slots__ = ()
+    
 
     def valuecount(self, evidence=None):
         if evidence is None:
@@ -329,6 +335,8 @@ class MutexVariable(MRFVariable):
     in which exactly one ground atom must be true.
     """
     
+    __slots__ = ()
+    
     def valuecount(self, evidence=None):
         if evidence is None:
             return len(self.gndatoms)
@@ -374,6 +382,8 @@ class SoftMutexVariable(MRFVariable):
     one ground atom may be true.
     """
     
+    __slots__ = ()
+    
     def valuecount(self, evidence=None):
         if evidence is None:
             return len(self.gndatoms) + 1
@@ -41,6 +41,8 @@ from tabulate import tabulate
 from pracmln import MLN
 from pracmln.mln.base import parse_mln
 from pracmln.mln.database import Database, parse_db
+from pracmln.mln.grounding.profile import GroundingProfile
+from pracmln.utils import tracing
 from pracmln.mln.learning.common import DiscriminativeLearner
 from pracmln.mln.methods import LearningMethods
 from pracmln.mln.util import headline, StopWatch
@@ -202,6 +204,38 @@ class MLNLearn(object):
         return self._config.get('use_initial_weights', False)
 
 
+    @property
+    def warmstart(self):
+        '''
+        An MLN (or the filename of an MLN) whose weights are used as an initial
+        guess for the formulas it has in common with the MLN to be learnt,
+        e.g. an MLN learnt previously on similar data. Default is ``None``.
+        '''
+        return self._config.get('warmstart')
+
+
+    @property
+    def checkpoint(self):
+        '''
+        The name of a file the state of the learning process is saved to
+        periodically, such that it can be resumed after an interruption.
+        Default is ``None``.
+
+        .. seealso::
+            :attr:`pracmln.MLNLearn.resume`
+        '''
+        return self._config.get('checkpoint')
+
+
+    @property
+    def resume(self):
+        '''
+        Specifies whether or not learning shall be resumed from the
+        :attr:`pracmln.MLNLearn.checkpoint` file. Default is ``False``.
+        '''
+        return self._config.get('resume', False)
+
+
     @property
     def qpreds(self):
         '''
@@ -287,6 +321,27 @@ class MLNLearn(object):
         return self._config.get('profile', False)
 
 
+    @property
+    def profile_grounding(self):
+        '''
+        If ``True``, the number of groundings, the time and the memory spent
+        on grounding every formula are reported after learning. Default is
+        ``False``.
+        '''
+        return self._config.get('profile_grounding', False)
+
+
+    @property
+    def tracefile(self):
+        '''
+        The name of a file the tracing records of the learning process, such
+        as the objective value and gradient norm of every iteration of the
+        optimizer, are appended to in JSON lines format. Default is ``None``,
+        i.e. nothing is recorded.
+        '''
+        return self._config.get('tracefile')
+
+
     @property
     def verbose(self):
         '''
@@ -374,6 +429,9 @@ class MLNLearn(object):
 
         params = dict([(k, getattr(self, k)) for k in (
             'multicore', 'verbose', 'profile', 'ignore_zero_weight_formulas')])
+        for k in ('warmstart', 'checkpoint', 'resume'):
+            if getattr(self, k):
+                params[k] = getattr(self, k)
 
         # for discriminative learning
         if issubclass(self.method, DiscriminativeLearner):
@@ -388,6 +446,8 @@ class MLNLearn(object):
             params['prior_stdev'] = self.prior_stdev
         # expand the parameters
         params.update(self.params)
+        if self.profile_grounding:
+            params['groundingprofile'] = GroundingProfile()
 
         if self.profile:
             prof = Profile()
@@ -395,6 +455,9 @@ class MLNLearn(object):
             prof.enable()
         else:
             prof = None
+        if self.tracefile:
+            exporter = tracing.JSONLinesExporter(self.tracefile)
+            tracing.addlistener(exporter)
         # set the debug level
         olddebug = logger.level
         logger.level = eval('logs.%s' % params.get('debug', 'WARNING').upper())
@@ -407,6 +470,11 @@ class MLNLearn(object):
                 print(headline('LEARNT MARKOV LOGIC NETWORK'))
                 print()
                 mlnlearnt.write()
+            if self.profile_grounding:
+                print()
+                print(headline('GROUNDING PROFILE'))
+                print()
+                params['groundingprofile'].write(mlnlearnt.formulas)
         except SystemExit:
             print('Cancelled...')
         finally:
@@ -416,6 +484,9 @@ class MLNLearn(object):
                 ps = pstats.Stats(prof, stream=sys.stdout).sort_stats(
                     'cumulative')
                 ps.print_stats()
+            if self.tracefile:
+                tracing.removelistener(exporter)
+                exporter.close()
             # reset the debug level
             logger.level = olddebug
         print()
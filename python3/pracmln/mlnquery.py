@@ -38,6 +38,9 @@ from dnutils import logs, ifnone, out
 from pracmln import ALL
 from pracmln.utils.project import MLNProject, PRACMLNConfig, mlnpath
 from pracmln.mln.methods import InferenceMethods
+from pracmln.mln.inference.batch import BatchInference
+from pracmln.mln.grounding.profile import GroundingProfile
+from pracmln.utils import tracing
 from pracmln.utils.widgets import FileEditBar
 from pracmln.utils import config, locs
 from pracmln.mln.util import parse_queries, headline, StopWatch
@@ -55,7 +58,7 @@ import logging #import used in eval, do not remove
 logger = logs.getlogger(__name__)
 
 GUI_SETTINGS = ['window_loc', 'db', 'method', 'use_emln', 'save',
-                'output_filename', 'grammar', 'queries', 'emln']
+                'output_filename', 'grammar', 'queries', 'emln', 'profile_grounding', 'tracefile']
 ALLOWED_EXTENSIONS = [('PRACMLN project files', '.pracmln'),
                       ('MLN files', '.mln'), ('MLN extension files', '.emln'),
                       ('Database files', '.db')]
@@ -164,6 +167,16 @@ class MLNQuery(object):
         return self._config.get('profile', False)
 
 
+    @property
+    def profile_grounding(self):
+        return self._config.get('profile_grounding', False)
+
+
+    @property
+    def tracefile(self):
+        return self._config.get('tracefile')
+
+
     @property
     def verbose(self):
         return self._verbose
@@ -178,9 +191,7 @@ class MLNQuery(object):
         return self._config.get('save', False)
 
 
-    def run(self):
-        watch = StopWatch()
-        watch.tag('inference', self.verbose)
+    def _load_mln(self):
         # load the MLN
         if isinstance(self.mln, MLN):
             mln = self.mln
@@ -195,21 +206,10 @@ class MLNQuery(object):
             emln = self.emln
             mln = parse_mln(mlnstr + emln, grammar=self.grammar,
                             logic=self.logic)
+        return mln
 
-        # load the database
-        if isinstance(self.db, Database):
-            db = self.db
-        elif isinstance(self.db, list) and len(self.db) == 1:
-            db = self.db[0]
-        elif isinstance(self.db, list) and len(self.db) == 0:
-            db = Database(mln)
-        elif isinstance(self.db, list):
-            raise Exception(
-                'Got {} dbs. Can only handle one for inference.'.format(
-                    len(self.db)))
-        else:
-            raise Exception('DB of invalid format {}'.format(type(self.db)))
 
+    def _inference_params(self):
         # expand the
         #  parameters
         params = dict(self._config)
@@ -219,19 +219,40 @@ class MLNQuery(object):
         params['verbose'] = self.verbose
         if self.verbose:
             print((tabulate(sorted(list(params.items()), key=lambda k_v: str(k_v[0])), headers=('Parameter:', 'Value:'))))
-        if type(db) is list and len(db) > 1:
-            raise Exception('Inference can only handle one database at a time')
-        elif type(db) is list:
-            db = db[0]
         params['cw_preds'] = [x for x in self.cw_preds if bool(x)]
         # extract and remove all non-algorithm
         for s in GUI_SETTINGS:
             if s in params: del params[s]
+        return params
 
+
+    def run(self):
+        watch = StopWatch()
+        watch.tag('inference', self.verbose)
+        mln = self._load_mln()
+
+        # load the database
+        if isinstance(self.db, Database):
+            db = self.db
+        elif isinstance(self.db, list) and len(self.db) == 1:
+            db = self.db[0]
+        elif isinstance(self.db, list) and len(self.db) == 0:
+            db = Database(mln)
+        elif isinstance(self.db, list):
+            raise Exception(
+                'Got {} dbs. Can only handle one for inference. Use runbatch() for multiple dbs.'.format(
+                    len(self.db)))
+        else:
+            raise Exception('DB of invalid format {}'.format(type(self.db)))
+
+        params = self._inference_params()
         if self.profile:
             prof = Profile()
             print('starting profiler...')
             prof.enable()
+        if self.tracefile:
+            exporter = tracing.JSONLinesExporter(self.tracefile)
+            tracing.addlistener(exporter)
         # set the debug level
         olddebug = logger.level
         logger.level = (eval('logs.%s' % params.get('debug', 'WARNING').upper()))
@@ -239,6 +260,8 @@ class MLNQuery(object):
         try:
             mln_ = mln.materialize(db)
             mrf = mln_.ground(db)
+            if self.profile_grounding:
+                mrf.groundingprofile = GroundingProfile()
             inference = self.method(mrf, self.queries, **params)
             if self.verbose:
                 print()
@@ -255,6 +278,11 @@ class MLNQuery(object):
             if self.verbose:
                 print()
                 inference.write_elapsed_time()
+            if self.profile_grounding:
+                print()
+                print((headline('GROUNDING PROFILE')))
+                print()
+                mrf.groundingprofile.write(mrf.formulas)
         except SystemExit:
             traceback.print_exc()
             print('Cancelled...')
@@ -264,6 +292,9 @@ class MLNQuery(object):
                 print((headline('PROFILER STATISTICS')))
                 ps = pstats.Stats(prof, stream=sys.stdout).sort_stats('cumulative')
                 ps.print_stats()
+            if self.tracefile:
+                tracing.removelistener(exporter)
+                exporter.close()
             # reset the debug level
             logger.level = olddebug
         if self.verbose:
@@ -273,6 +304,36 @@ class MLNQuery(object):
         return result
 
 
+    def runbatch(self, dbs=None):
+        '''
+        Performs the inference for a list of evidence databases at once.
+
+        The MLN is grounded only once for all databases with the same domains
+        and, if `multicore` is set, the databases are processed in parallel.
+
+        :param dbs:     the list of databases. If `None`, the databases of
+                        this query are used.
+        :returns:       a list of dicts mapping the query atoms to their
+                        results, one for each database.
+        '''
+        mln = self._load_mln()
+        if dbs is None:
+            dbs = self.db
+        if isinstance(dbs, Database):
+            dbs = [dbs]
+        elif not isinstance(dbs, list):
+            raise Exception('DB of invalid format {}'.format(type(dbs)))
+        params = self._inference_params()
+        params.pop('mln', None)
+        # set the debug level
+        olddebug = logger.level
+        logger.level = (eval('logs.%s' % params.get('debug', 'WARNING').upper()))
+        try:
+            return BatchInference(mln, dbs, self.method, self.queries, **params).run()
+        finally:
+            logger.level = olddebug
+
+
 class MLNQueryGUI(object):
     def __init__(self, master, gconf, directory=None):
         self.master = master
@@ -8,9 +8,21 @@ import os
 from pracmln import MLN, Database
 from pracmln import query, learn
 from pracmln.mlnlearn import EVIDENCE_PREDS
+from pracmln.mln.grounding import DefaultGroundingFactory, FastConjunctionGrounding, GroundingProfile, GroundingCache
+from pracmln.mln.inference import MaxWalkSAT, MCSAT, GibbsSampler
+from pracmln.mln.inference.wcspinfer import WCSPConverter
+from pracmln.mln.inference.batch import BatchInference
+from pracmln.wcsp import WCSP
+import io
+import numpy
+import json
 import time
+import tempfile
 
 from pracmln.utils import locs
+from pracmln.mln.util import mergedom
+from pracmln.utils import tracing
+from pracmln import cli
 
 
 def test_inference_smokers():
@@ -46,14 +58,357 @@ def test_inference_taxonomies():
               db=db,
               verbose=False,
               cw=True).run().write()
+
+
+
+def test_inference_smokers_lazy():
+    p = os.path.join(locs.examples, 'smokers', 'smokers.pracmln')
+    mln = MLN(mlnfile=('%s:wts.pybpll.smoking-train-smoking.mln' % p),
+              grammar='StandardGrammar')
+    db = Database(mln, dbfile='%s:smoking-test-smaller.db' % p)
+    exact = query(queries='Cancer,Smokes', method='EnumerationAsk', mln=mln, db=db).run().results
+    for method in ('MC-SAT', 'SAMaxWalkSAT'):
+        print('=== INFERENCE TEST:', method, '(lazy) ===')
+        results = query(queries='Cancer,Smokes',
+                        method=method,
+                        mln=mln,
+                        db=db,
+                        lazy=True).run().results
+        if method == 'MC-SAT':
+            assert all([abs(results[q] - exact[q]) < .1 for q in exact])
+
+
+def test_inference_smokers_raoblackwell():
+    p = os.path.join(locs.examples, 'smokers', 'smokers.pracmln')
+    mln = MLN(mlnfile=('%s:wts.pybpll.smoking-train-smoking.mln' % p),
+              grammar='StandardGrammar')
+    db = Database(mln, dbfile='%s:smoking-test-smaller.db' % p)
+    exact = query(queries='Cancer,Smokes', method='EnumerationAsk', mln=mln, db=db).run().results
+    for method in ('MC-SAT', 'GibbsSampler'):
+        print('=== INFERENCE TEST:', method, '(Rao-Blackwellized) ===')
+        results = query(queries='Cancer,Smokes',
+                        method=method,
+                        mln=mln,
+                        db=db,
+                        raoblackwell=True).run().results
+        assert all([abs(results[q] - exact[q]) < .1 for q in exact])
+
+
+def test_inference_smokers_valueprobs():
+    p = os.path.join(locs.examples, 'smokers', 'smokers.pracmln')
+    mln = MLN(mlnfile=('%s:wts.pybpll.smoking-train-smoking.mln' % p),
+              grammar='StandardGrammar')
+    # the weighted sums exceed the range of exp(), and the hard formulas
+    # rule out every value of Smokes and Cancer in every world
+    mln.weights = [1000 * float(w) for w in mln.weights]
+    mln << 'Smokes(x) <=> Cancer(x).'
+    mln << 'Smokes(x) <=> !Cancer(x).'
+    db = Database(mln, dbfile='%s:smoking-test-smaller.db' % p)
+    mrf = mln.materialize(db).ground(db)
+    print('=== INFERENCE TEST: conditional distributions of the variables ===')
+    gibbs = GibbsSampler(mrf, ['Cancer'])
+    world = gibbs.random_world()
+    for var in mrf.variables:
+        probs = gibbs._valueprobs(var, world)
+        assert numpy.isfinite(probs).all() and abs(sum(probs) - 1) < 1e-9
+    for block in gibbs._blocks():
+        _, probs = gibbs._blockprobs(block, world)
+        assert numpy.isfinite(probs).all() and abs(sum(probs) - 1) < 1e-9
+
+
+def test_inference_smokers_blocked():
+    p = os.path.join(locs.examples, 'smokers', 'smokers.pracmln')
+    mln = MLN(mlnfile=('%s:wts.pybpll.smoking-train-smoking.mln' % p),
+              grammar='StandardGrammar')
+    mln.weights = [1.2, 6]
+    db = Database(mln, dbfile='%s:smoking-test-smaller.db' % p)
+    print('=== INFERENCE TEST: GibbsSampler (blocked) ===')
+    exact = query(queries='Cancer,Smokes', method='EnumerationAsk', mln=mln, db=db).run().results
+    results = query(queries='Cancer,Smokes',
+                    method='GibbsSampler',
+                    mln=mln,
+                    db=db,
+                    blocked=True,
+                    maxsteps=100).run().results
+    assert all([abs(results[q] - exact[q]) < .1 for q in exact])
+
+
+def test_inference_smokers_kbest():
+    p = os.path.join(locs.examples, 'smokers', 'smokers.pracmln')
+    mln = MLN(mlnfile=('%s:wts.pybpll.smoking-train-smoking.mln' % p),
+              grammar='StandardGrammar')
+    db = Database(mln, dbfile='%s:smoking-test-smaller.db' % p)
+    for marginal in (False, True):
+        print('=== INFERENCE TEST: WCSPInference k-best', '(marginal)' if marginal else '', '===')
+        infer = query(queries='Cancer,Smokes',
+                      method='WCSPInference',
+                      mln=mln,
+                      db=db,
+                      k=5,
+                      marginal=marginal).run()
+        costs = [c for _, c in infer.solutions]
+        assert len(costs) == 5 and costs == sorted(costs)
+    # the time limit holds for all toulbar2 runs together
+    db = Database(mln, dbfile='%s:smoking-test.db' % p)
+    wcsp = WCSPConverter(mln.materialize(db).ground(db)).convert()
+    start = time.time()
+    solutions = wcsp.kbest(1000, timeout=.1)
+    assert time.time() - start < 1
+    costs = [c for c, _ in solutions]
+    assert 0 < len(costs) <= 1000 and costs == sorted(costs)
+
+
+def test_wcsp_read():
+    print('=== WCSP TEST: reading constraints with the same scope ===')
+    wcsp = WCSP()
+    wcsp.read(io.StringIO('test 2 2 3 100\n'
+                          '2 2\n'
+                          '2 0 1 0 1\n0 0 5\n'
+                          '2 0 1 0 1\n1 1 7\n'
+                          '2 1 0 0 2\n1 0 1\n0 1 2\n'))
+    assert list(wcsp.constraints) == [(0, 1)]
+    c = wcsp.constraints[(0, 1)]
+    assert dict([(t, c.tuples.get(t, c.defcost)) for t in ((0, 0), (0, 1), (1, 0), (1, 1))]) == \
+           {(0, 0): 5, (0, 1): 1, (1, 0): 2, (1, 1): 7}
+
+
+def test_inference_smokers_cuttingplane():
+    p = os.path.join(locs.examples, 'smokers', 'smokers.pracmln')
+    mln = MLN(mlnfile=('%s:wts.pybpll.smoking-train-smoking.mln' % p),
+              grammar='StandardGrammar')
+    db = Database(mln, dbfile='%s:smoking-test.db' % p)
+    for weights in (mln.weights, [1.2, -1.5]):
+        print('=== INFERENCE TEST: WCSPInference (cutting plane) ===')
+        mln.weights = weights
+        full = query(queries='Cancer,Smokes', method='WCSPInference', mln=mln, db=db).run()
+        cpi = query(queries='Cancer,Smokes', method='WCSPInference', mln=mln, db=db, cuttingplane=True).run()
+        assert abs(cpi.solutions[0][1] - full.solutions[0][1]) < 1e-6
+
+
+def test_inference_smokers_maxwalksat():
+    p = os.path.join(locs.examples, 'smokers', 'smokers.pracmln')
+    mln = MLN(mlnfile=('%s:wts.pybpll.smoking-train-smoking.mln' % p),
+              grammar='StandardGrammar')
+    mln.weights = [1.2, -1.5]
+    db = Database(mln, dbfile='%s:smoking-test.db' % p)
+    mrf = mln.ground(db)
+    mpe = query(queries='Cancer,Smokes,Friends', method='WCSPInference', mln=mln, db=db).run().results
+    world = list(mrf.evidence)
+    for atom, value in mpe.items():
+        world[mrf.gndatom(atom).idx] = value
+    optimum = MaxWalkSAT(mrf, queries=['Cancer', 'Smokes'], state=world).sum
+    for multicore in (False, True):
+        print('=== INFERENCE TEST: MaxWalkSAT', '(multicore)' if multicore else '', '===')
+        infer = MaxWalkSAT(mrf, queries=['Cancer', 'Smokes'], tries=3, multicore=multicore)
+        infer.run()
+        assert infer.sum <= optimum + 1e-6
+
+
+def test_inference_smokers_timeout():
+    p = os.path.join(locs.examples, 'smokers', 'smokers.pracmln')
+    mln = MLN(mlnfile=('%s:wts.pybpll.smoking-train-smoking.mln' % p),
+              grammar='StandardGrammar')
+    db = Database(mln, dbfile='%s:smoking-test-smaller.db' % p)
+    mrf = mln.ground(db)
+    for method in ('MC-SAT', 'GibbsSampler'):
+        print('=== INFERENCE TEST:', method, '(timeout) ===')
+        snapshots = []
+        start = time.time()
+        query(queries='Cancer,Smokes',
+              method=method,
+              mln=mln,
+              db=db,
+              maxsteps=1000000,
+              timeout=.3,
+              callback=snapshots.append).run()
+        assert time.time() - start < 5
+        assert len(snapshots) > 1 and snapshots[-1]['final'] and snapshots[-1]['timedout']
+    snapshots = list(MCSAT(mrf, ['Cancer', 'Smokes'], maxsteps=1000000, timeout=.3).iterrun())
+    assert snapshots[-1]['final'] and all([not s['final'] for s in snapshots[:-1]])
+
+
+def test_inference_smokers_timeout_expensive():
+    # a single step of MC-SAT and the enumeration of the worlds take much longer than the budget
+    p = os.path.join(locs.examples, 'smokers', 'smokers.pracmln')
+    mln = MLN(mlnfile=('%s:wts.pybpll.smoking-train-smoking.mln' % p),
+              grammar='StandardGrammar')
+    db = Database(mln, dbfile='%s:smoking-test.db' % p)
+    for method in ('MC-SAT', 'EnumerationAsk'):
+        print('=== INFERENCE TEST:', method, '(timeout, expensive steps) ===')
+        start = time.time()
+        infer = query(queries='Cancer',
+                      method=method,
+                      mln=mln,
+                      db=db,
+                      maxsteps=1000000,
+                      timeout=.5).run()
+        assert time.time() - start < 5
+        assert infer.timedout and all([0 <= p <= 1 for p in infer.results.values()])
+
+
+def test_inference_smokers_batch():
+    p = os.path.join(locs.examples, 'smokers', 'smokers.pracmln')
+    mln = MLN(mlnfile=('%s:wts.pybpll.smoking-train-smoking.mln' % p),
+              grammar='StandardGrammar')
+    # a predicate that does not occur in any formula is discarded by the materialization
+    mln << 'Unused(person)'
+    dbs = [Database(mln, dbfile='%s:%s' % (p, f)) for f in ('smoking-test-smaller.db', 'smoking-test.db')]
+    dbs.insert(1, dbs[0].copy())
+    dbs[1]['Smokes(Bob)'] = 1
+    single = [dict(query(queries='Cancer,Smokes',
+                         method='WCSPInference',
+                         mln=mln,
+                         db=db).run().results) for db in dbs]
+    for multicore in (False, True):
+        print('=== INFERENCE TEST: batch', '(multicore)' if multicore else '', '===')
+        results = query(queries='Cancer,Smokes',
+                        method='WCSPInference',
+                        mln=mln,
+                        db=dbs,
+                        multicore=multicore).runbatch()
+        assert results == single
+    # the formulas are grounded once per domain and simplified for every database
+    single = [dict(query(queries='Cancer,Smokes',
+                         method='EnumerationAsk',
+                         mln=mln,
+                         db=db).run().results) for db in dbs]
+    batch = BatchInference(mln, dbs, 'EnumerationAsk', queries=['Cancer', 'Smokes'])
+    results = batch.run()
+    assert len(batch.mrfs) == 2 and all([len(mrf.sharedgrounding) > 0 for mrf in batch.mrfs])
+    assert all([abs(r[q] - s[q]) < 1e-9 for r, s in zip(results, single) for q in s])
     
     
+def test_grounding_profile():
+    p = os.path.join(locs.examples, 'smokers', 'smokers.pracmln')
+    mln = MLN(mlnfile=('%s:smoking.mln' % p), grammar='StandardGrammar')
+    db = Database(mln, dbfile='%s:smoking-test-smaller.db' % p)
+    mrf = mln.ground(db)
+    for grounder in (DefaultGroundingFactory, FastConjunctionGrounding):
+        print('=== GROUNDING PROFILE TEST:', grounder.__name__, '===')
+        mrf.groundingprofile = GroundingProfile()
+        gfs = list(grounder(mrf, simplify=True).itergroundings())
+        mrf.groundingprofile.write(mrf.formulas)
+        assert sum([prof.emitted for prof in mrf.groundingprofile.items()]) == len(gfs)
+        assert all([mrf.groundingprofile[f.idx].enumerated == f.countgroundings(mrf) for f in mrf.formulas])
+
+
+def test_grounding_shared_literals():
+    p = os.path.join(locs.examples, 'smokers', 'smokers.pracmln')
+    mln = MLN(mlnfile=('%s:wts.pybpll.smoking-train-smoking.mln' % p), grammar='StandardGrammar')
+    db = Database(mln, dbfile='%s:smoking-test-smaller.db' % p)
+    mrf = mln.ground(db)
+    print('=== GROUNDING TEST: shared ground literals ===')
+    gfs = list(DefaultGroundingFactory(mrf, simplify=False).itergroundings())
+    lits = {}
+    for gf in gfs:
+        assert not hasattr(gf, '__dict__')
+        for lit in gf.literals():
+            assert lits.setdefault((lit.gndatom.idx, lit.negated), lit) is lit
+    assert all([gf.idx is not None for gf in gfs])
+    assert not any([hasattr(var, '__dict__') for var in mrf.variables])
+
+
+def test_grounding_spill():
+    p = os.path.join(locs.examples, 'smokers', 'smokers.pracmln')
+    mln = MLN(mlnfile=('%s:wts.pybpll.smoking-train-smoking.mln' % p), grammar='StandardGrammar')
+    db = Database(mln, dbfile='%s:smoking-test-smaller.db' % p)
+    mrf = mln.ground(db)
+    print('=== GROUNDING TEST: spill to disk ===')
+    expected = [(gf.idx, str(gf)) for gf in DefaultGroundingFactory(mrf, simplify=True).itergroundings()]
+    grounder = DefaultGroundingFactory(mrf, simplify=True, membudget=0)
+    gfs = grounder.itergroundings()
+    first = [next(gfs)]
+    grounder._cache.chunksize = 7
+    first = [(gf.idx, str(gf)) for gf in first + list(gfs)]
+    second = [(gf.idx, str(gf)) for gf in grounder.itergroundings()]
+    assert grounder._cache.spilled == len(expected) - 1
+    assert first == second == expected
+    cache = GroundingCache(mrf, budget=0, chunksize=3)
+    for gf in grounder.itergroundings():
+        cache.append(gf)
+    assert [str(gf) for gf in cache.iterate(5)] == [s for _, s in expected[5:]]
+    cache.close()
+
+
+def test_parsing_materialization_cache():
+    p = os.path.join(locs.examples, 'smokers', 'smokers.pracmln')
+    mln = MLN(mlnfile=('%s:wts.pybpll.smoking-train-smoking.mln' % p), grammar='StandardGrammar')
+    db = Database(mln, dbfile='%s:smoking-test-smaller.db' % p)
+    print('=== CACHE TEST: parsing and materialization ===')
+    # modifications of parsed formulas and literals do not affect subsequent parses
+    grammar = mln.logic.grammar
+    for _ in range(2):
+        f = grammar.parse_formula('Cancer(x) => Smokes(x)')
+        assert str(f) == 'Cancer(x) => Smokes(x)'
+        f.children[1].negated = True
+        lit = grammar.parse_literal('!Smokes(Anna)')
+        assert lit == (False, 'Smokes', ['Anna'])
+        lit[2][0] = 'Bob'
+    # the current weights are used if the materialization is cached
+    weights = list(mln.weights)
+    mln_ = mln.materialize(db)
+    formulas = [str(f) for f in mln_.formulas]
+    mln.weights = [float(w) + 1 for w in weights]
+    mln__ = mln.materialize(db)
+    assert mln__.weights == mln.weights and mln_.weights == weights
+    assert [f.weight for f in mln__.formulas] == mln.weights
+    # modifications of a materialized MLN do not affect subsequent materializations
+    mln__.formulas[0].children[1].negated = True
+    mln__.weights[0] = 0
+    mln___ = mln.materialize(db)
+    assert [str(f) for f in mln___.formulas] == formulas and mln___.weights == mln.weights
+    # new formulas change the cache key
+    domains = mergedom(mln.domains, db.domains)
+    key = mln._materialization_key(domains)
+    mln.formula('Cancer(x) => Smokes(x)', weight=0)
+    assert mln._materialization_key(domains) != key
+    assert [str(f) for f in mln.materialize(db).formulas] == formulas + ['Cancer(x) => Smokes(x)']
+
+
+def test_tracing():
+    p = os.path.join(locs.examples, 'smokers', 'smokers.pracmln')
+    stream = io.StringIO()
+    exporter = tracing.JSONLinesExporter(stream)
+    tracing.addlistener(exporter)
+    try:
+        print('=== TRACING TEST ===')
+        mln = MLN(mlnfile=('%s:smoking.mln' % p), grammar='StandardGrammar')
+        db = Database(mln, dbfile='%s:smoking-train.db' % p)
+        learn(method='BPLL', mln=mln, db=db).run()
+        db = Database(mln, dbfile='%s:smoking-test-smaller.db' % p)
+        query(queries='Cancer', method='MC-SAT', mln=mln, db=db).run()
+    finally:
+        tracing.removelistener(exporter)
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    names = set([r['name'] for r in records])
+    for name in ('parse.mln', 'parse.db', 'materialize', 'ground', 'ground.formulas', 'learn', 'learn.prepare',
+                 'learn.optimize', 'learn.iteration', 'infer', 'infer.setup', 'mcmc.chain'):
+        assert name in names, name
+    spans = dict([(r['id'], r) for r in records if r['type'] == 'span'])
+    assert all([r['parent'] is None or r['parent'] in spans for r in spans.values()])
+
+
+def test_cli():
+    p = os.path.join(locs.examples, 'smokers', 'smokers.pracmln')
+    print('=== COMMAND LINE INTERFACE TEST ===')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        mlnfile = os.path.join(tmpdir, 'learnt.mln')
+        resultfile = os.path.join(tmpdir, 'results.txt')
+        cli.main(['learn', '-i', '%s:smoking.mln' % p, '-t', '%s:smoking-train.db' % p,
+                  '--grammar', 'StandardGrammar', '-o', mlnfile])
+        cli.main(['query', '-i', mlnfile, '-e', '%s:smoking-test-smaller.db' % p, '-q', 'Cancer',
+                  '--grammar', 'StandardGrammar', '-m', 'WCSPInference', '-o', resultfile])
+        with open(resultfile) as f:
+            results = f.read()
+    assert 'Cancer(Ann)' in results and 'Cancer(Bob)' in results
+
+
 def test_learning_smokers():
     p = os.path.join(locs.examples, 'smokers', 'smokers.pracmln')
     mln = MLN(mlnfile=('%s:smoking.mln' % p), grammar='StandardGrammar')
     mln.write()
     db = Database(mln, dbfile='%s:smoking-train.db' % p)
-    for method in ('BPLL', 'BPLL_CG', 'CLL'):
+    for method in ('BPLL', 'BPLL_CG', 'CLL', 'SLL'):
         for multicore in (True, False):
             print('=== LEARNING TEST:', method, '===')
             learn(method=method,
@@ -63,6 +418,33 @@ def test_learning_smokers():
                   multicore=multicore).run()
 
 
+
+def test_learning_smokers_checkpoint():
+    p = os.path.join(locs.examples, 'smokers', 'smokers.pracmln')
+    mln = MLN(mlnfile=('%s:smoking.mln' % p), grammar='StandardGrammar')
+    db = Database(mln, dbfile='%s:smoking-train.db' % p)
+    checkpoint = os.path.join(tempfile.mkdtemp(), 'smoking.ckpt')
+    print('=== LEARNING TEST: checkpoint ===')
+    learnt = learn(method='BPLL', mln=mln, db=db, checkpoint=checkpoint).run()
+    assert os.path.exists(checkpoint) and os.path.exists(checkpoint + '.stat')
+    resumed = learn(method='BPLL', mln=mln, db=db, checkpoint=checkpoint, resume=True).run()
+    assert resumed.weights == learnt.weights
+    warm = learn(method='BPLL', mln=mln, db=db, warmstart=learnt).run()
+    assert all(abs(w1 - w2) < 1e-3 for w1, w2 in zip(warm.weights, learnt.weights))
+
+
+def test_learning_smokers_optimizers():
+    p = os.path.join(locs.examples, 'smokers', 'smokers.pracmln')
+    mln = MLN(mlnfile=('%s:smoking.mln' % p), grammar='StandardGrammar')
+    db = Database(mln, dbfile='%s:smoking-train.db' % p)
+    for method in ('BPLL', 'CLL'):
+        for optimizer in ('ncg', 'trust-ncg'):
+            print('=== LEARNING TEST:', method, optimizer, '===')
+            learn(method=method, mln=mln, db=db, params='optimizer=%r' % optimizer).run()
+        print('=== LEARNING TEST:', method, 'l-bfgs-b', '===')
+        learnt = learn(method=method, mln=mln, db=db, params="optimizer='l-bfgs-b', bounds=(-.5, .5)").run()
+        assert all(-.5 <= w <= .5 for w in learnt.weights)
+
 def test_learning_taxonomies():
     p = os.path.join(locs.examples, 'taxonomies', 'taxonomies.pracmln')
     mln = MLN(mlnfile=('%s:senses_and_roles.mln' % p), grammar='PRACGrammar')
@@ -84,7 +466,26 @@ def runall():
     start = time.time()
     test_inference_smokers()
     test_inference_taxonomies()
+    test_inference_smokers_lazy()
+    test_inference_smokers_raoblackwell()
+    test_inference_smokers_valueprobs()
+    test_inference_smokers_blocked()
+    test_inference_smokers_kbest()
+    test_wcsp_read()
+    test_inference_smokers_cuttingplane()
+    test_inference_smokers_maxwalksat()
+    test_inference_smokers_timeout()
+    test_inference_smokers_timeout_expensive()
+    test_inference_smokers_batch()
+    test_grounding_profile()
+    test_grounding_shared_literals()
+    test_grounding_spill()
+    test_parsing_materialization_cache()
+    test_tracing()
+    test_cli()
     test_learning_smokers()
+    test_learning_smokers_checkpoint()
+    test_learning_smokers_optimizers()
     test_learning_taxonomies()
     print()
     print('all test finished after', time.time() - start, 'secs')
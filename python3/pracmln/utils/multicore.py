@@ -4,9 +4,14 @@ import traceback
 import sys
 import signal
 import os
+import gc
 from ..mln.errors import OutOfMemoryError
 import psutil
 
+
+# the percentage of the system memory in use above which computations are aborted
+MEMLIMIT = 90.
+
      
 
 class CtrlCException(Exception): pass
@@ -64,8 +69,38 @@ class _methodcaller:
     
 
 def checkmem():
-    if float(psutil.virtual_memory().percent) > 75.:
-        raise OutOfMemoryError('Aborting due to excessive memory consumption.')
+    """
+    Raises an :class:`mln.errors.OutOfMemoryError` if more than `MEMLIMIT`
+    percent of the system memory are in use, even after a garbage collection.
+    """
+    if float(psutil.virtual_memory().percent) > MEMLIMIT:
+        gc.collect()
+        if float(psutil.virtual_memory().percent) > MEMLIMIT:
+            raise OutOfMemoryError('Aborting due to excessive memory consumption.')
+
+
+def availmem():
+    """
+    Returns the memory in bytes that can still be allocated before `MEMLIMIT`
+    is reached.
+    """
+    mem = psutil.virtual_memory()
+    return max(0, int(mem.total * MEMLIMIT / 100.) - (mem.total - mem.available))
+
+
+def poolsize(mem=None):
+    """
+    Returns the number of worker processes for a pool, i.e. the number of CPUs,
+    but at most as many workers as fit into the available memory (see
+    :func:`availmem`).
+
+    :param mem:    the memory in bytes a worker is expected to need. Defaults
+                   to the resident memory of the current process, which the
+                   workers inherit and which they copy as they write to it.
+    """
+    if mem is None:
+        mem = psutil.Process().memory_info().rss
+    return max(1, min(multiprocessing.cpu_count(), availmem() // max(1, mem)))
 
 def make_memsafe():
     if sys.platform.startswith('linux'):
@@ -0,0 +1,184 @@
+'''
+Structured metrics and tracing of the learning and inference pipeline.
+
+Components of pracmln report what they are doing as records, i.e. flat dicts
+with at least the members `name`, `type` (either `'span'` for a timed
+operation or `'event'` for a single measurement), `time` (the UNIX time
+stamp) and `pid`, plus arbitrary attributes of the respective operation.
+Spans additionally have a `duration` in seconds, an `id` and the `parent`
+id of the span they are nested in, and an `error` if they were left by an
+exception.
+
+Records are passed to all listeners registered with :func:`addlistener`.
+As long as there are no listeners, nothing is recorded.
+
+:Example:
+
+>>> with JSONLinesExporter('trace.jsonl') as exporter:
+...     addlistener(exporter)
+...     mln.learn(dbs, BPLL)
+...     removelistener(exporter)
+
+The records emitted by pracmln are:
+
+=====================  ======  ==============================================
+name                   type    attributes
+=====================  ======  ==============================================
+`parse.mln`            span
+`parse.db`             span
+`materialize`          span
+`ground`               span    `gndatoms`
+`ground.formulas`      event   `grounder`, `groundings`, `duration`
+`learn`                span    `learner`
+`learn.prepare`        span    `learner`, `run`
+`learn.optimize`       span    `learner`, `optimizer`, `run`
+`learn.iteration`      event   `learner`, `iteration`, `f`, `gradnorm`, `duration`
+`infer`                span    `method`
+`infer.setup`          span    `method`
+`infer.cuttingplane`   event   `iteration`, `groundings`, `violated`
+`mcmc.chain`           event   `method`, `steps`, `rate`, `delta`, `converged`
+=====================  ======  ==============================================
+'''
+import os
+import json
+import time
+import itertools
+import functools
+
+
+class Tracer(object):
+    '''
+    Dispatches the tracing records to the registered listeners.
+    '''
+
+    def __init__(self):
+        self.listeners = []
+        self._ids = itertools.count(1)
+        self._spans = []
+
+
+    @property
+    def enabled(self):
+        return bool(self.listeners)
+
+
+    def addlistener(self, listener):
+        '''
+        Registers a callable that is called with every record.
+        '''
+        self.listeners.append(listener)
+
+
+    def removelistener(self, listener):
+        self.listeners.remove(listener)
+
+
+    def emit(self, record):
+        for listener in list(self.listeners):
+            listener(record)
+
+
+    def event(self, name, **attrs):
+        '''
+        Emits a single measurement.
+        '''
+        if not self.listeners: return
+        record = {'name': name, 'type': 'event', 'time': time.time(), 'pid': os.getpid()}
+        record.update(attrs)
+        self.emit(record)
+
+
+    def span(self, name, **attrs):
+        '''
+        Returns a context manager that emits a record with the duration of
+        the operation it encloses. Attributes can be added to the span while
+        it is open by assigning to its `attrs` dict.
+        '''
+        return Span(self, name, attrs)
+
+
+class Span(object):
+
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.id = None
+
+
+    def __enter__(self):
+        if self.tracer.enabled:
+            self.id = next(self.tracer._ids)
+            self.parent = self.tracer._spans[-1] if self.tracer._spans else None
+            self.tracer._spans.append(self.id)
+            self.start = time.time()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self.id is None: return
+        self.tracer._spans.remove(self.id)
+        record = {'name': self.name, 'type': 'span', 'time': self.start, 'pid': os.getpid(),
+                  'duration': time.time() - self.start, 'id': self.id, 'parent': self.parent}
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        record.update(self.attrs)
+        self.tracer.emit(record)
+
+
+class JSONLinesExporter(object):
+    '''
+    Writes every record as a line of JSON to a file or stream.
+
+    :param target:    a filename, which is opened for appending, or a stream.
+    '''
+
+    def __init__(self, target):
+        if isinstance(target, str):
+            self.stream = open(target, 'a')
+            self._close = True
+        else:
+            self.stream = target
+            self._close = False
+
+
+    def __call__(self, record):
+        # records may contain numpy numbers, which are converted to strings
+        self.stream.write(json.dumps(record, default=str) + '\n')
+        self.stream.flush()
+
+
+    def close(self):
+        if self._close:
+            self.stream.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *_):
+        self.close()
+
+
+# the tracer all components of pracmln report to
+tracer = Tracer()
+
+
+def traced(name):
+    '''
+    Decorator enclosing every call of a function in a span of the given name.
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+addlistener = tracer.addlistener
+removelistener = tracer.removelistener
+event = tracer.event
+span = tracer.span
@@ -23,11 +23,15 @@
 
 import sys
 import os
-from subprocess import Popen, PIPE
-import bisect
-import re
+from subprocess import Popen, PIPE, DEVNULL
+import math
+import time
+import heapq
 from collections import defaultdict
 import _thread
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import platform
 
 from dnutils import logs
@@ -36,6 +40,7 @@ from ..utils import locs
 from ..mln.errors import NoConstraintsError
 import tempfile
 from functools import reduce
+import numpy
 
 
 logger = logs.getlogger(__name__)
@@ -92,6 +97,9 @@ _tb2path = os.path.join(locs.app_data, toulbar2_path())
 if not is_executable(_tb2path):
     logger.error('toulbar2 was expected to be in {} but cannot be found. WCSP inference will not be possible.\n'.format(_tb2path))
 
+# problems are handed over to toulbar2 in a memory-backed file if possible
+_tmpdir = '/dev/shm' if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK) else None
+
 
 class Constraint(object):
     '''
@@ -101,6 +109,10 @@ class Constraint(object):
     valued non-negative weight or the WCSP.TOP constant
     indicating global inconsistency.
     
+    Alternatively, the costs of a constraint can be held in a dense
+    cost table (see :meth:`Constraint.table`), which is converted back
+    into tuples and default costs the first time they are accessed.
+    
     :member tuples:     dictionary mapping a tuple to int (the costs)
     :member defcost:    the default cost of this constraint
     :param variables:   list of indices that identify the range of this constraint
@@ -110,14 +122,92 @@ class Constraint(object):
     '''
     
     def __init__(self, variables, tuples=None, defcost=0):
-        self.tuples = dict()
+        self._tuples = dict()
+        self._table = None
         if tuples is not None:
             for t in tuples:
-                self.tuples[tuple(t[:-1])] = t[-1]
-        self.defcost = defcost
+                self._tuples[tuple(t[:-1])] = t[-1]
+        self._defcost = defcost
         self.variables = variables
         
         
+    @property
+    def tuples(self):
+        if self._table is not None:
+            self._sparsify()
+        return self._tuples
+    
+    
+    @tuples.setter
+    def tuples(self, tuples):
+        if self._table is not None:
+            self._sparsify()
+        self._tuples = tuples
+        
+        
+    @property
+    def defcost(self):
+        if self._table is not None:
+            self._sparsify()
+        return self._defcost
+    
+    
+    @defcost.setter
+    def defcost(self, cost):
+        if self._table is not None:
+            self._sparsify()
+        self._defcost = cost
+        
+        
+    def table(self, domsizes, top, variables=None):
+        '''
+        Returns the costs of this constraint as a dense array with one axis per variable.
+        
+        Top costs are represented by ``numpy.inf``.
+        
+        :param domsizes:    the domain sizes of all variables of the WCSP.
+        :param top:         the top costs of the WCSP.
+        :param variables:   (optional) permutation of the variables of this constraint
+                            specifying the order of the axes.
+        '''
+        if self._table is not None:
+            table = self._table[0]
+        else:
+            table = numpy.full([domsizes[v] for v in self.variables], numpy.inf if self._defcost == top else self._defcost, dtype=float)
+            if self._tuples:
+                costs = numpy.array(list(self._tuples.values()), dtype=float)
+                costs[costs == top] = numpy.inf
+                table[tuple(numpy.array(list(self._tuples.keys())).T)] = costs
+        if variables is not None and tuple(variables) != tuple(self.variables):
+            table = table.transpose([self.variables.index(v) for v in variables])
+        return table
+    
+    
+    def settable(self, table, top):
+        '''
+        Replaces the costs of this constraint by the given dense cost table.
+        
+        :param table:    an array as returned by :meth:`Constraint.table`.
+        :param top:      the top costs of the WCSP.
+        '''
+        self._table = (table, top)
+        
+        
+    def _sparsify(self):
+        '''
+        Converts the dense cost table into tuples and default costs. The most 
+        frequent cost value becomes the default.
+        '''
+        table, top = self._table
+        self._table = None
+        values, counts = numpy.unique(table, return_counts=True)
+        defcost = values[counts.argmax()]
+        idx = numpy.nonzero(table != defcost)
+        cast = float if top == -1 else int
+        self._defcost = top if defcost == numpy.inf else cast(defcost)
+        self._tuples = {t: (top if c == numpy.inf else cast(c)) for t, c in zip(zip(*[i.tolist() for i in idx]), table[idx].tolist())}
+        
+        
     def tuple(self, t, cost):
         '''
         Adds a tuple to the constraint. A value in the tuple corresponds to the
@@ -131,9 +221,25 @@ class Constraint(object):
     
     
     def write(self, stream=sys.stdout.buffer):
-        stream.write('{} {} {} {}\n'.format(len(self.variables), ' '.join(map(str, self.variables)), self.defcost, len(self.tuples)).encode())
-        for t in list(self.tuples.keys()):
-            stream.write('{} {}\n'.format(' '.join(map(str, t)), self.tuples[t]).encode())
+        stream.write(self.wcspstr(intcosts=False).encode())
+
+
+    def wcspstr(self, intcosts=True):
+        '''
+        Returns the representation of this constraint in WCSP format, i.e. the
+        header line followed by one line per tuple.
+
+        All tuples are formatted by a single format string, which is compiled
+        once per constraint.
+
+        :param intcosts:    if True, the costs are written as integers.
+        '''
+        costfmt = '%d' if intcosts else '%s'
+        fmt = ' '.join(['%d'] * len(self.variables) + [costfmt])
+        lines = [('%d %s ' + costfmt + ' %d') % (len(self.variables), ' '.join(map(str, self.variables)), self.defcost, len(self.tuples))]
+        lines.extend([fmt % (t + (c,)) for t, c in self.tuples.items()])
+        lines.append('')
+        return '\n'.join(lines)
             
             
     def __eq__(self, other):
@@ -153,17 +259,30 @@ class WCSP(object):
     :member domsizes:    list of domain sizes
     :member top:         maximal costs (entirely inconsistent worlds)
     :member constraints: list of :class:`Constraint` objects
+    :member divisor:     the factor by which the original real-valued costs have been
+                         divided to make them integers (None if unknown or all
+                         constraints are hard)
     '''
     
     # maximum costs imposed by toulbar
     MAX_COST = 1537228672809129301
     
+    # number of characters buffered before they are written to the stream
+    WRITE_BUFSIZE = 1 << 20
+    
+    # maximal size of the joint domain of constraints merged as dense cost tables
+    DENSE_MAXSIZE = 1 << 16
+    
+    # maximal number of solutions enumerated per solver run in :meth:`WCSP.kbest`
+    KBEST_MAXSOLUTIONS = 10000
+    
 
     def __init__(self, name=None, domsizes=None, top=-1):
         self.name = name
         self.domsizes = domsizes
         self.top = top
         self.constraints = {}
+        self.divisor = None
     
     
     def constraint(self, constraint):
@@ -171,72 +290,88 @@ class WCSP(object):
         Adds the given constraint to the WCSP. If a constraint 
         with the same scope already exists, the tuples of the
         new constraint are merged with the existing ones.
+        
+        Constraints whose joint domain is not larger than :attr:`WCSP.DENSE_MAXSIZE`
+        are merged by adding their dense cost tables.
         '''
         varindices = constraint.variables
         cold = self.constraints.get(tuple(sorted(varindices)))
-        if cold is not None:
+        if cold is None:
+            self.constraints[tuple(sorted(varindices))] = constraint
+            return
+        size = reduce(lambda x, y: x * y, [self.domsizes[x] for x in varindices])
+        if size <= WCSP.DENSE_MAXSIZE:
+            table = cold.table(self.domsizes, self.top) + constraint.table(self.domsizes, self.top, variables=cold.variables)
+            cold.settable(table, self.top)
+            return
+        if tuple(constraint.variables) != tuple(cold.variables):
+            perm = [constraint.variables.index(v) for v in cold.variables]
             c_ = Constraint(cold.variables, defcost=constraint.defcost)
-            for t, cost in constraint.tuples.items():
-                t = [t[constraint.variables.index(v)] for v in cold.variables]
-                c_.tuple(t, cost)
+            c_.tuples = {tuple([t[i] for i in perm]): cost for t, cost in constraint.tuples.items()}
             constraint = c_
-            varindices = constraint.variables
-            
-            # update all the tuples of the old constraint with the tuples of the new constraint
-            for t, cost in constraint.tuples.items():
-                oldcost = cold.tuples.get(t, None)
-                # if the tuple has caused maximal costs in the old constraint, it must also cause maximal costs in the
-                # merged one. Or if the tuple was not part of the old constraint and the defcosts were maximal.
-                if oldcost == self.top or oldcost is None and cold.defcost == self.top: continue
-                # add the tuple costs of the new constraint or make them top if it's top in the new constraint
-                if oldcost is not None:
-                    cold.tuple(t, self.top if cost == self.top else (cost + oldcost))
-                # add the tuple costs of the new constraint if the tuple is not conatined in the old one
-                # or make them top if the tuple has maximal costs in the new constraint
-                else:
-                    cold.tuple(t, self.top if cost == self.top else (cost + cold.defcost))
-                    
-            # update the default costs of the old constraint
-            if constraint.defcost != 0:# and cold.defcost != self.top:
-                # all tuples that are part of the old constraint but not of the new constraint
-                # have to be added the default costs of the new constraint, or made tops cost
-                # in case the defcosts of the new constraint are top
-                for t in [x for x in cold.tuples if x not in constraint.tuples]:
-                    oldcost = cold.tuples[t]
-                    if oldcost != self.top:
-                        cold.tuple(t, self.top if constraint.defcost == self.top else (oldcost + constraint.defcost))
-                # for all tuples that are neither in the old nor the new constraint, the default costs
-                # have to be updated by the sum of the two defcosts, or tops if defcosts of the new constraint are tops.
-                if cold.defcost != self.top:
-                    cold.defcost = self.top if constraint.defcost == self.top else (cold.defcost + constraint.defcost)
-            # if the constraint is fully specified by its tuples,
-            # simplify it by introducing default costs
-            if reduce(lambda x, y: x * y, [self.domsizes[x] for x in varindices]) == len(cold.tuples):
-                cost2assignments = defaultdict(list)
-                for t, c in cold.tuples.items():
-                    cost2assignments[c].append(t)
-                defaultCost = max(cost2assignments, key=lambda x: len(cost2assignments[x]))
-                del cost2assignments[defaultCost]
-                cold.defcost = defaultCost
-                cold.tuples = {}
-                for cost, tuples in cost2assignments.items():
-                    for t in tuples: cold.tuple(t, cost)
-        else:
-            self.constraints[tuple(sorted(varindices))] = constraint
+        
+        # update all the tuples of the old constraint with the tuples of the new constraint
+        for t, cost in constraint.tuples.items():
+            oldcost = cold.tuples.get(t, None)
+            # if the tuple has caused maximal costs in the old constraint, it must also cause maximal costs in the
+            # merged one. Or if the tuple was not part of the old constraint and the defcosts were maximal.
+            if oldcost == self.top or oldcost is None and cold.defcost == self.top: continue
+            # add the tuple costs of the new constraint or make them top if it's top in the new constraint
+            if oldcost is not None:
+                cold.tuple(t, self.top if cost == self.top else (cost + oldcost))
+            # add the tuple costs of the new constraint if the tuple is not conatined in the old one
+            # or make them top if the tuple has maximal costs in the new constraint
+            else:
+                cold.tuple(t, self.top if cost == self.top else (cost + cold.defcost))
+                
+        # update the default costs of the old constraint
+        if constraint.defcost != 0:# and cold.defcost != self.top:
+            # all tuples that are part of the old constraint but not of the new constraint
+            # have to be added the default costs of the new constraint, or made tops cost
+            # in case the defcosts of the new constraint are top
+            for t in [x for x in cold.tuples if x not in constraint.tuples]:
+                oldcost = cold.tuples[t]
+                if oldcost != self.top:
+                    cold.tuple(t, self.top if constraint.defcost == self.top else (oldcost + constraint.defcost))
+            # for all tuples that are neither in the old nor the new constraint, the default costs
+            # have to be updated by the sum of the two defcosts, or tops if defcosts of the new constraint are tops.
+            if cold.defcost != self.top:
+                cold.defcost = self.top if constraint.defcost == self.top else (cold.defcost + constraint.defcost)
+        # if the constraint is fully specified by its tuples,
+        # simplify it by introducing default costs
+        if size == len(cold.tuples):
+            cost2assignments = defaultdict(list)
+            for t, c in cold.tuples.items():
+                cost2assignments[c].append(t)
+            defaultCost = max(cost2assignments, key=lambda x: len(cost2assignments[x]))
+            del cost2assignments[defaultCost]
+            cold.defcost = defaultCost
+            cold.tuples = {}
+            for cost, tuples in cost2assignments.items():
+                for t in tuples: cold.tuple(t, cost)
         
         
     def write(self, stream=sys.stdout.buffer):
         '''
         Writes the WCSP problem in WCSP format into an arbitrary stream
         providing a write method.
+        
+        The constraints are formatted in bulk and written in chunks of
+        about :attr:`WCSP.WRITE_BUFSIZE` characters.
         '''
         self._make_integer_cost()
-        stream.write('{} {} {} {} {}\n'.format(self.name, len(self.domsizes), max(self.domsizes), len(self.constraints), int(self.top)).encode())
-        stream.write('{}\n'.format(' '.join(map(str, self.domsizes))).encode())
-        for c in list(self.constraints.values()):
-            stream.write('{} {} {} {}\n'.format(len(c.variables), ' '.join(map(str, c.variables)), c.defcost, len(c.tuples)).encode())
-            for t in list(c.tuples.keys()):
-                stream.write('{} {}\n'.format(' '.join(map(str, t)), int(c.tuples[t])).encode())
+        buf = ['{} {} {} {} {}\n'.format(self.name, len(self.domsizes), max(self.domsizes), len(self.constraints), int(self.top)),
+               '{}\n'.format(' '.join(map(str, self.domsizes)))]
+        bufsize = 0
+        for c in self.constraints.values():
+            cstr = c.wcspstr()
+            buf.append(cstr)
+            bufsize += len(cstr)
+            if bufsize >= WCSP.WRITE_BUFSIZE:
+                stream.write(''.join(buf).encode())
+                buf = []
+                bufsize = 0
+        stream.write(''.join(buf).encode())
         
         
     def read(self, stream):
@@ -244,6 +379,7 @@ class WCSP(object):
         Loads a WCSP problem from an arbitrary stream. Must be in the WCSP format.
         '''
         tuplesToRead = 0
+        constraint = None
         for i, line in enumerate(stream.readlines()):
             tokens = line.split()
             if i == 0:
@@ -257,30 +393,29 @@ class WCSP(object):
                     variables = list(map(int, tokens[1:-2]))
                     defcost = int(tokens[-2])
                     constraint = Constraint(variables, defcost=defcost)
-                    self.constraints.append(constraint)
                 else:
                     constraint.tuple(list(map(int,tokens[0:-1])), int(tokens[-1]))
                     tuplesToRead -= 1
+                # constraints with the same scope are merged, so they must be complete
+                if tuplesToRead == 0:
+                    self.constraint(constraint)
                     
                     
     def _compute_divisor(self):
         '''
         Computes a divisor for making all constraint costs integers.
         '''
-        # store all costs in a sorted list
-        costs = []
-        minWeight = None
+        # collect the distinct costs in a sorted list
         if len(self.constraints) == 0:
             raise NoConstraintsError('There are no satisfiable constraints.')
-        for constraint in list(self.constraints.values()):
-            for value in [constraint.defcost] + list(constraint.tuples.values()):
-                if value == self.top: continue
-                value = eval('{:.6f}'.format(value))
-                if value in costs:
-                    continue
-                bisect.insort(costs, value)
-                if (minWeight is None or value < minWeight) and value > 0:
-                    minWeight = value
+        costs = set()
+        for constraint in self.constraints.values():
+            costs.add(constraint.defcost)
+            costs.update(constraint.tuples.values())
+        costs.discard(self.top)
+        costs = sorted(set([float('{:.6f}'.format(value)) for value in costs]))
+        positive = [value for value in costs if value > 0]
+        minWeight = positive[0] if positive else None
         # no smallest real-valued weight -> all constraints are hard
         if minWeight is None: 
             return None
@@ -348,83 +483,282 @@ class WCSP(object):
                 else:
                     constraint.tuples[tup] = 0 if divisor is None else int(float(cost) / divisor)
         self.top = top
+        self.divisor = divisor
     
                     
-    def itersolutions(self):
+    def _toulbar2(self, *options, timeout=None):
         '''
-        Iterates over all (intermediate) solutions found.
+        Writes the problem into a temporary file and runs toulbar2 on it.
         
-        Intermediate solutions are sound variable assignments that may not necessarily
-        be gloabally optimal.
+        The file is placed in a memory-backed file system where available. 
         
-        :returns:    a generator of (idx, solution) tuples, where idx is the index and solution is a tuple
-                     of variable value indices.
+        :param options:    additional command line options passed to toulbar2.
+        :param timeout:    (optional) time limit in seconds, after which toulbar2 is stopped.
+        :returns:          a generator of the lines toulbar2 writes to its stdout.
         '''
         if not is_executable(_tb2path):
             raise Exception('toulbar2 cannot be found.')
         # append the process id to the filename to make it "process safe"
-        tmpfile = tempfile.NamedTemporaryFile(prefix=os.getpid(), suffix='.wcsp', delete=False)
+        tmpfile = tempfile.NamedTemporaryFile(prefix='{}-{}'.format(os.getpid(), _thread.get_ident()), suffix='.wcsp', dir=_tmpdir, delete=False)
         wcspfilename = tmpfile.name
-        self.write(stream=tmpfile)
-        tmpfile.close()
-        cmd = '%s -s -a %s' % (_tb2path, wcspfilename)
+        with tmpfile:
+            self.write(stream=tmpfile)
+        cmd = [_tb2path, '-s'] + list(options)
+        if timeout is not None:
+            # toulbar2 only accepts an integer CPU time limit, so we
+            # additionally stop the process after the wall clock time
+            cmd.append('-timer={}'.format(max(1, int(math.ceil(timeout)))))
+        cmd.append(wcspfilename)
         logger.debug('solving WCSP...')
-        p = Popen(cmd, shell=True, stderr=PIPE, stdout=PIPE)
-        solution = None
-        while True:
-            l = p.stdout.readline().strip()
-            if not l: break
-            m = re.match(r'(\d+)\s+solution:([\s\d]+)', l) 
-            if m is not None:
-                num = m.group(1)
-                solution = list(map(int, m.group(2).strip().split()))
-                yield (num, solution)
-        p.wait()        
-        logger.debug('toulbar2 process returned {}'.format(str(p.returncode)))
+        p = Popen(cmd, stdout=PIPE, stderr=DEVNULL)
+        watchdog = None
+        if timeout is not None:
+            watchdog = threading.Timer(timeout, p.kill)
+            watchdog.start()
         try:
-            os.remove(wcspfilename)
-        except OSError:
-            logger.warning('could not remove temporary file {}'.format(wcspfilename))
-        if p.returncode != 0:
+            for l in p.stdout:
+                yield l
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+            if p.poll() is None:
+                p.kill()
+            p.stdout.close()
+            p.wait()
+            logger.debug('toulbar2 process returned {}'.format(str(p.returncode)))
+            try:
+                os.remove(wcspfilename)
+            except OSError:
+                logger.warning('could not remove temporary file {}'.format(wcspfilename))
+        if p.returncode != 0 and not (watchdog is not None and watchdog.finished.is_set()):
             raise Exception('toulbar2 returned a non-zero exit code: {}'.format(p.returncode))
+    
+    
+    def itersolutions(self, timeout=None):
+        '''
+        Iterates over all (intermediate) solutions found.
+        
+        Intermediate solutions are sound variable assignments that may not necessarily
+        be gloabally optimal. Every solution has strictly lower costs than its predecessor,
+        so the last solution is the optimum, unless the time limit has been hit.
+        
+        :param timeout:  (optional) time limit in seconds.
+        :returns:        a generator of (cost, solution) tuples, where solution is a list
+                         of variable value indices.
+        '''
+        cost = None
+        for l in self._toulbar2(timeout=timeout):
+            if l.startswith(b'New solution'):
+                cost = int(l.split()[2])
+            elif cost is not None:
+                yield cost, list(map(int, l.split()))
+                cost = None
 
 
-    def solve(self):
+    def solve(self, timeout=None, callback=None, multicore=False):
         '''
         Uses toulbar2 inference. Returns the best solution, i.e. a tuple
-        of variable assignments.
+        of variable assignments, and its costs.
+        
+        :param timeout:     (optional) time limit in seconds. If it is exceeded, the 
+                            best solution found so far is returned.
+        :param callback:    (optional) function that is called as ``callback(cost, solution)``
+                            for every intermediate solution.
+        :param multicore:   if True, independent components of the problem are solved
+                            by parallel toulbar2 processes.
         '''
-        if not is_executable(_tb2path):
-            raise Exception('toulbar2 cannot be found.')
-        # append the process id to the filename to make it "process safe"
-        tmpfile = tempfile.NamedTemporaryFile(prefix='{}-{}'.format(os.getpid(), _thread.get_ident()), suffix='.wcsp', delete=False)
-        wcspfilename = tmpfile.name
-        self.write(stream=tmpfile)
-        tmpfile.close()
-        cmd = '"%s" -s %s' % (_tb2path, wcspfilename)
-        logger.debug('solving WCSP...')
-        p = Popen(cmd, shell=True, stderr=PIPE, stdout=PIPE)
+        if multicore:
+            components = self.components()
+            if len(components) > 1:
+                return self._solve_components(components, timeout=timeout, callback=callback)
         solution = None
-        nextLineIsSolution = False
         cost = None
+        for cost, solution in self.itersolutions(timeout=timeout):
+            if callback is not None:
+                callback(cost, solution)
+        return solution, cost
+    
+    
+    def cost(self, solution):
+        '''
+        Returns the (integer) costs of the given variable assignment, or the 
+        top costs if it violates a hard constraint.
+        '''
+        self._make_integer_cost()
+        cost = 0
+        for c in self.constraints.values():
+            c_ = c.tuples.get(tuple([solution[v] for v in c.variables]), c.defcost)
+            if c_ == self.top:
+                return self.top
+            cost += c_
+        return cost
+    
+    
+    def allsolutions(self, ub=None, timeout=None):
+        '''
+        Iterates over all solutions whose costs are strictly lower than `ub`
+        in a single toulbar2 run. The solutions are not ordered by their costs.
+        
+        :param ub:         the upper bound of the costs. Defaults to the top costs.
+        :param timeout:    (optional) time limit in seconds.
+        :returns:          a generator of solutions, i.e. lists of variable value indices.
+        '''
+        self._make_integer_cost()
+        options = ['-a']
+        if ub is not None:
+            options.append('-ub={}'.format(int(ub)))
+        for l in self._toulbar2(*options, timeout=timeout):
+            if b'solution:' in l:
+                yield list(map(int, l.split(b':', 1)[1].split()))
+    
+    
+    def kbest(self, k, timeout=None):
+        '''
+        Computes the `k` best solutions of this problem.
+        
+        After the optimum has been found, all solutions below an upper bound on 
+        the costs are enumerated, where the bound is widened until at least `k` solutions
+        are found. If a bound admits more than :attr:`WCSP.KBEST_MAXSOLUTIONS` solutions, 
+        it is narrowed again by bisection.
+        
+        :param k:          the number of solutions.
+        :param timeout:    (optional) time limit in seconds for all solver runs together.
+                           If it is exceeded, the best solutions found so far are returned.
+        :returns:          a list of at most `k` (cost, solution) tuples sorted by increasing costs.
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        def timeleft():
+            return None if deadline is None else max(0., deadline - time.time())
+        solution, optimum = self.solve(timeout=timeout)
+        if solution is None:
+            return []
+        if k <= 1:
+            return [(optimum, solution)]
+        maxsolutions = max(WCSP.KBEST_MAXSOLUTIONS, 10 * k)
+        # lo: bound with less than k solutions below, hi: bound with too many solutions below
+        lo, hi = optimum, None
+        ub = optimum + 1
+        # the solutions below the last bound that has been enumerated completely
+        complete = [(-optimum, 0, solution)]
         while True:
-            l = p.stdout.readline()
-            if not l: break
-            if l.startswith(b'New solution'):
-                cost = int(l.split()[2])
-                nextLineIsSolution = True
-                continue
-            if nextLineIsSolution:
-                solution = list(map(int, l.split()))
-                nextLineIsSolution = False
-        p.wait()
-        logger.debug('toulbar2 process returned {}'.format(str(p.returncode)))
+            if timeleft() == 0:
+                logger.warning('time limit exceeded. The {} best solutions are approximate.'.format(k))
+                best = complete
+                break
+            best = []
+            count = 0
+            for s in self.allsolutions(ub=ub, timeout=timeleft()):
+                count += 1
+                item = (-self.cost(s), count, s)
+                if len(best) < k:
+                    heapq.heappush(best, item)
+                else:
+                    heapq.heappushpop(best, item)
+                if count > maxsolutions: break
+            if timeleft() == 0:
+                # toulbar2 may have been stopped before all solutions were enumerated
+                logger.warning('time limit exceeded. The {} best solutions are approximate.'.format(k))
+                seen = set([tuple(s) for _, _, s in best])
+                best = heapq.nlargest(k, best + [i for i in complete if tuple(i[2]) not in seen])
+                break
+            if count > maxsolutions:
+                if ub - lo > 1:
+                    hi = ub
+                    ub = (lo + hi) // 2
+                    continue
+                logger.warning('more than {} solutions with costs {}. The {} best solutions are approximate.'.format(maxsolutions, lo, k))
+                break
+            if count >= k or ub >= self.top:
+                break
+            complete = best
+            lo = ub
+            if hi is None:
+                ub = min(self.top, 2 * ub - optimum)
+            else:
+                ub = max(lo + 1, (lo + hi) // 2)
+        return sorted([(-c, s) for c, _, s in best], key=lambda x: x[0])
+    
+    
+    def components(self):
+        '''
+        Returns the connected components of the constraint graph of this problem.
+        
+        :returns:    a list of lists of variable indices, where no two components share
+                     a constraint.
+        '''
+        parent = list(range(len(self.domsizes)))
+        def find(v):
+            while parent[v] != v:
+                parent[v] = parent[parent[v]]
+                v = parent[v]
+            return v
+        for scope in self.constraints:
+            root = find(scope[0])
+            for v in scope[1:]:
+                r = find(v)
+                if r != root: parent[r] = root
+        components = defaultdict(list)
+        for v in range(len(self.domsizes)):
+            components[find(v)].append(v)
+        return list(components.values())
+    
+    
+    def _solve_components(self, components, timeout=None, callback=None):
+        '''
+        Solves the problem by partitioning the given components into one subproblem
+        per CPU core and solving the subproblems in parallel.
+        '''
+        self._make_integer_cost()
+        # distribute the components over the subproblems, largest first
+        ngroups = min(len(components), multiprocessing.cpu_count())
+        size = defaultdict(int)
+        for scope, c in self.constraints.items():
+            size[scope[0]] += len(c.tuples) + 1
+        comp2group = {}
+        groupsizes = [0] * ngroups
+        groups = [[] for _ in range(ngroups)]
+        for comp in sorted(components, key=lambda c: sum(size[v] for v in c), reverse=True):
+            g = groupsizes.index(min(groupsizes))
+            groups[g].extend(comp)
+            groupsizes[g] += sum(size[v] for v in comp)
+        var2group = {}
+        for g, variables in enumerate(groups):
+            for i, v in enumerate(variables):
+                var2group[v] = (g, i)
+        subproblems = [WCSP(self.name, [self.domsizes[v] for v in variables], self.top) for variables in groups]
+        for scope, c in self.constraints.items():
+            g = var2group[scope[0]][0]
+            c_ = Constraint([var2group[v][1] for v in c.variables], defcost=c.defcost)
+            c_.tuples = c.tuples
+            subproblems[g].constraints[tuple(sorted(c_.variables))] = c_
+        # the subproblems' best solutions so far
+        partial = [None] * ngroups
+        lock = threading.Lock()
+        def merge():
+            solution = [0] * len(self.domsizes)
+            for variables, (_, s) in zip(groups, partial):
+                for v, val in zip(variables, s):
+                    solution[v] = val
+            return sum([c for c, _ in partial]), solution
+        def solve(g):
+            wcsp = subproblems[g]
+            if not wcsp.constraints: # nothing to be solved
+                partial[g] = (0, [0] * len(wcsp.domsizes))
+                return True
+            def update(cost, solution):
+                with lock:
+                    partial[g] = (cost, solution)
+                    if callback is not None and None not in partial:
+                        callback(*merge())
+            return wcsp.solve(timeout=timeout, callback=update)[0] is not None
+        pool = ThreadPool(ngroups)
         try:
-            os.remove(wcspfilename)
-        except OSError:
-            logger.warning('could not remove temporary file {}'.format(wcspfilename))
-        if p.returncode != 0:
-            raise Exception('toulbar2 returned a non-zero exit code: {}'.format(p.returncode))
+            solved = pool.map(solve, list(range(ngroups)))
+        finally:
+            pool.terminate()
+        if not all(solved):
+            return None, None
+        cost, solution = merge()
         return solution, cost
 
 
@@ -432,6 +766,6 @@ class WCSP(object):
 if __name__ == '__main__':
     wcsp = WCSP()
     wcsp.read(open('/home/nyga/code/test/nqueens.wcsp', 'rb'))
-    for i, s in wcsp.itersolutions():
-        print(i, s)
+    for c, s in wcsp.itersolutions():
+        print(c, s)
     print('best solution:', wcsp.solve())
@@ -111,45 +111,35 @@ class XValFold(object):
         
 #         dbs = map(lambda db: db.copy(mln), dbs)
         
+        testdbs = []
+        gndtruths = []
         for db_ in dbs:
             # save and remove the query predicates from the evidence
             db = db_.copy()
             gndtruth = mln.ground(db)
             gndtruth.apply_cw()
             for atom, _ in db.gndatoms(querypred):
-                out('removing evidence', repr(atom))
+                logger.debug('removing evidence %s' % repr(atom))
                 del db.evidence[atom]
-            db.write()
-            stop()
-            try:
-                resultdb = MLNQuery(config=self.params.queryconf, mln=mln, method=InferenceMethods.WCSPInference, db=db, 
-                                  cw_preds=[p.name for p in mln.predicates if p.name != self.params.querypred], multicore=False).run().resultdb
+            testdbs.append(db)
+            gndtruths.append(gndtruth)
+        try:
+            results = MLNQuery(config=self.params.queryconf, mln=mln, method=InferenceMethods.WCSPInference, db=testdbs,
+                               cw_preds=[p.name for p in mln.predicates if p.name != self.params.querypred], multicore=False).runbatch()
+            for db, gndtruth, resultdict in zip(testdbs, gndtruths, results):
                 result = mln.ground(db)
-                result.set_evidence(resultdb)
+                result.set_evidence(resultdict)
                 for variable in result.variables:
                     if variable.predicate.name != querypred: continue
                     pvalue = variable.evidence_value()
-                    tvalue = variable.evidence_value()
+                    tvalue = variable.evidence_value(gndtruth.evidence)
                     prediction = [a for a, v in variable.atomvalues(pvalue) if v == 1]
                     truth = [a for a, v in variable.atomvalues(tvalue) if v == 1]
                     prediction = str(prediction[0]) if prediction else None
                     truth = str(truth[0]) if truth else None
                     self.confmat.addClassificationResult(prediction, truth)
-#                 sig2 = list(sig)
-#                 entityIdx = mln.predicates[query_pred].argdoms.index(query_dom)
-#                 for entity in db.domains[]:
-#                     sig2[entityIdx] = entity
-#                     query = '%s(%s)' % (queryPred, ','.join(sig2))
-#                     for truth in trueDB.query(query):
-#                         truth = truth.values().pop()
-#                     for pred in resultDB.query(query):
-#                         pred = pred.values().pop()
-#                     self.confMatrix.addClassificationResult(pred, truth)
-#                 for e, v in trueDB.evidence.iteritems():
-#                     if v is not None:
-#                         db.addGroundAtom('%s%s' % ('' if v is True else '!', e))
-            except:
-                logger.critical(''.join(traceback.format_exception(*sys.exc_info())))
+        except:
+            logger.critical(''.join(traceback.format_exception(*sys.exc_info())))
 
     def run(self):
         '''
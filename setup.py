@@ -110,6 +110,7 @@ setup(
         'console_scripts': [
             'mlnlearn=pracmln.mlnlearn:main',
 	        'mlnquery=pracmln.mlnquery:main',
+            'pracmln=pracmln.cli:main',
 	        'libpracmln-build=pracmln.libpracmln:createcpplibs',
             'pracmlntest=pracmln.test:main',
         ],